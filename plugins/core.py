@@ -7,7 +7,7 @@ from vacore import VACore
 def start(core:VACore):
     manifest = {
         "name": "Core plugin",
-        "version": "5.0",
+        "version": "6.5",
         "description": "Плагин с основными настройками Ирины.\nПосмотрите другие плагины, чтобы понять, какие команды можно использовать.",
 
         "options_label": {
@@ -17,8 +17,23 @@ def start(core:VACore):
 
             "isOnline": "Будут ли выполняться команды плагинов, требующие онлайн",
             # "ttsIndex": 0,
-            "useTTSCache": "Кешировать озвучку текста (требует больше места на диске, может сбоить при переключении голосов)",
+            "useTTSCache": "Кешировать озвучку текста (требует больше места на диске)",
+            "ttsCacheMaxMB": "Максимальный размер кеша озвучки в мегабайтах (старые файлы удаляются). 0 - без ограничения",
+            "hotPhrases": "Фразы, которые озвучиваются заранее при старте и хранятся в памяти (ответы reply* из опций плагинов добавляются сами)",
+            "hotPhrasesMaxItems": "Сколько частых фраз хранить в памяти уже озвученными (0 - не хранить)",
+            "ttsStreamSentences": "Озвучивать длинные ответы по предложениям: следующее готовится, пока звучит текущее (ответ начинает звучать быстрее)",
+            "ttsStreamMinChars": "С какой длины текста (в символах) озвучивать по предложениям",
+            "ttsStreamBatch": "Сколько предложений (после первого) озвучивать за один вызов TTS. Для нейросетевых движков (silero) несколько предложений за раз быстрее",
+            "ttsTemplateCache": "Ответы-шаблоны плагинов (например, 'Ставлю таймер на ...') склеивать из заранее озвученных частей - быстрее, но интонация чуть хуже",
+            "ttsTemplateCrossfadeMs": "Длина перекрестного затухания при склейке частей ответа-шаблона, мс",
+            "backgroundEngineInit": "Загружать движки (TTS, нормализатор, fuzzy processors) в фоне: команды принимаются сразу, озвучка ждет только нужный ей движок. Состояние загрузки - WEB-API /health",
+            "ttsWorkers": "Сколько отдельных процессов запустить для основного движка TTS (0 - озвучка в основном процессе). Для тяжелых движков (silero): долгая озвучка не тормозит остальное, но каждый процесс загружает свою копию модели",
+            "ttsWorkersTimeout": "Сколько секунд ждать озвучку одной фразы от процесса TTS",
             "ttsEngineId": "ID основного движка озвучки. Если что-то не работает - попробуйте сменить на pyttsx, elevenlabs, vosk, vsegpt (если используете) или silero_v3 (последний требует полной установки из install - т.е. c torch)",
+            "ttsEngineChain": "Запасные движки TTS по порядку (например, [\"silero_v4\"] при основном silero_rest). Если основной не озвучил фразу за свое обычное время (p95), текст параллельно отдается следующему - берется тот, кто успеет первым. Часто сбоящий движок временно уходит в конец цепочки",
+            "ttsHedgeQuantile": "Квантиль задержек движка, после которого подключается следующий движок цепочки (0.95 - p95)",
+            "ttsHedgeMinBudget": "Минимальное время ожидания движка цепочки, сек",
+            "ttsHedgeDefaultBudget": "Время ожидания движка цепочки, пока по нему нет статистики, сек",
             "ttsEngineId2": "ID дополнительного движка озвучки. Всегда озвучивает результат на той машине, где запущена Ирина (без веб-интерфейса)",  # двиг для прямой озвучки на сервере. Если пуст - используется ttsEngineId
             "playWavEngineId": "ID движка воспроизведения аудио. Если есть проблемы - попробуйте сменить на audioplayer или sounddevice",
             "linguaFrancaLang": "Язык для библиотеки lingua-franca конвертирования чисел",  # язык для библиотеки lingua-franca конвертирования чисел
@@ -34,6 +49,14 @@ def start(core:VACore):
 
             "tempDir": "адрес директории для временных файлов",
             "fuzzyThreshold": "(ПРО) Порог уверенности при использовании нечеткого распознавания команд",
+            "fuzzyProcessorTimeout": "(ПРО) Сколько секунд ждать результата каждого обработчика нечеткого распознавания (все запускаются параллельно, берется лучший результат)",
+            "fuzzyProcessorTimeouts": "(ПРО) Индивидуальные таймауты для обработчиков нечеткого распознавания, словарь {id: секунды}",
+            "fuzzyMaxWorkers": "(ПРО) Максимальное число потоков для параллельного запуска обработчиков нечеткого распознавания",
+            "fuzzyCacheSize": "(ПРО) Сколько результатов нечеткого распознавания хранить в кеше (0 - не кешировать)",
+            "asyncMaxWorkers": "(ПРО) WEB-API: число потоков, в которых выполняются команды плагинов и TTS",
+            "asyncMaxInflight": "(ПРО) WEB-API: сколько команд может выполняться или ждать выполнения одновременно",
+            "speculativeResolve": "(ПРО) Искать команду заранее, по промежуточным результатам распознавания VOSK (быстрее реакция, чуть больше нагрузка)",
+            "timersJournal": "Сохранять таймеры на диск (в директорию временных файлов), чтобы они сработали и после перезапуска Ирины",
 
             "voiceAssNameRunCmd": "Словарь сопоставлений. При нахождении имени помощника, добавляет префикс к распознанной фразе",
 
@@ -56,7 +79,22 @@ def start(core:VACore):
             "isOnline": True,
             #"ttsIndex": 0,
             "useTTSCache": False,
+            "ttsCacheMaxMB": 500,
+            "hotPhrases": ["Запускаю!"],
+            "hotPhrasesMaxItems": 64,
+            "ttsStreamSentences": False,
+            "ttsStreamMinChars": 120,
+            "ttsStreamBatch": 2,
+            "ttsTemplateCache": False,
+            "ttsTemplateCrossfadeMs": 15,
+            "backgroundEngineInit": True,
+            "ttsWorkers": 0,
+            "ttsWorkersTimeout": 60,
             "ttsEngineId": "pyttsx",
+            "ttsEngineChain": [],
+            "ttsHedgeQuantile": 0.95,
+            "ttsHedgeMinBudget": 0.5,
+            "ttsHedgeDefaultBudget": 3.0,
             "ttsEngineId2": "", # двиг для прямой озвучки на сервере. Если пуст - используется ttsEngineId
             "playWavEngineId": "audioplayer",
             "linguaFrancaLang": "ru", # язык для библиотеки lingua-franca конвертирования чисел
@@ -72,6 +110,14 @@ def start(core:VACore):
 
             "tempDir": "temp",
             "fuzzyThreshold": 0.5,
+            "fuzzyProcessorTimeout": 2.0,
+            "fuzzyProcessorTimeouts": {},
+            "fuzzyMaxWorkers": 4,
+            "fuzzyCacheSize": 256,
+            "asyncMaxWorkers": 4,
+            "asyncMaxInflight": 16,
+            "speculativeResolve": False,
+            "timersJournal": True,
 
             "voiceAssNameRunCmd": {
                 "альбина": "чатгпт"
@@ -122,17 +168,40 @@ def start_with_options(core:VACore, manifest:dict):
     core.contextDefaultDuration = options["contextDefaultDuration"]
     core.contextRemoteWaitForCall = options["contextRemoteWaitForCall"]
 
+    core.fuzzyProcessorTimeout = options["fuzzyProcessorTimeout"]
+    core.fuzzyProcessorTimeouts = options["fuzzyProcessorTimeouts"]
+    core.fuzzyMaxWorkers = options["fuzzyMaxWorkers"]
+    core.fuzzyCacheSize = options["fuzzyCacheSize"]
+
+    core.asyncMaxWorkers = options["asyncMaxWorkers"]
+    core.asyncMaxInflight = options["asyncMaxInflight"]
+    core.speculativeResolve = options["speculativeResolve"]
+    core.timersJournal = options["timersJournal"]
+
     core.tmpdir = options["tempDir"]
     import os
     if not os.path.exists(core.tmpdir):
         os.mkdir(core.tmpdir)
 
     core.useTTSCache = options["useTTSCache"]
+    core.ttsCacheMaxMB = options["ttsCacheMaxMB"]
+    core.hotPhrases = options["hotPhrases"]
+    core.hotPhrasesMaxItems = options["hotPhrasesMaxItems"]
+    core.ttsStreamSentences = options["ttsStreamSentences"]
+    core.ttsStreamMinChars = options["ttsStreamMinChars"]
+    core.ttsStreamBatch = options["ttsStreamBatch"]
+    core.ttsTemplateCache = options["ttsTemplateCache"]
+    core.ttsTemplateCrossfadeMs = options["ttsTemplateCrossfadeMs"]
+    core.backgroundEngineInit = options["backgroundEngineInit"]
+    core.ttsEngineChain = options["ttsEngineChain"]
+    core.ttsHedgeQuantile = options["ttsHedgeQuantile"]
+    core.ttsHedgeMinBudget = options["ttsHedgeMinBudget"]
+    core.ttsHedgeDefaultBudget = options["ttsHedgeDefaultBudget"]
+    core.ttsWorkers = options["ttsWorkers"]
+    core.ttsWorkersTimeout = options["ttsWorkersTimeout"]
     core.tts_cache_dir = "tts_cache"
     if not os.path.exists(core.tts_cache_dir):
         os.mkdir(core.tts_cache_dir)
-    if not os.path.exists(core.tts_cache_dir+"/"+core.ttsEngineId):
-        os.mkdir(core.tts_cache_dir+"/"+core.ttsEngineId)
 
 
 
@@ -62,7 +62,7 @@ modname = os.path.basename(__file__)[:-3] # calculating modname
 def start(core:VACore):
     manifest = {
         "name": "Болталка с ChatGPT с сохранением контекста через Vsegpt.ru или другой OpenAI сервер",
-        "version": "3.2",
+        "version": "3.3",
         "require_online": True,
         "description": "После указания apiKey позволяет вести диалог с ChatGPT.\n"
                        "Голосовая команда: поболтаем|поговорим (для обычной модели с чатом), справка (для точных фактов)",
@@ -96,8 +96,8 @@ def start(core:VACore):
         },
 
         "tts": {
-            "vsegpt": (init, None, towavfile)  # первая функция инициализации, вторая - говорить, третья - в wav file
-            # если вторая - None, то используется 3-я с проигрыванием файла
+            "vsegpt": (init, None, towavfile, None, tostream)  # первая функция инициализации, вторая - говорить, третья - в wav file
+            # если вторая - None, то используется 3-я с проигрыванием файла; пятая - потоком (для форматов wav и pcm)
         }
     }
     return manifest
@@ -219,7 +219,37 @@ def towavfile(core:VACore, text_to_speech:str,wavfile:str):
         return
 
 
-    import requests
+    from utils.http_pool import stream_to_file
+
+    # общее keep-alive соединение, ответ пишется в файл по мере загрузки
+    try:
+        stream_to_file("POST", options["apiBaseUrl"]+"/audio/speech", wavfile, **speech_request(options, text_to_speech))
+    except Exception as e:
+        print("Не могу связаться с сервером", e)
+
+def tostream(core:VACore, text_to_speech:str):
+    # потоком - только несжатые форматы (tts_response_format: wav или pcm), проигрывание начинается до конца загрузки
+    options = core.plugin_options(modname)
+    response_format = options["tts_response_format"]
+    if options["apiKey"] == "" or response_format not in ("wav", "pcm"):
+        return None
+
+    from utils.http_pool import request_stream, iter_body
+    from utils.audio import pcm_stream_from_wav, pcm_stream_from_raw
+    try:
+        body = iter_body(request_stream("POST", options["apiBaseUrl"]+"/audio/speech", **speech_request(options, text_to_speech)))
+    except Exception as e:
+        print("Не могу связаться с сервером", e)
+        return None
+
+    if response_format == "pcm":
+        return pcm_stream_from_raw(body, 24000), 24000 # pcm в OpenAI API - 24 кГц, 16 бит, моно
+    res = pcm_stream_from_wav(body)
+    if res is None:
+        body.close()
+    return res
+
+def speech_request(options:dict, text_to_speech:str) -> dict:
     import json
 
     headers = {
@@ -231,19 +261,12 @@ def towavfile(core:VACore, text_to_speech:str,wavfile:str):
     if str(options["apiBaseUrl"]).startswith("https://api.vsegpt.ru"):
         headers["X-Title"] = "Irene VA"
 
-    response = requests.post(
-        url=options["apiBaseUrl"]+"/audio/speech",
-        headers=headers,
-        data=json.dumps({
+    return {
+        "headers": headers,
+        "data": json.dumps({
             "model": options['tts_model'],
             "voice": options['tts_voice'],
             "input": text_to_speech,
             "response_format": options['tts_response_format'],
-        }, ensure_ascii=True)
-    )
-
-    if response.status_code == 200:
-        with open(wavfile, "wb") as wavfile:
-            wavfile.write(response.content)
-    else:
-        print("Не могу связаться с сервером", response.status_code, response.text)
\ No newline at end of file
+        }, ensure_ascii=True),
+    }
\ No newline at end of file
@@ -4,12 +4,13 @@
 import subprocess
 import requests
 #from voiceassmain import play_voice_assistant_speech
-from vacore import VACore
+from vacore import VACore, ContextIndex
 
 
 multPath = ""
 serialPath = ""
 options = {}
+mult_index:ContextIndex = None # название мультика -> файл; строится один раз, дальше только обновляется
 
 # функция на старте
 def start(core:VACore):
@@ -100,18 +101,7 @@ def play_mult(core:VACore, phrase: str):
         return
 
     #core.play_voice_assistant_speech("Ищу мультфильм "+find)
-    mult_files= mult_list()
-    name_dict = {}
-    #f_list = []
-    for f in mult_files:
-        name = str(f)[:-4].lower().replace(".","").replace(",","")
-        name_dict[name] = f
-        # if name == phrase:
-        #     print("Мульт ",f)
-        #     #subprocess.Popen([core.mpcHcPath, multPath+"\\"+f])
-        #     play_mult_direct(core, f)
-        #     core.say("Запускаю!")
-        #     return
+    name_dict = update_mult_index(core)
 
     res = core.find_best_cmd_with_fuzzy(phrase,name_dict,False,0.7)
     if res is not None:
@@ -128,6 +118,32 @@ def play_mult(core:VACore, phrase: str):
     core.say("Не нашла. Пожалуйста, повтори только название.")
     core.context_set(play_mult)
 
+def update_mult_index(core:VACore) -> ContextIndex:
+    # индекс строится один раз; при изменении папки обновляются только добавленные/удаленные файлы
+    global mult_index
+    mult_files = mult_list()
+    name_dict = {}
+    for f in mult_files:
+        name = str(f)[:-4].lower().replace(".","").replace(",","")
+        name_dict[name] = f
+
+    if mult_index is None:
+        mult_index = ContextIndex(core, name_dict)
+        return mult_index
+
+    is_changed = False
+    for name in [name for name in mult_index.keys() if name not in name_dict]:
+        del mult_index[name]
+        is_changed = True
+    for name in name_dict.keys():
+        if mult_index.get(name) != name_dict[name]:
+            mult_index[name] = name_dict[name]
+            is_changed = True
+
+    if is_changed:
+        mult_index.prepare()
+    return mult_index
+
 def play_mult_direct(core:VACore, f:str):
     if options["player"] == "mpc-hc":
         subprocess.Popen([core.mpcHcPath, multPath + "\\" + f])
@@ -11,11 +11,11 @@ modname = os.path.basename(__file__)[:-3] # calculating modname
 def start(core:VACore):
     manifest = {
         "name": "PlayWav through simpleaudio",
-        "version": "1.0",
+        "version": "1.1",
         "require_online": False,
 
         "playwav": {
-            "simpleaudio": (init,playwav) # первая функция инициализации, вторая - проиграть wav-файл
+            "simpleaudio": (init,playwav,playbuffer) # первая функция инициализации, вторая - проиграть wav-файл, третья - проиграть звук из памяти
         }
     }
     return manifest
@@ -34,3 +34,11 @@ def playwav(core:VACore, wavfile:str):
     play_obj.wait_done()
 
     return
+
+def playbuffer(core:VACore, data_set, fsample:int):
+    import numpy
+    import simpleaudio as sa
+    channels = 1 if data_set.ndim == 1 else data_set.shape[1]
+    pcm16 = (numpy.clip(data_set, -1.0, 1.0) * 32767).astype(numpy.int16)
+    play_obj = sa.play_buffer(pcm16.tobytes(), channels, 2, int(fsample))
+    play_obj.wait_done()
@@ -2,6 +2,8 @@
 # author: Vladislav Janvarev
 
 import os
+from collections import deque, OrderedDict
+from threading import Lock, Event
 
 from vacore import VACore
 import sounddevice as sound_device
@@ -9,15 +11,28 @@ import soundfile as sound_file
 
 modname = os.path.basename(__file__)[:-3] # calculating modname
 
+_player = None # постоянный поток вывода, создается при первом проигрывании
+_files = OrderedDict() # декодированные файлы (путь -> (mtime, данные для потока)), см. cacheDirs
+_files_lock = Lock() # и создание _player
+
 # функция на старте
 def start(core:VACore):
     manifest = {
         "name": "PlayWav through sounddevice",
-        "version": "1.0",
+        "version": "1.4",
         "require_online": False,
 
+        "default_options": {
+            "persistentStream": True, # один поток вывода на все время работы: звуки идут друг за другом без пауз и без открытия устройства
+                                      # False - как раньше, устройство открывается на каждый звук
+            "sampleRate": 0, # частота потока; 0 - частота первого звука. Звуки с другой частотой пересчитываются
+            "cacheDirs": ["media"], # файлы из этих папок держим в памяти уже декодированными (сигнал таймера и т.п.)
+            "cacheMaxFiles": 16,
+        },
+
         "playwav": {
-            "sounddevice": (init,playwav) # первая функция инициализации, вторая - проиграть wav-файл
+            "sounddevice": (init,playwav,playbuffer,playstream) # первая функция инициализации, вторая - проиграть wav-файл, третья - проиграть звук из памяти
+                                                                # четвертая - проиграть поток кусков (звук еще загружается)
         }
     }
     return manifest
@@ -33,8 +48,21 @@ def playwav(core:VACore, wavfile:str):
     filename = os.path.dirname(__file__)+"/../"+wavfile
 
     #filename = 'timer/Sounds/Loud beep.wav'
+    options = core.plugin_options(modname)
+    if options["persistentStream"] and _is_cached_file(options, wavfile):
+        data_set = _read_cached(core, filename)
+        _get_player(core, data_set, None).play(data_set, None)
+        return
+
     # now, Extract the data and sampling rate from file
     data_set, fsample = sound_file.read(filename, dtype = 'float32')
+    playbuffer(core, data_set, fsample)
+
+def playbuffer(core:VACore, data_set, fsample:int):
+    options = core.plugin_options(modname)
+    if options["persistentStream"]:
+        _get_player(core, data_set, fsample).play(data_set, fsample)
+        return
 
     # Этот фикс позволяет убрать проглатывания из концов фраз
     # Просто добавляет 0 в конце проигрываемому файлу
@@ -43,7 +71,7 @@ def playwav(core:VACore, wavfile:str):
     # for i in range(5000):
     #     zeros.append(0.0)
     import numpy
-    zeros = numpy.zeros((5000,)) # fix by modos189
+    zeros = numpy.zeros((5000,) + data_set.shape[1:], dtype=data_set.dtype) # fix by modos189
     data_set_new = numpy.concatenate((data_set,zeros))
     # end fix
 
@@ -52,3 +80,218 @@ def playwav(core:VACore, wavfile:str):
     status = sound_device.wait()
     return
 
+def playstream(core:VACore, chunks, fsample:int):
+    # куски numpy float32 по мере прихода; перед стартом копим немного звука, чтобы не было провалов при медленной сети
+    import numpy
+    options = core.plugin_options(modname)
+    prebuffer = []
+    prebuffer_len = 0
+    player = None
+    clip = None
+    stream = None
+    try:
+        for chunk in chunks:
+            chunk = numpy.ascontiguousarray(chunk.reshape(len(chunk), -1), dtype=numpy.float32)
+            if clip is None and stream is None:
+                prebuffer.append(chunk)
+                prebuffer_len += len(chunk)
+                if prebuffer_len < fsample * 0.2:
+                    continue
+                chunk = numpy.concatenate(prebuffer)
+                if options["persistentStream"]:
+                    player = _get_player(core, chunk, fsample)
+                    clip = player.open(fsample) # место в очереди - весь клип, а не отдельные куски
+                else:
+                    stream = _start_stream(fsample, chunk.shape[1])
+            if clip is not None:
+                player.write(clip, chunk)
+            else:
+                stream.write(chunk)
+
+        if clip is None and stream is None: # все уместилось в предбуфер
+            if len(prebuffer) == 0:
+                return
+            data_set = numpy.concatenate(prebuffer)
+            if options["persistentStream"]:
+                _get_player(core, data_set, fsample).play(data_set, fsample)
+                return
+            stream = _start_stream(fsample, data_set.shape[1])
+            stream.write(data_set)
+        if clip is not None:
+            player.close(clip)
+            clip.done.wait()
+            return
+        # тот же фикс проглатывания конца фразы, что и в playbuffer
+        stream.write(numpy.zeros((5000, stream.channels), dtype=numpy.float32))
+    finally:
+        if clip is not None and not clip.finished: # обрыв загрузки - освобождаем очередь
+            player.close(clip)
+        if stream is not None:
+            stream.stop()
+            stream.close()
+
+def _start_stream(fsample:int, channels:int):
+    stream = sound_device.OutputStream(samplerate=fsample, channels=channels, dtype="float32")
+    stream.start()
+    return stream
+
+
+# ------- постоянный поток вывода ----------
+def _get_player(core:VACore, data_set, fsample):
+    # поток открывается один раз - с частотой из опций или первого звука
+    global _player
+    with _files_lock:
+        if _player is None:
+            options = core.plugin_options(modname)
+            samplerate = options["sampleRate"] or fsample or 48000
+            _player = _Player(int(samplerate), 1 if data_set.ndim == 1 else data_set.shape[1])
+        return _player
+
+def _is_cached_file(options:dict, wavfile:str) -> bool:
+    path = os.path.normpath(wavfile).replace("\\", "/")
+    return any(path.startswith(os.path.normpath(d).replace("\\", "/") + "/") for d in options["cacheDirs"])
+
+def _read_cached(core:VACore, filename:str):
+    # данные сразу в формате потока - при повторном проигрывании ни чтения, ни пересчета частоты
+    options = core.plugin_options(modname)
+    mtime = os.path.getmtime(filename)
+    with _files_lock:
+        item = _files.get(filename)
+        if item is not None and item[0] == mtime:
+            _files.move_to_end(filename)
+            return item[1]
+    data_set, fsample = sound_file.read(filename, dtype = 'float32')
+    data_set = _get_player(core, data_set, fsample).convert(data_set, fsample)
+    with _files_lock:
+        _files[filename] = (mtime, data_set)
+        while len(_files) > options["cacheMaxFiles"]:
+            _files.popitem(last=False)
+    return data_set
+
+
+class _Clip:
+    # место в очереди проигрывания: куски звука добавляются, пока клип не закрыт (close), другие звуки ждут его окончания
+    __slots__ = ("chunks", "pos", "finished", "done", "resampler")
+
+    def __init__(self, resampler):
+        self.chunks = deque()
+        self.pos = 0 # позиция в первом куске
+        self.finished = False
+        self.done = Event() # последний сэмпл ушел в устройство
+        self.resampler = resampler
+
+
+class _Player:
+    # очередь клипов, которую забирает callback потока вывода. Когда клипы кончаются - поток выводит тишину,
+    # а не останавливается: следующий звук начинается сразу, и конец предыдущего не обрезается (поэтому нули в конце не нужны)
+
+    def __init__(self, samplerate:int, channels:int):
+        self.samplerate = samplerate
+        self.channels = channels
+        self._queue = deque() # _Clip
+        self._lock = Lock()
+        self._stream = None
+        self._stream_lock = Lock() # открытие потока - не под self._lock, его берет callback
+
+    def convert(self, data_set, fsample):
+        # целый звук к частоте и числу каналов потока; fsample None - данные уже в формате потока
+        from utils.audio import resample
+        data_set = self._channels(data_set)
+        if fsample is not None and fsample != self.samplerate:
+            data_set = resample(data_set, fsample, self.samplerate)
+        return _contiguous(data_set)
+
+    def _channels(self, data_set):
+        import numpy
+        data_set = numpy.asarray(data_set, dtype=numpy.float32)
+        if data_set.ndim == 1:
+            data_set = data_set.reshape(-1, 1)
+        if data_set.shape[1] != self.channels:
+            data_set = data_set.mean(axis=1, keepdims=True)
+            if self.channels > 1:
+                data_set = numpy.repeat(data_set, self.channels, axis=1)
+        return data_set
+
+    def open(self, fsample) -> _Clip:
+        # занимает место в очереди; куски с другой частотой пересчитываются с сохранением состояния между кусками
+        from utils.audio import StreamResampler
+        clip = _Clip(StreamResampler(fsample, self.samplerate) if fsample is not None and fsample != self.samplerate else None)
+        with self._lock:
+            self._queue.append(clip)
+        try:
+            self._ensure_stream()
+        except Exception:
+            with self._lock:
+                self._queue.remove(clip)
+            clip.done.set()
+            raise
+        return clip
+
+    def write(self, clip:_Clip, data_set):
+        data_set = self._channels(data_set)
+        if clip.resampler is not None:
+            data_set = clip.resampler.process(data_set)
+        self._append(clip, data_set)
+
+    def close(self, clip:_Clip):
+        # обязательно после open (в том числе при ошибке) - иначе очередь будет ждать этот клип
+        if clip.resampler is not None:
+            self._append(clip, clip.resampler.flush())
+        with self._lock:
+            clip.finished = True
+
+    def _append(self, clip:_Clip, data_set):
+        if len(data_set) > 0:
+            data_set = _contiguous(data_set)
+            with self._lock:
+                clip.chunks.append(data_set)
+
+    def play(self, data_set, fsample):
+        # ждем, пока звук целиком уйдет в устройство: следующий звук, поставленный сразу после, пойдет встык
+        clip = self.open(fsample)
+        try:
+            self.write(clip, data_set)
+        finally:
+            self.close(clip)
+        clip.done.wait()
+
+    def _ensure_stream(self):
+        with self._stream_lock:
+            if self._stream is not None and self._stream.active:
+                return
+            if self._stream is not None: # устройство пропало или поток упал - открываем заново
+                try:
+                    self._stream.close()
+                except Exception:
+                    pass
+            self._stream = sound_device.OutputStream(samplerate=self.samplerate, channels=self.channels,
+                                                     dtype="float32", callback=self._callback)
+            self._stream.start()
+
+    def _callback(self, outdata, frames, time, status):
+        # поток PortAudio: только копирование, без выделения памяти
+        pos = 0
+        with self._lock:
+            while pos < frames and len(self._queue) > 0:
+                clip = self._queue[0]
+                if len(clip.chunks) == 0:
+                    if not clip.finished:
+                        break # клип еще загружается - ждем его, следующие звуки не вклиниваются
+                    self._queue.popleft()
+                    clip.done.set()
+                    continue
+                data_set = clip.chunks[0]
+                n = min(frames - pos, len(data_set) - clip.pos)
+                outdata[pos:pos+n] = data_set[clip.pos:clip.pos+n]
+                pos += n
+                clip.pos += n
+                if clip.pos >= len(data_set):
+                    clip.chunks.popleft()
+                    clip.pos = 0
+        if pos < frames:
+            outdata[pos:] = 0
+
+
+def _contiguous(data_set):
+    import numpy
+    return numpy.ascontiguousarray(data_set, dtype=numpy.float32)
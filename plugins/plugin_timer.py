@@ -19,7 +19,7 @@ modname = os.path.basename(__file__)[:-3] # calculating modname
 def start(core:VACore):
     manifest = {
         "name": "Таймер",
-        "version": "1.2",
+        "version": "1.4",
         "require_online": False,
 
         "description": "Плагин таймера\n"
@@ -29,11 +29,13 @@ def start(core:VACore):
         "options_label": {
             "wavRepeatTimes": "число повторений WAV-файла сигнала таймера",
             "wavPath": "путь к звуковому файлу",
+            "wavPause": "пауза между повторами сигнала, сек (0 - встык)",
         },
 
         "default_options": {
             "wavRepeatTimes": 1, # число повторений WAV-файла таймера
             "wavPath": 'media/timer.wav', # путь к звуковому файлу
+            "wavPause": 0.2, # пауза между повторами сигнала, сек
         },
 
         "commands": {
@@ -122,16 +124,17 @@ def set_timer(core:VACore, phrase:str):
 
 def set_timer_real(core:VACore, num:int, txt:str):
     core.set_timer(num,(after_timer, txt))
-    core.play_voice_assistant_speech("Ставлю таймер на "+txt)
+    core.say_template("Ставлю таймер на {0}", txt)
 
 def after_timer(core:VACore, txt:str):
     options = core.plugin_options(modname)
 
     for i in range(options["wavRepeatTimes"]):
         core.play_wav(options["wavPath"])
-        time.sleep(0.2)
+        if options["wavPause"] > 0:
+            time.sleep(options["wavPause"])
 
-    core.play_voice_assistant_speech(txt+" прошло")
+    core.say_template("{0} прошло", txt)
     #core.play_voice_assistant_speech("БИП! БИП! БИП! "+txt+" прошло")
 
 if __name__ == "__main__":
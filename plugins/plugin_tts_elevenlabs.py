@@ -8,17 +8,21 @@ from vacore import VACore
 
 modname = os.path.basename(__file__)[:-3] # calculating modname
 
+_client = None # клиент создается один раз - соединение с сервером переиспользуется
+_client_key = None
+
 # функция на старте
 def start(core:VACore):
     manifest = {
         "name": "TTS Elevenlabs",
-        "version": "1.0",
+        "version": "1.1",
         "require_online": True,
 
         "default_options": {
             "speaker": "Bella",
             "model": "eleven_multilingual_v2",
             "api_key": "", # not required
+            "timeout": 30, # сек
         },
 
         "tts": {
@@ -35,30 +39,43 @@ def init(core:VACore):
     import elevenlabs
 
 
+def get_client(core:VACore):
+    global _client, _client_key
+    options = core.plugin_options(modname)
+    api_key = options["api_key"]
+    if _client is None or _client_key != api_key:
+        from elevenlabs.client import ElevenLabs
+        if api_key == "":
+            _client = ElevenLabs(timeout=options["timeout"])
+        else:
+            _client = ElevenLabs(
+                api_key=api_key,
+                timeout=options["timeout"]
+            )
+        _client_key = api_key
+    return _client
+
 def towavfile(core:VACore, text_to_speech:str, wavfile:str):
 
 
     options = core.plugin_options(modname)
     speaker = options["speaker"]
     model = options["model"]
-    api_key = options["api_key"]
-
-    from elevenlabs.client import ElevenLabs
-    from elevenlabs import save
-
-
-    el_client:ElevenLabs = None
-    if api_key == "":
-        el_client = ElevenLabs()
-    else:
-        el_client = ElevenLabs(
-            api_key=api_key
-        )
 
-    audio = el_client.generate(
+    audio = get_client(core).generate(
         text=text_to_speech,
         voice=speaker,
         model=model,
     )
-    # рендерим wav (здесь это будет MP3)
-    save(audio,wavfile)
+    # рендерим wav (здесь это будет MP3); куски пишем по мере прихода
+    try:
+        with open(wavfile, "wb") as f:
+            if isinstance(audio, bytes):
+                f.write(audio)
+            else:
+                for chunk in audio:
+                    f.write(chunk)
+    except Exception:
+        if os.path.exists(wavfile): # недокачанный файл не должен попасть в кеш
+            os.unlink(wavfile)
+        raise
@@ -20,12 +20,13 @@ modname = os.path.basename(__file__)[:-3] # calculating modname
 def start(core:VACore):
     manifest = {
         "name": "TTS silero V3",
-        "version": "2.1",
+        "version": "2.3",
         "require_online": False,
 
         "default_options": {
             "speaker": "xenia",
-            "threads": 4,
+            "threads": 4, # потоки внутри операций (intra-op)
+            "interop_threads": 1, # потоки между операциями (inter-op), меняется только до первого запуска модели
             "sample_rate": 48000,
             "put_accent": True,
             "put_yo": True,
@@ -37,7 +38,7 @@ def start(core:VACore):
         },
 
         "tts": {
-            "silero_v3": (init,None,towavfile) # первая функция инициализации, вторая - говорить
+            "silero_v3": (init,None,towavfile,tobuffer) # первая функция инициализации, вторая - говорить, третья - в wav file, четвертая - в память (numpy)
         }
     }
     return manifest
@@ -55,6 +56,10 @@ def init(core:VACore):
     
     device = torch.device('cpu')
     torch.set_num_threads(options["threads"])
+    try:
+        torch.set_num_interop_threads(options["interop_threads"])
+    except RuntimeError: # torch уже запускал параллельные операции - значение не поменять
+        print(f"Silero TTS v3: Не удалось установить interop_threads, текущее значение: {torch.get_num_interop_threads()}")
     local_file = 'silero_model.pt'
 
     if not os.path.isfile(local_file):
@@ -70,10 +75,10 @@ def init(core:VACore):
     print(f"Silero TTS v3: Доступные голоса: {core.model.speakers}")
     print(f"Silero TTS v3: Текущий голос: {options['speaker']}")
     print(f"Silero TTS v3: Частота дискретизации: {options['sample_rate']}Hz")
-    print(f"Silero TTS v3: Количество потоков: {options['threads']}")
+    print(f"Silero TTS v3: Количество потоков: {options['threads']} (inter-op: {torch.get_num_interop_threads()})")
 
 
-def towavfile(core:VACore, text_to_speech:str, wavfile:str):
+def tobuffer(core:VACore, text_to_speech:str):
     # Улучшенная обработка текста для более естественной речи
     text_to_speech = text_to_speech.replace("…","...")
     text_to_speech = text_to_speech.replace("—","-")
@@ -106,16 +111,26 @@ def towavfile(core:VACore, text_to_speech:str, wavfile:str):
 
     print(f"Silero TTS v3: Генерация аудио с голосом '{speaker}', частота {options['sample_rate']}Hz")
 
-    # Рендерим wav с улучшенными параметрами
-    path = core.model.save_wav(text=text_to_speech,
-                               speaker=speaker,
-                               put_accent=options["put_accent"],
-                               put_yo=options["put_yo"],
-                               sample_rate=options["sample_rate"])
-
-    # Перемещаем wav на новое место
-    if os.path.exists(wavfile):
-        os.unlink(wavfile)
-    os.rename(path,wavfile)
-    
-    print(f"Silero TTS v3: Аудио сохранено в {wavfile}")
\ No newline at end of file
+    import torch
+
+    # озвучка идет из потоков ядра; при сборке torch с OpenMP число потоков в них может быть свое
+    if torch.get_num_threads() != options["threads"]:
+        torch.set_num_threads(options["threads"])
+
+    # Рендерим в память, без временного файла; inference_mode - без лишнего учета градиентов
+    with torch.inference_mode():
+        audio = core.model.apply_tts(text=text_to_speech,
+                                     speaker=speaker,
+                                     put_accent=options["put_accent"],
+                                     put_yo=options["put_yo"],
+                                     sample_rate=options["sample_rate"])
+    return audio.numpy(), options["sample_rate"]
+
+def towavfile(core:VACore, text_to_speech:str, wavfile:str):
+    from utils.audio import pcm_to_wav_bytes
+
+    data, sample_rate = tobuffer(core, text_to_speech)
+    with open(wavfile, "wb") as f:
+        f.write(pcm_to_wav_bytes(data, sample_rate))
+
+    print(f"Silero TTS v3: Аудио сохранено в {wavfile}")
@@ -16,7 +16,7 @@ logger = logging.getLogger(__name__)
 def start(core:VACore):
     manifest = {
         "name": "TTS vosk",
-        "version": "1.4",
+        "version": "1.5",
         "require_online": False,
 
         "description": "TTS через VOSK\n"
@@ -30,8 +30,9 @@ def start(core:VACore):
         },
 
         "tts": {
-            "vosk": (init,None,towavfile) # первая функция инициализации, вторая - говорить, третья - в wav file
+            "vosk": (init,None,towavfile,tobuffer) # первая функция инициализации, вторая - говорить, третья - в wav file
                                          # если вторая - None, то используется 3-я с проигрыванием файла
+                                         # четвертая - в память (numpy), тогда проигрывается без файла
         }
     }
     return manifest
@@ -81,3 +82,9 @@ def towavfile(core:VACore, text_to_speech:str,wavfile:str):
     """
     options = core.plugin_options(modname)
     core.ttsSynth.synth(core.normalize(text_to_speech),wavfile,speaker_id=options['speakerId'])
+
+
+def tobuffer(core:VACore, text_to_speech:str):
+    options = core.plugin_options(modname)
+    audio = core.ttsSynth.synth_audio(core.normalize(text_to_speech),speaker_id=options['speakerId'])
+    return audio.astype("float32") / 32768.0, core.ttsModel.config["audio"]["sample_rate"]
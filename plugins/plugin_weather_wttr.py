@@ -15,7 +15,7 @@ modname = os.path.basename(__file__)[:-3] # calculating modname
 def start(core: VACore):
     manifest = {
         'name': 'Погода (wttr.in)',
-        'version': '1.1',
+        'version': '1.2',
         'require_online': True,
         'location':'Moscow',
         "default_options": {
@@ -57,24 +57,33 @@ def compute_suffix(value: str, variants: list):
     return suffix
 
 
+# шаблоны прогноза: постоянные части озвучиваются один раз (core.say_template), подставляются только значения
+FORECAST_TEMPLATE = 'Температура {temp}, Ощущается как {temp_feel}, Влажность {humidity}, Давление - {pressure} ртутного столба, Ветер {wind_speed} в час.'
+FORECAST_TEMPLATE_SHORT = 'Температура {temp}, Ощущается как {temp_feel}, Ветер {wind_speed} в секунду.'
+
+# значения для шаблона прогноза погоды на основании переданных данныхъ о температуре, влажности, давлении и скорости ветра
+def forecast_slots(temp: str, temp_feel: str, humidity: str, pressure: str, wind_speed: str):
+    return {
+        'temp': temp + ' ' + compute_suffix(temp, ['градусов', 'градус', 'градуса']),
+        'temp_feel': temp_feel + ' ' + compute_suffix(temp_feel, ['градусов', 'градус', 'градуса']),
+        'humidity': humidity + ' ' + compute_suffix(humidity, ['процентов', 'процент', 'процента']),
+        'pressure': pressure + ' ' + compute_suffix(pressure, ['миллиметров', 'миллиметр', 'миллиметра']),
+        'wind_speed': wind_speed + ' ' + compute_suffix(wind_speed, ['километров', 'километр', 'километра']),
+    }
+
+def forecast_slots_short(temp: str, temp_feel: str, wind_speed: str):
+    return {
+        'temp': temp + ' ' + compute_suffix(temp, ['градусов', 'градус', 'градуса']),
+        'temp_feel': temp_feel + ' ' + compute_suffix(temp_feel, ['градусов', 'градус', 'градуса']),
+        'wind_speed': wind_speed + ' ' + compute_suffix(wind_speed, ['метров', 'метр', 'метра']),
+    }
+
 # текст прогноза погоды на основании переданных данныхъ о температуре, влажности, давлении и скорости ветра
 def forecast_text(temp: str, temp_feel: str, humidity: str, pressure: str, wind_speed: str):
-    text = 'Температура {0} {1}, Ощущается как {2} {3}, Влажность {4} {5}, Давление - {6} {7} ртутного столба, Ветер {8} {9} в час.'.format(
-        temp, compute_suffix(temp, ['градусов', 'градус', 'градуса']),
-		temp_feel, compute_suffix(temp_feel, ['градусов', 'градус', 'градуса']),
-        humidity, compute_suffix(humidity, ['процентов', 'процент', 'процента']),
-        pressure, compute_suffix(pressure, ['миллиметров', 'миллиметр', 'миллиметра']),
-        wind_speed, compute_suffix(wind_speed, ['километров', 'километр', 'километра'])
-    )
-    return text
+    return FORECAST_TEMPLATE.format(**forecast_slots(temp, temp_feel, humidity, pressure, wind_speed))
 
 def forecast_text_short(temp: str, temp_feel: str, wind_speed: str):
-    text = 'Температура {0} {1}, Ощущается как {2} {3}, Ветер {4} {5} в секунду.'.format(
-        temp, compute_suffix(temp, ['градусов', 'градус', 'градуса']),
-		temp_feel, compute_suffix(temp_feel, ['градусов', 'градус', 'градуса']),
-        wind_speed, compute_suffix(wind_speed, ['метров', 'метр', 'метра'])
-    )
-    return text
+    return FORECAST_TEMPLATE_SHORT.format(**forecast_slots_short(temp, temp_feel, wind_speed))
 
 
 # запросить погоду для данного местоположения
@@ -88,6 +97,10 @@ def request_weather(core:VACore):
 
 # сформировать описание погоды, на основании словаря JSON
 def get_weather_text(data: dict):
+    template, slots = get_weather_template(data)
+    return template.format(**slots)
+
+def get_weather_template(data: dict):
     descr = data['lang_ru'][0]['value']
 
     humidity = data['humidity']
@@ -101,10 +114,16 @@ def get_weather_text(data: dict):
 
     wind_speed = data['windspeedKmph']
 
-    return descr + '. ' + forecast_text(temp, temp_feel, humidity, str(pressure), wind_speed)
+    slots = forecast_slots(temp, temp_feel, humidity, str(pressure), wind_speed)
+    slots['descr'] = descr
+    return '{descr}. ' + FORECAST_TEMPLATE, slots
 
 def get_weather_text_short(data: dict):
-    descr = 'Сегодня '+data['lang_ru'][0]['value']
+    template, slots = get_weather_template_short(data)
+    return template.format(**slots)
+
+def get_weather_template_short(data: dict):
+    descr = data['lang_ru'][0]['value']
 
     if 'temp_C' in data:
         temp = data['temp_C']
@@ -114,7 +133,9 @@ def get_weather_text_short(data: dict):
     temp_feel = data['FeelsLikeC']
     wind_speed = str(round(float(data['windspeedKmph']) * 1000 / 3600))
 
-    return descr + '. ' + forecast_text_short(temp, temp_feel, wind_speed)
+    slots = forecast_slots_short(temp, temp_feel, wind_speed)
+    slots['descr'] = descr
+    return 'Сегодня {descr}. ' + FORECAST_TEMPLATE_SHORT, slots
 
 
 # получить текст для описания даты прогноза
@@ -147,8 +168,8 @@ def get_weather(core: VACore, phrase: str):
         # core.play_voice_assistant_speech('Текущая погодная сводка')
 
         weathers = request_weather(core)
-        text = get_weather_text(weathers['current_condition'][0])
-        core.play_voice_assistant_speech(text)
+        template, slots = get_weather_template(weathers['current_condition'][0])
+        core.say_template(template, **slots)
         return
     except Exception as e:
         pass
@@ -158,8 +179,8 @@ def get_weather_short(core: VACore,phrase: str):
         # core.play_voice_assistant_speech('Текущая погодная сводка')
 
         weathers = request_weather(core)
-        text = get_weather_text_short(weathers['current_condition'][0])
-        core.play_voice_assistant_speech(text)
+        template, slots = get_weather_template_short(weathers['current_condition'][0])
+        core.say_template(template, **slots)
         return
     except Exception as e:
         pass
@@ -169,8 +190,8 @@ def get_weather_forecast(core: VACore, phrase: str):
     # произнести прогноз на определенное время суток
     def say_hourly_weather(daytime: str, hourly: dict):
         core.play_voice_assistant_speech(daytime);
-        text = get_weather_text(hourly)
-        core.play_voice_assistant_speech(text)
+        template, slots = get_weather_template(hourly)
+        core.say_template(template, **slots)
 
     try:
         core.play_voice_assistant_speech('Прогноз на три дня')
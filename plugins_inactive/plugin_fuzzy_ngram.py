@@ -0,0 +1,188 @@
+# Fuzzy processor: character n-gram TF-IDF (vectorized with numpy)
+
+# Для каждого контекста (словаря команд) один раз строится TF-IDF матрица символьных n-грамм по всем алиасам команд.
+# Фраза сравнивается сразу со всеми алиасами одним разреженным умножением матрицы на вектор (косинусная близость).
+# Если allow_rest_phrase - сравниваются также все начала фразы (по словам), остаток возвращается как rest_phrase.
+
+import os
+import math
+from threading import Lock
+
+import numpy
+
+from vacore import VACore
+
+modname = os.path.basename(__file__)[:-3] # calculating modname
+
+indexes = {} # (fingerprint контекста, ngram_size) -> NgramIndex
+indexes_lock = Lock()
+MAX_INDEXES = 16
+
+# функция на старте
+def start(core:VACore):
+    manifest = {
+        "name": "Fuzzy processor: n-граммы символов (TF-IDF)",
+        "version": "1.2",
+        "require_online": False,
+
+        "description": "Нечеткое распознавание команд по символьным n-граммам. Быстрое даже на тысячах команд.\n"
+                       "Срабатывает, только если уверенность не ниже min_probability (и порога fuzzyThreshold в core)",
+
+        "options_label": {
+            "ngram_size": "Размер n-граммы в символах",
+            "min_probability": "Минимальная уверенность, ниже - считаем, что команда не распознана",
+        },
+
+        "default_options": {
+            "ngram_size": 3,
+            "min_probability": 0.7, # косинусная близость n-грамм выше, чем у других процессоров - порог строже fuzzyThreshold
+        },
+
+        "fuzzy_processor": {
+            "ngram": (init,predict,prepare) # первая функция инициализации, вторая - обработка, третья - подготовка контекста
+        }
+    }
+    return manifest
+
+def start_with_options(core:VACore, manifest:dict):
+    pass
+
+def init(core:VACore):
+    # заранее строим индекс по основным командам
+    get_index(core, core.commands)
+
+def prepare(core:VACore, context:dict):
+    # вызывается для ContextIndex - строим матрицу заранее, а не при первой фразе
+    get_index(core, context)
+
+def predict(core:VACore, command:str, context:dict, allow_rest_phrase:bool = True):
+    index = get_index(core, context)
+    res = index.predict(command, allow_rest_phrase)
+    if res is None or res[1] < core.plugin_options(modname)["min_probability"]:
+        return None
+    return res
+
+def get_index(core:VACore, context:dict):
+    ngram_size = core.plugin_options(modname)["ngram_size"]
+    key = (core.get_context_trie(context).fingerprint, ngram_size)
+    with indexes_lock:
+        index = indexes.get(key)
+        if index is None:
+            index = NgramIndex(context, ngram_size)
+            if len(indexes) >= MAX_INDEXES:
+                indexes.pop(next(iter(indexes)))
+            indexes[key] = index
+    return index
+
+
+class NgramIndex:
+    def __init__(self, context:dict, ngram_size:int = 3):
+        self.ngram_size = ngram_size
+
+        # алиасы команд и соответствующие им ключи контекста
+        self.alias_keys = []
+        alias_ngrams = []
+        for keyall in context.keys():
+            for key in str(keyall).split("|"):
+                self.alias_keys.append(keyall)
+                alias_ngrams.append(self.ngrams(key))
+
+        # словарь n-грамм и document frequency
+        self.vocab = {}
+        df = []
+        for ngrams in alias_ngrams:
+            for ngram in ngrams.keys():
+                col = self.vocab.get(ngram)
+                if col is None:
+                    col = len(self.vocab)
+                    self.vocab[ngram] = col
+                    df.append(0)
+                df[col] += 1
+
+        n_aliases = len(self.alias_keys)
+        self.idf = numpy.log((1.0 + n_aliases) / (1.0 + numpy.array(df, dtype=numpy.float32))) + 1.0
+        self.idf_oov = math.log(1.0 + n_aliases) + 1.0 # для n-грамм, которых нет ни в одной команде
+
+        # матрица алиасы x n-граммы в CSC-формате (по столбцам), строки нормированы
+        rows = []
+        cols = []
+        vals = []
+        for row, ngrams in enumerate(alias_ngrams):
+            row_cols = [self.vocab[ngram] for ngram in ngrams.keys()]
+            row_vals = numpy.array(list(ngrams.values()), dtype=numpy.float32) * self.idf[row_cols]
+            norm = numpy.linalg.norm(row_vals)
+            if norm > 0:
+                row_vals /= norm
+            rows.extend([row] * len(row_cols))
+            cols.extend(row_cols)
+            vals.append(row_vals)
+
+        cols = numpy.array(cols, dtype=numpy.int64)
+        order = numpy.argsort(cols, kind="stable")
+        self.csc_rows = numpy.array(rows, dtype=numpy.int64)[order]
+        self.csc_vals = (numpy.concatenate(vals) if len(vals) > 0 else numpy.zeros(0, dtype=numpy.float32))[order]
+        self.csc_indptr = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(cols, minlength=len(self.vocab)))))
+
+    def ngrams(self, text:str) -> dict:
+        text = " " + " ".join(text.lower().split()) + " "
+        res = {}
+        for i in range(max(1, len(text) - self.ngram_size + 1)):
+            ngram = text[i:i + self.ngram_size]
+            res[ngram] = res.get(ngram, 0) + 1
+        return res
+
+    def scores(self, texts:list) -> numpy.ndarray:
+        # косинусная близость каждого текста со всеми алиасами; результат - матрица тексты x алиасы
+        n_aliases = len(self.alias_keys)
+        rows = []
+        vals = []
+        for i, text in enumerate(texts):
+            ngrams = self.ngrams(text)
+            q_cols = []
+            q_vals = []
+            norm2 = 0.0
+            for ngram, tf in ngrams.items():
+                col = self.vocab.get(ngram)
+                if col is None:
+                    norm2 += (tf * self.idf_oov) ** 2
+                else:
+                    w = tf * float(self.idf[col])
+                    norm2 += w * w
+                    q_cols.append(col)
+                    q_vals.append(w)
+            if len(q_cols) == 0 or norm2 == 0:
+                continue
+            norm = math.sqrt(norm2)
+            for col, w in zip(q_cols, q_vals):
+                start, end = self.csc_indptr[col], self.csc_indptr[col + 1]
+                rows.append(self.csc_rows[start:end] + i * n_aliases)
+                vals.append(self.csc_vals[start:end] * (w / norm))
+
+        if len(rows) == 0:
+            return numpy.zeros((len(texts), n_aliases), dtype=numpy.float32)
+        res = numpy.bincount(numpy.concatenate(rows), weights=numpy.concatenate(vals), minlength=len(texts) * n_aliases)
+        return res.reshape((len(texts), n_aliases))
+
+    def predict(self, command:str, allow_rest_phrase:bool = True):
+        if len(self.alias_keys) == 0:
+            return None
+
+        words = command.split()
+        if len(words) == 0:
+            return None
+
+        # кандидаты - вся фраза, и (если можно) все ее начала по словам
+        if allow_rest_phrase:
+            prefix_lens = list(range(len(words), 0, -1))
+        else:
+            prefix_lens = [len(words)]
+
+        scores = self.scores([" ".join(words[:n]) for n in prefix_lens])
+        best = int(numpy.argmax(scores))
+        prefix_ind, alias_ind = divmod(best, len(self.alias_keys))
+        probability = float(scores[prefix_ind, alias_ind])
+        if probability <= 0:
+            return None
+
+        rest_phrase = " ".join(words[prefix_lens[prefix_ind]:])
+        return (self.alias_keys[alias_ind], min(probability, 1.0), rest_phrase)
@@ -4,20 +4,16 @@
 
 
 import os
-import requests
 import json
 
 from vacore import VACore
+from utils.http_pool import TTSHttpError, request_stream, iter_body, stream_to_file
 
 modname = os.path.basename(__file__)[:-3] # calculating modname
 
-### classes from https://github.com/Aculeasis/rhvoice-rest/blob/master/example/rhvoice-rest.py
-class Error(Exception):
-    def __init__(self, code, msg):
-        self.code = code
-        self.msg = msg
-
+Error = TTSHttpError # для совместимости
 
+### classes from https://github.com/Aculeasis/rhvoice-rest/blob/master/example/rhvoice-rest.py
 class TTS:
     TTS_URL = "{}/api/tts"
 
@@ -27,37 +23,28 @@ class TTS:
             'text': text,
             'voice': voice,
         }
-        self._data = None
-        self._generate()
-
-    def _generate(self):
-        try:
-            rq = requests.get(self._url, params=self.__params, stream=False)
-        except (requests.exceptions.HTTPError, requests.exceptions.RequestException) as e:
-            raise Error(code=1, msg=str(e))
-
-        code = rq.status_code
-        if code != 200:
-            raise Error(code=code, msg='http code != 200')
-        self._data = rq.iter_content()
 
     def save(self, file_path):
-        if self._data is None:
-            raise Exception('There\'s nothing to save')
-
-        with open(file_path, 'wb') as f:
-            for d in self._data:
-                f.write(d)
-
+        # тело ответа пишется в файл по мере загрузки, соединение с сервером переиспользуется
+        stream_to_file("GET", self._url, file_path, params=self.__params)
         return file_path
 
+    def stream(self):
+        # (куски PCM, sample_rate) - проигрывание начинается до конца загрузки; None - ответ не PCM WAV
+        from utils.audio import pcm_stream_from_wav
+        body = iter_body(request_stream("GET", self._url, params=self.__params))
+        res = pcm_stream_from_wav(body)
+        if res is None:
+            body.close()
+        return res
+
 
 
 # функция на старте
 def start(core:VACore):
     manifest = {
         "name": "TTS OpenTTS server",
-        "version": "1.0",
+        "version": "1.1",
         "require_online": False,
 
         "default_options": {
@@ -66,8 +53,9 @@ def start(core:VACore):
         },
 
         "tts": {
-            "opentts": (init,None,towavfile) # первая функция инициализации, вторая - говорить, третья - в wav file
+            "opentts": (init,None,towavfile,None,tostream) # первая функция инициализации, вторая - говорить, третья - в wav file
                                             # если вторая - None, то используется 3-я с проигрыванием файла
+                                            # пятая - потоком, проигрывание начинается до конца загрузки
         }
     }
     return manifest
@@ -79,8 +67,9 @@ def init(core:VACore):
     url = core.plugin_options(modname)["urlOpenTTS"]
     print("Open TTS web interface: {}".format(url))
     try:
-        rq = requests.get(url+"/api/voices", params={}, stream=False)
-    except (requests.exceptions.HTTPError, requests.exceptions.RequestException) as e:
+        from utils.http_pool import get_session, TTS_TIMEOUT
+        rq = get_session().get(url+"/api/voices", params={}, timeout=TTS_TIMEOUT)
+    except Exception as e:
         #raise Error(code=1, msg=str(e))
         print("--- Error: OpenTTS seems to be unavailable ----")
         return
@@ -91,23 +80,23 @@ def init(core:VACore):
     for voiceId in ar.keys():
         print("  "+voiceId+": ",ar[voiceId])
 
-def towavfile(core:VACore, text_to_speech:str, wavfile:str):
-    # simple way
+def get_tts(core:VACore, text_to_speech:str) -> TTS:
     voiceid = core.plugin_options(modname)["voiceId"]
     url = core.plugin_options(modname)["urlOpenTTS"]
-    #format = core.plugin_options("plugin_tts_rhvoice_rest")["format"]
-    try:
-
-        res = TTS(text=text_to_speech,url=url,voice=voiceid)
+    return TTS(text=text_to_speech,url=url,voice=voiceid)
 
-        res.save(wavfile)
+def towavfile(core:VACore, text_to_speech:str, wavfile:str):
+    try:
+        get_tts(core, text_to_speech).save(wavfile)
     except Exception as e:
         print(e)
 
-
-
-
-    return
+def tostream(core:VACore, text_to_speech:str):
+    try:
+        return get_tts(core, text_to_speech).stream()
+    except Exception as e:
+        print(e)
+        return None
 
 if __name__ == '__main__':
     test = TTS(text='Привет мир! 1 2 3.',format_="wav")
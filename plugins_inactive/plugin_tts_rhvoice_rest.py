@@ -4,19 +4,15 @@
 
 
 import os
-import requests
 
 from vacore import VACore
+from utils.http_pool import TTSHttpError, request_stream, iter_body, stream_to_file
 
 modname = os.path.basename(__file__)[:-3] # calculating modname
 
-### classes from https://github.com/Aculeasis/rhvoice-rest/blob/master/example/rhvoice-rest.py
-class Error(Exception):
-    def __init__(self, code, msg):
-        self.code = code
-        self.msg = msg
-
+Error = TTSHttpError # для совместимости
 
+### classes from https://github.com/Aculeasis/rhvoice-rest/blob/master/example/rhvoice-rest.py
 class TTS:
     TTS_URL = "{}/say"
 
@@ -27,37 +23,28 @@ class TTS:
             'voice': voice,
             'format': format_
         }
-        self._data = None
-        self._generate()
-
-    def _generate(self):
-        try:
-            rq = requests.get(self._url, params=self.__params, stream=False)
-        except (requests.exceptions.HTTPError, requests.exceptions.RequestException) as e:
-            raise Error(code=1, msg=str(e))
-
-        code = rq.status_code
-        if code != 200:
-            raise Error(code=code, msg='http code != 200')
-        self._data = rq.iter_content()
 
     def save(self, file_path):
-        if self._data is None:
-            raise Exception('There\'s nothing to save')
-
-        with open(file_path, 'wb') as f:
-            for d in self._data:
-                f.write(d)
-
+        # тело ответа пишется в файл по мере загрузки, соединение с сервером переиспользуется
+        stream_to_file("GET", self._url, file_path, params=self.__params)
         return file_path
 
+    def stream(self):
+        # (куски PCM, sample_rate) - проигрывание начинается до конца загрузки; None - ответ не PCM WAV
+        from utils.audio import pcm_stream_from_wav
+        body = iter_body(request_stream("GET", self._url, params=self.__params))
+        res = pcm_stream_from_wav(body)
+        if res is None:
+            body.close()
+        return res
+
 
 
 # функция на старте
 def start(core:VACore):
     manifest = {
         "name": "TTS rhvoice (REST)",
-        "version": "1.1",
+        "version": "1.2",
         "require_online": False,
 
         "default_options": {
@@ -67,8 +54,9 @@ def start(core:VACore):
         },
 
         "tts": {
-            "rhvoice_rest": (init,None,towavfile) # первая функция инициализации, вторая - говорить, третья - в wav file
+            "rhvoice_rest": (init,None,towavfile,None,tostream) # первая функция инициализации, вторая - говорить, третья - в wav file
                                             # если вторая - None, то используется 3-я с проигрыванием файла
+                                            # пятая - потоком (только для format wav), проигрывание начинается до конца загрузки
         }
     }
     return manifest
@@ -79,23 +67,26 @@ def start_with_options(core:VACore, manifest:dict):
 def init(core:VACore):
     pass
 
-def towavfile(core:VACore, text_to_speech:str, wavfile:str):
-    # simple way
+def get_tts(core:VACore, text_to_speech:str) -> TTS:
     voiceid = core.plugin_options("plugin_tts_rhvoice_rest")["voiceId"]
     url = core.plugin_options("plugin_tts_rhvoice_rest")["urlRHVoiceRestServer"]
     format = core.plugin_options("plugin_tts_rhvoice_rest")["format"]
-    try:
+    return TTS(text=text_to_speech,url=url,voice=voiceid,format_=format)
 
-        res = TTS(text=text_to_speech,url=url,voice=voiceid,format_=format)
-
-        res.save(wavfile)
+def towavfile(core:VACore, text_to_speech:str, wavfile:str):
+    try:
+        get_tts(core, text_to_speech).save(wavfile)
     except Exception as e:
         print(e)
 
-
-
-
-    return
+def tostream(core:VACore, text_to_speech:str):
+    if core.plugin_options("plugin_tts_rhvoice_rest")["format"] != "wav":
+        return None # mp3 потоком не разбираем - будет через файл
+    try:
+        return get_tts(core, text_to_speech).stream()
+    except Exception as e:
+        print(e)
+        return None
 
 if __name__ == '__main__':
     test = TTS(text='Привет мир! 1 2 3.',format_="wav")
@@ -2,19 +2,15 @@
 # author: Vladislav Janvarev
 
 import os
-import requests
 
 from vacore import VACore
+from utils.http_pool import TTSHttpError, request_stream, iter_body, stream_to_file
 
 modname = os.path.basename(__file__)[:-3] # calculating modname
 
-### classes from https://github.com/Aculeasis/rhvoice-rest/blob/master/example/rhvoice-rest.py
-class Error(Exception):
-    def __init__(self, code, msg):
-        self.code = code
-        self.msg = msg
-
+Error = TTSHttpError # для совместимости
 
+### classes from https://github.com/Aculeasis/rhvoice-rest/blob/master/example/rhvoice-rest.py
 class TTS:
     TTS_URL = "{}/getwav"
 
@@ -28,37 +24,28 @@ class TTS:
             'put_yo': put_yo,
 
         }
-        self._data = None
-        self._generate()
-
-    def _generate(self):
-        try:
-            rq = requests.get(self._url, params=self.__params, stream=False)
-        except (requests.exceptions.HTTPError, requests.exceptions.RequestException) as e:
-            raise Error(code=1, msg=str(e))
-
-        code = rq.status_code
-        if code != 200:
-            raise Error(code=code, msg='http code != 200')
-        self._data = rq.iter_content()
 
     def save(self, file_path):
-        if self._data is None:
-            raise Exception('There\'s nothing to save')
-
-        with open(file_path, 'wb') as f:
-            for d in self._data:
-                f.write(d)
-
+        # тело ответа пишется в файл по мере загрузки, соединение с сервером переиспользуется
+        stream_to_file("GET", self._url, file_path, params=self.__params)
         return file_path
 
+    def stream(self):
+        # (куски PCM, sample_rate) - проигрывание начинается до конца загрузки
+        from utils.audio import pcm_stream_from_wav
+        body = iter_body(request_stream("GET", self._url, params=self.__params))
+        res = pcm_stream_from_wav(body)
+        if res is None:
+            body.close()
+        return res
+
 
 
 # функция на старте
 def start(core:VACore):
     manifest = {
         "name": "TTS silero (REST)",
-        "version": "1.0",
+        "version": "1.1",
         "require_online": False,
 
         "default_options": {
@@ -70,8 +57,9 @@ def start(core:VACore):
         },
 
         "tts": {
-            "silero_rest": (init,None,towavfile) # первая функция инициализации, вторая - говорить, третья - в wav file
+            "silero_rest": (init,None,towavfile,None,tostream) # первая функция инициализации, вторая - говорить, третья - в wav file
                                             # если вторая - None, то используется 3-я с проигрыванием файла
+                                            # пятая - потоком, проигрывание начинается до конца загрузки
         }
     }
     return manifest
@@ -82,8 +70,7 @@ def start_with_options(core:VACore, manifest:dict):
 def init(core:VACore):
     pass
 
-def towavfile(core:VACore, text_to_speech:str, wavfile:str):
-    # simple way
+def get_tts(core:VACore, text_to_speech:str) -> TTS:
     speaker = core.plugin_options("plugin_tts_silero_rest")["speaker"]
     url = core.plugin_options("plugin_tts_silero_rest")["urlSileroRestServer"]
     sample_rate = core.plugin_options("plugin_tts_silero_rest")["sample_rate"]
@@ -99,19 +86,20 @@ def towavfile(core:VACore, text_to_speech:str, wavfile:str):
         put_accent = 0
 
 
-    #format = core.plugin_options("plugin_tts_silero_rest")["format"]
-    try:
+    return TTS(text=text_to_speech,url=url,speaker=speaker,sample_rate=sample_rate,put_yo=put_yo,put_accent=put_accent)
 
-        res = TTS(text=text_to_speech,url=url,speaker=speaker,sample_rate=sample_rate,put_yo=put_yo,put_accent=put_accent)
-
-        res.save(wavfile)
+def towavfile(core:VACore, text_to_speech:str, wavfile:str):
+    try:
+        get_tts(core, text_to_speech).save(wavfile)
     except Exception as e:
         print(e)
 
-
-
-
-    return
+def tostream(core:VACore, text_to_speech:str):
+    try:
+        return get_tts(core, text_to_speech).stream()
+    except Exception as e:
+        print(e)
+        return None
 
 if __name__ == '__main__':
     test = TTS(text='Привет мир! 1 2 3.',format_="wav")
@@ -24,7 +24,7 @@ if __name__ == "__main__":
         # traceback.print_exc()
         logger.exception(e)
 
-
+    cmd_core.print_metrics_summary()
     exit(0) # если нужно - закомментируйте и можно будет работать с командной строкой
 
     print("Enter command (user text like 'привет') or 'exit'")
@@ -36,4 +36,6 @@ if __name__ == "__main__":
         except Exception as e:
             logger.exception(e)
 
-        cmd_core.execute_next(cmd,cmd_core.context)
\ No newline at end of file
+        cmd_core.execute_next(cmd,cmd_core.context)
+
+    cmd_core.print_metrics_summary()
\ No newline at end of file
@@ -56,13 +56,14 @@ if __name__ == "__main__":
     #core.init_plugin("core")
     #core.init_plugins(["core"])
     core.init_with_plugins()
+    core.timers_journal_replay()
 
-    while True:
-        # старт записи речи с последующим выводом распознанной речи
-        voice_input_str = record_and_recognize_audio()
+    try:
+        while True:
+            # старт записи речи с последующим выводом распознанной речи
+            voice_input_str = record_and_recognize_audio()
 
-        if voice_input_str != "":
-            core.run_input_str(voice_input_str)
-
-
-        core._update_timers()
\ No newline at end of file
+            if voice_input_str != "":
+                core.run_input_str(voice_input_str)
+    except KeyboardInterrupt:
+        core.print_metrics_summary()
\ No newline at end of file
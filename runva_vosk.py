@@ -65,6 +65,7 @@ if __name__ == "__main__":
     # настраиваем логирование
     logger = logging.getLogger('runva_vosk')  # задаём конкретное имя, иначе здесь будет  __main__
 
+    core = None
     try:
         if args.model is None:
             args.model = "model"
@@ -99,6 +100,7 @@ if __name__ == "__main__":
             #core.init_plugin("core")
             #core.init_plugins(["core"])
             core.init_with_plugins()
+            core.timers_journal_replay()
 
             #core.play_wav('timer/Sounds/Loud beep.wav')
 
@@ -124,8 +126,8 @@ if __name__ == "__main__":
                         #print("UNBlocking microphone...")
                 else:
                     #print("2",rec.PartialResult())
-                    pass
-                core._update_timers()
+                    if core.speculativeResolve:
+                        core.speculate_input_str(json.loads(rec.PartialResult()).get("partial", ""))
 
 
                 if dump_fn is not None:
@@ -133,6 +135,8 @@ if __name__ == "__main__":
 
     except KeyboardInterrupt:
         print('\nDone')
+        if core is not None:
+            core.print_metrics_summary()
         parser.exit(0)
     except Exception as e:
         logger.exception(e)
@@ -36,7 +36,14 @@ async def run_test():
     # initing core
     core = VACore()
     core.init_with_plugins()
+    core.timers_journal_replay()
 
+    try:
+        await run_recognition(core)
+    finally:
+        core.print_metrics_summary()
+
+async def run_recognition(core:VACore):
     with sd.RawInputStream(samplerate=args.samplerate, blocksize = 4000, device=args.device, dtype='int16',
                            channels=1, callback=callback) as device:
 
@@ -54,8 +61,10 @@ async def run_test():
                     #print(restext)
 
                     if voice_input_str != "":
-                        core.run_input_str(voice_input_str,block_mic)
+                        await core.run_input_str_async(voice_input_str,block_mic)
                         mic_blocked = False
+                elif "partial" in resj and core.speculativeResolve:
+                    core.speculate_input_str(resj["partial"])
 
             await websocket.send('{"eof" : 1}')
             print (await websocket.recv())
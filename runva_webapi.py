@@ -4,7 +4,7 @@ from fastapi import FastAPI, HTTPException
 import uvicorn
 from multiprocessing import Process
 
-from starlette.responses import HTMLResponse
+from starlette.responses import HTMLResponse, PlainTextResponse, Response, StreamingResponse
 from termcolor import cprint
 import json
 from starlette.websockets import WebSocket
@@ -16,11 +16,14 @@ from starlette.websockets import WebSocket
 #     exit(-1)
 #from pydantic import BaseModel
 
-from fastapi_utils_tasks import repeat_every
 
-
-from vacore import VACore
+from vacore import VACore, VASession, TTSBufferError
 import time
+import uuid
+import asyncio
+from urllib.parse import quote
+from threading import Lock
+from collections import OrderedDict
 
 # ------------------- main loop ------------------
 
@@ -45,7 +48,9 @@ default_options={
     "host": "127.0.0.1",
     "port": 5003,
     "log_level": "info",
-    "use_ssl": False
+    "use_ssl": False,
+    "sessions_max": 1000, # сессий по sessionId в памяти; сверх - удаляются давно не использованные
+    "session_idle_seconds": 3600, # сессия, к которой столько не обращались, удаляется (с ее контекстом и таймером)
 }
 webapi_options = load_options(py_file=__file__,default_options=default_options)
 use_ssl = webapi_options["use_ssl"]
@@ -71,17 +76,124 @@ returnFormat Варианты:
 - "none" (TTS реакции будут на сервере) (звук на сервере)
 - "saytxt" (сервер вернет текст, TTS будет на клиенте) (звук на клиенте)
 - "saywav" (TTS на сервере, сервер отрендерит WAV и вернет клиенту, клиент его проиграет) (звук на клиенте) **наиболее универсальный для клиента**
+- "saywavbin" (как saywav, но WAV передается бинарными данными, без base64: в HTTP - телом ответа audio/wav,
+  в websocket - текстовый кадр с JSON (wav_binary - размер WAV), затем бинарные кадры с WAV)
 """
-def runCmd(cmd:str,returnFormat:str):
+
+WS_BINARY_CHUNK = 32768 # размер бинарного кадра websocket с WAV
+
+def http_result(r):
+    # saywavbin: WAV отдаем телом ответа, текст ответа - в заголовке X-Restxt (urlencoded)
+    if isinstance(r, dict) and r.get("wav_bytes") is not None:
+        headers = {}
+        if r.get("restxt") is not None:
+            headers["X-Restxt"] = quote(r["restxt"])
+        return Response(content=r["wav_bytes"], media_type="audio/wav", headers=headers)
+    return r
+
+async def websocket_send_result(websocket: WebSocket, r, is_json_str:bool = False):
+    if isinstance(r, dict) and r.get("wav_bytes") is not None:
+        r = dict(r)
+        wav_bytes = r.pop("wav_bytes")
+        r["wav_binary"] = len(wav_bytes)
+        if r.get("wav_base64") is not None:
+            r["wav_base64"] = r["wav_base64"].decode("utf-8")
+        await websocket.send_text(json.dumps(r, ensure_ascii=False))
+        for i in range(0, len(wav_bytes), WS_BINARY_CHUNK):
+            await websocket.send_bytes(wav_bytes[i:i+WS_BINARY_CHUNK])
+    elif is_json_str:
+        await websocket.send_text(r)
+    else:
+        await websocket.send_text(str(r))
+
+# сессии клиентов - у каждого свой контекст и формат ответа, клиенты не мешают друг другу
+# sessionId приходит от клиента - число сессий ограничено (sessions_max, session_idle_seconds), иначе память растет без конца
+sessions:OrderedDict = OrderedDict() # sessionId -> VASession; порядок - от давно использованных к недавним
+sessions_used:dict[str, float] = {} # sessionId -> время последнего обращения (time.monotonic)
+sessions_lock = Lock()
+
+def get_session(sessionId:str = "default") -> VASession:
+    with sessions_lock:
+        session = sessions.get(sessionId)
+        if session is None:
+            session = VASession()
+            sessions[sessionId] = session
+        sessions.move_to_end(sessionId)
+        sessions_used[sessionId] = time.monotonic()
+        expired = pop_expired_sessions(sessionId)
+    for old in expired:
+        clear_session(old)
+    return session
+
+def pop_expired_sessions(keepId:str) -> list:
+    # под sessions_lock; "default" и сессии открытых websocket (их закрывает обработчик) не трогаем, как и занятые командой
+    now = time.monotonic()
+    res = []
+    for sessionId in list(sessions.keys()):
+        is_idle = now - sessions_used[sessionId] > webapi_options["session_idle_seconds"]
+        if not is_idle and len(sessions) - len(res) <= webapi_options["sessions_max"]:
+            break # дальше - недавние
+        if sessionId == keepId or sessionId == "default" or sessionId.startswith("ws_"):
+            continue
+        session = sessions[sessionId]
+        if session.async_lock is not None and session.async_lock.locked(): # есть запросы в очереди сессии
+            continue
+        if not session.lock.acquire(blocking=False):
+            continue
+        session.lock.release()
+        res.append(sessions.pop(sessionId))
+        sessions_used.pop(sessionId, None)
+    return res
+
+async def run_in_session(sessionId:str, func, *args):
+    # команды одной сессии ждут друг друга в event loop, а не в потоках пула (см. VACore.run_async_session)
+    return await core.run_async_session(get_session(sessionId), func, *args)
+
+def clear_session(session:VASession):
+    with core.use_session(session):
+        core.context_clear()
+
+def close_session(sessionId:str):
+    with sessions_lock:
+        session = sessions.pop(sessionId, None)
+        sessions_used.pop(sessionId, None)
+    if session is not None:
+        clear_session(session)
+
+def audio_format_error(audioFormat:str) -> str:
+    # "" - формат известен (или не задан); проверяется до выполнения команды - HTTP отвечает 400, websocket - сообщением об ошибке
+    from utils.audio import FORMAT_PROFILES
+    if audioFormat is None or audioFormat == "" or audioFormat in FORMAT_PROFILES:
+        return ""
+    return "Unknown audioFormat. Available: "+", ".join(FORMAT_PROFILES.keys())
+
+def check_audio_format(audioFormat:str):
+    # только для HTTP-запросов
+    error = audio_format_error(audioFormat)
+    if error != "":
+        raise HTTPException(status_code=400, detail=error)
+
+def set_audio_format(session:VASession, audioFormat:str):
+    # клиент один раз объявляет нужный ему формат звука (например, pcm16k или ulaw8k) - он запоминается в сессии
+    if audioFormat is None or audioFormat == "":
+        return
+    error = audio_format_error(audioFormat)
+    if error != "": # вызывающий должен был проверить раньше
+        raise ValueError(error)
+    session.audioFormat = audioFormat
+
+def runCmd(cmd:str,returnFormat:str,sessionId:str = "default",audioFormat:str = ""):
     if core.logPolicy == "cmd" or core.logPolicy == "all":
         print("Running cmd: ",cmd)
 
-    tmpformat = core.remoteTTS
-    core.remoteTTS = returnFormat
-    core.remoteTTSResult = ""
-    core.lastSay = ""
-    core.execute_next(cmd,core.context)
-    core.remoteTTS = tmpformat
+    session = get_session(sessionId)
+    set_audio_format(session, audioFormat)
+    with session.lock:
+        session.remoteTTS = returnFormat
+        session.remoteTTSResult = ""
+        session.lastSay = ""
+        core.execute_next(cmd,session.context,session)
+        return session.remoteTTSResult
 
 app = FastAPI()
 is_running = True
@@ -97,19 +209,27 @@ app.mount("/mic_client", StaticFiles(directory="mic_client", html = True), name=
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     print("New WebSocket text connection")
-    while True:
-        data = await websocket.receive_text()
+    sessionId = "ws_"+uuid.uuid4().hex
+    try:
+        while True:
+            data = await websocket.receive_text()
 
-        data_json = None
-        try:
-            data_json = json.loads(str(data))
-        except:
-            print("Can't parse json from websocket: ", data)
+            data_json = None
+            try:
+                data_json = json.loads(str(data))
+            except:
+                print("Can't parse json from websocket: ", data)
 
-        if data_json is not None:
-            # r = process_chunk(rec,data,"saytxt,saywav")
-            r = sendRawTxtOrig(data_json.get("txt",""), data_json.get("returnFormat", "none"))
-            await websocket.send_text(str(r))
+            if data_json is not None:
+                error = audio_format_error(data_json.get("audioFormat", ""))
+                if error != "":
+                    await websocket.send_text(json.dumps({"error": error}))
+                    continue
+                # r = process_chunk(rec,data,"saytxt,saywav")
+                r = await run_in_session(sessionId, sendRawTxtOrig, data_json.get("txt",""), data_json.get("returnFormat", "none"), sessionId, data_json.get("audioFormat", ""))
+                await websocket_send_result(websocket, r)
+    finally:
+        close_session(sessionId)
 
 
 
@@ -118,78 +238,70 @@ async def websocket_endpoint(websocket: WebSocket):
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     print("New WebSocket text cmd connection")
-    while True:
-        data = await websocket.receive_text()
-        data_json = None
-        try:
-            data_json = json.loads(str(data))
-        except:
-            print("Can't parse json from websocket: ", data)
-
-        if data_json is not None:
-            # r = process_chunk(rec,data,"saytxt,saywav")
-            r = sendSimpleTxtCmd(data_json.get("txt",""), data_json.get("returnFormat", "none"))
-            await websocket.send_text(str(r))
-
-
-@app.websocket("/wsmic")
-async def websocket_endpoint(websocket: WebSocket):
+    sessionId = "ws_"+uuid.uuid4().hex
+    try:
+        while True:
+            data = await websocket.receive_text()
+            data_json = None
+            try:
+                data_json = json.loads(str(data))
+            except:
+                print("Can't parse json from websocket: ", data)
+
+            if data_json is not None:
+                error = audio_format_error(data_json.get("audioFormat", ""))
+                if error != "":
+                    await websocket.send_text(json.dumps({"error": error}))
+                    continue
+                # r = process_chunk(rec,data,"saytxt,saywav")
+                r = await run_in_session(sessionId, runCmd, data_json.get("txt",""), data_json.get("returnFormat", "none"), sessionId, data_json.get("audioFormat", ""))
+                await websocket_send_result(websocket, r)
+    finally:
+        close_session(sessionId)
+
+
+async def websocket_mic(websocket: WebSocket, sample_rate:int, returnFormat:str, name:str):
     await websocket.accept()
+    returnFormat = websocket.query_params.get("returnFormat", returnFormat) # например, ws://.../wsmic?returnFormat=saytxt,saywavbin
     if model != None:
         from vosk import KaldiRecognizer
-        rec = KaldiRecognizer(model, 48000)
-        print("New WebSocket microphone recognition")
-        while True:
-            data = await websocket.receive_bytes()
-            r = process_chunk(rec,data,"saytxt,saywav")
-            await websocket.send_text(r)
+        rec = KaldiRecognizer(model, sample_rate)
+        print("New WebSocket microphone recognition "+name)
+        audioFormat = websocket.query_params.get("audioFormat", "")
+        error = audio_format_error(audioFormat)
+        if error != "":
+            await websocket.close(code=1008, reason=error) # 1008 - policy violation
+            return
+        sessionId = "ws_"+uuid.uuid4().hex
+        set_audio_format(get_session(sessionId), audioFormat)
+        try:
+            while True:
+                data = await websocket.receive_bytes()
+                r = await run_in_session(sessionId, process_chunk, rec, data, returnFormat, sessionId)
+                await websocket_send_result(websocket, r, True)
+        finally:
+            close_session(sessionId)
     else:
         print("Can't accept WebSocket microphone recognition - no Model (seems to be no VOSK at startup)")
 
+@app.websocket("/wsmic")
+async def websocket_endpoint(websocket: WebSocket):
+    await websocket_mic(websocket, 48000, "saytxt,saywav", "wsmic")
+
 @app.websocket("/wsmic_48000_none")
 async def websocket_endpoint(websocket: WebSocket):
-    await websocket.accept()
-    if model != None:
-        from vosk import KaldiRecognizer
-        rec = KaldiRecognizer(model, 48000)
-        print("New WebSocket microphone recognition wsmic_48000_none")
-        while True:
-            data = await websocket.receive_bytes()
-            r = process_chunk(rec,data,"none")
-            await websocket.send_text(r)
-    else:
-        print("Can't accept WebSocket microphone recognition - no Model (seems to be no VOSK at startup)")
+    await websocket_mic(websocket, 48000, "none", "wsmic_48000_none")
 
 @app.websocket("/wsmic_22050_none")
 async def websocket_endpoint(websocket: WebSocket):
-    await websocket.accept()
-    if model != None:
-        from vosk import KaldiRecognizer
-        rec = KaldiRecognizer(model, 22050)
-        print("New WebSocket microphone recognition wsmic_22050_none")
-        while True:
-            data = await websocket.receive_bytes()
-            r = process_chunk(rec,data,"none")
-            await websocket.send_text(r)
-    else:
-        print("Can't accept WebSocket microphone recognition - no Model (seems to be no VOSK at startup)")
+    await websocket_mic(websocket, 22050, "none", "wsmic_22050_none")
 
 @app.websocket("/wsmic_44100_none")
 async def websocket_endpoint(websocket: WebSocket):
-    await websocket.accept()
-    if model != None:
-        from vosk import KaldiRecognizer
-        rec = KaldiRecognizer(model, 44100)
-        print("New WebSocket microphone recognition wsmic_44100_none")
-        while True:
-            data = await websocket.receive_bytes()
-            r = process_chunk(rec,data,"none")
-            await websocket.send_text(r)
-    else:
-        print("Can't accept WebSocket microphone recognition - no Model (seems to be no VOSK at startup)")
+    await websocket_mic(websocket, 44100, "none", "wsmic_44100_none")
 
 
-def process_chunk(rec,message,returnFormat):
+def process_chunk(rec,message,returnFormat,sessionId:str = "default"):
     # with open('temp/asr_server_test.wav', 'wb') as the_file:
     #     the_file.write(message)
 
@@ -209,12 +321,14 @@ def process_chunk(rec,message,returnFormat):
                 print(voice_input_str)
                 #ttsFormatList = ["saytxt"]
                 #res2 = sendRawTxtOrig(voice_input_str,"none,saytxt")
-                res2 = sendRawTxtOrig(voice_input_str, returnFormat)
+                res2 = sendRawTxtOrig(voice_input_str, returnFormat, sessionId)
                 # saywav not supported due to bytes serialization???
 
 
                 if res2 != "NO_VA_NAME":
                     res3:dict = res2
+                    if res3.get("wav_bytes") is not None: # saywavbin - отправит websocket_send_result
+                        return res3
                     if res3.get("wav_base64") is not None: # converting bytes to str
                         res3["wav_base64"] = res2["wav_base64"].decode("utf-8")
                     res2 = json.dumps(res3)
@@ -229,7 +343,9 @@ def process_chunk(rec,message,returnFormat):
     else:
         res = rec.PartialResult()
         #print("Part Result:",res)
-        return rec.PartialResult()
+        if core.speculativeResolve:
+            core.speculate_input_str(json.loads(res).get("partial", ""), get_session(sessionId))
+        return res
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -267,6 +383,7 @@ async def startup_event():
     core = VACore()
     core.fastApiApp = app
     core.init_with_plugins()
+    core.timers_journal_replay()
 
     from vacore import version
 
@@ -297,63 +414,140 @@ async def startup_event():
 
 
 # рендерит текст в wav
+# format:
+# - json - {"wav_base64": ...} (совместимость)
+# - wav - WAV телом ответа (audio/wav)
+# - pcm - поток audio/pcm (16 бит little-endian; частота и каналы - в заголовках X-Sample-Rate, X-Channels),
+#   при включенной опции ядра ttsStreamSentences отдается по предложениям - клиент может начать проигрывание до окончания озвучки всего текста
+# другие значения format - ответ 400
+# audioFormat - (опционально) профиль формата звука: pcm8k, pcm16k, pcm22k, pcm24k, pcm44k, ulaw8k (моно); по умолчанию - как есть
 @app.get("/ttsWav")
-async def ttsWav(text:str):
+async def ttsWav(text:str, format:str = "json", audioFormat:str = "", sessionId:str = ""):
     #runCmd(cmd,returnFormat)
-    tmpformat = core.remoteTTS
-    core.remoteTTS = "saywav"
-    core.play_voice_assistant_speech(text)
-    core.remoteTTS = tmpformat
-    return core.remoteTTSResult
+    if format not in ("json", "wav", "pcm"):
+        raise HTTPException(status_code=400, detail="Unknown format. Available: json, wav, pcm")
+    check_audio_format(audioFormat)
+    session = get_session(sessionId) if sessionId != "" else VASession()
+    set_audio_format(session, audioFormat)
+    if format == "pcm":
+        return await tts_pcm_stream(text, session.audioFormat)
+
+    ttsSession = VASession("saywavbin" if format == "wav" else "saywav")
+    ttsSession.audioFormat = session.audioFormat
+    await core.play_voice_assistant_speech_async(text, ttsSession)
+    return http_result(ttsSession.remoteTTSResult)
+
+async def tts_pcm_stream(text:str, audioFormat:str = ""):
+    from utils.audio import convert_pcm, get_format_profile
+
+    profile = get_format_profile(audioFormat)
+    sentences = core.tts_split_sentences(text)
+    # до начала ответа ошибку еще можно вернуть кодом HTTP
+    try:
+        data, sample_rate = await core.run_async(core.tts_to_buffer, sentences[0])
+    except TTSBufferError as e:
+        raise HTTPException(status_code=501, detail="format=pcm is not supported by current TTS engine: "+str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="TTS error: "+str(e))
+    first, out_rate, channels = convert_pcm(data, sample_rate, profile)
+
+    async def chunks():
+        cur = first
+        for i in range(len(sentences)):
+            # следующее предложение рендерится, пока отдаем текущее
+            next_task = asyncio.ensure_future(core.run_async(core.tts_to_buffer, sentences[i+1])) if i+1 < len(sentences) else None
+            try:
+                yield cur
+            except BaseException: # клиент отключился - следующее предложение не нужно
+                if next_task is not None:
+                    next_task.cancel()
+                raise
+            if next_task is not None:
+                try:
+                    next_data, next_rate = await next_task
+                except Exception as e:
+                    # заголовки уже отправлены - заканчиваем поток на целом предложении
+                    print("TTS pcm stream: ошибка озвучки, поток остановлен: {0}".format(e))
+                    return
+                cur = convert_pcm(next_data, next_rate, profile)[0]
+
+    encoding = profile["encoding"] if profile is not None else "pcm16"
+    return StreamingResponse(chunks(), media_type="audio/pcm",
+                             headers={"X-Sample-Rate": str(out_rate), "X-Channels": str(channels), "X-Encoding": encoding})
 
 
 # выполняет команду Ирины
 # Например: привет, погода.
+# sessionId - (опционально) идентификатор клиента; у каждого клиента свой контекст
 @app.get("/sendTxtCmd")
-async def sendSimpleTxtCmd(cmd:str,returnFormat:str = "none"):
-    runCmd(cmd,returnFormat)
-    return core.remoteTTSResult
+async def sendSimpleTxtCmd(cmd:str,returnFormat:str = "none",sessionId:str = "default",audioFormat:str = ""):
+    check_audio_format(audioFormat)
+    return http_result(await run_in_session(sessionId,runCmd,cmd,returnFormat,sessionId,audioFormat))
 
 # Посылает распознанный текстовый ввод. Если в нем есть имя помощника, выполняется команда.
 # Пример: ирина погода, раз два
 @app.get("/sendRawTxt")
-async def sendRawTxt(rawtxt:str,returnFormat:str = "none"):
-    return sendRawTxtOrig(rawtxt,returnFormat)
-
-def sendRawTxtOrig(rawtxt:str,returnFormat:str = "none"):
-    tmpformat = core.remoteTTS
-    core.remoteTTS = returnFormat
-    core.remoteTTSResult = ""
-    core.lastSay = ""
-    isFound = core.run_input_str(rawtxt)
-    core.remoteTTS = tmpformat
-
-    if isFound:
-        return core.remoteTTSResult
-    else:
-        return "NO_VA_NAME"
+async def sendRawTxt(rawtxt:str,returnFormat:str = "none",sessionId:str = "default",audioFormat:str = ""):
+    check_audio_format(audioFormat)
+    return http_result(await run_in_session(sessionId,sendRawTxtOrig,rawtxt,returnFormat,sessionId,audioFormat))
+
+def sendRawTxtOrig(rawtxt:str,returnFormat:str = "none",sessionId:str = "default",audioFormat:str = ""):
+    session = get_session(sessionId)
+    set_audio_format(session, audioFormat)
+    with session.lock:
+        session.remoteTTS = returnFormat
+        session.remoteTTSResult = ""
+        session.lastSay = ""
+        isFound = core.run_input_str(rawtxt,None,session)
+
+        if isFound:
+            return session.remoteTTSResult
+        else:
+            return "NO_VA_NAME"
 
 # Обновляет контекст на то же самое время
 @app.get("/reinitContext")
-async def reinitContext():
-    if core.contextTimer != None:
-        core.context_set(core.context,core.contextTimerLastDuration)
+async def reinitContext(sessionId:str = "default"):
+    session = get_session(sessionId)
+    with core.use_session(session):
+        if core.contextTimer != None:
+            core.context_set(core.context,core.contextTimerLastDuration)
     return ""
 
-# Запускает внутреннюю процедуру проверки таймеров. Должна запускаться периодически
+# Метрики задержек по этапам обработки команд в формате Prometheus
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(core.metrics.render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# Готовность ядра: состояние и время загрузки каждого движка (TTS, нормализатор, fuzzy processors...)
+# status: loading - движки еще грузятся (текстовые команды уже работают), ok - все загружены, degraded - есть ошибки
+@app.get("/health")
+async def health():
+    from vacore import version
+    res = core.engine_loader.status()
+    if not res["ready"]:
+        status = "loading"
+    elif any(engine["state"] == "error" for engine in res["engines"].values()):
+        status = "degraded"
+    else:
+        status = "ok"
+    return {"status": status, "version": version, "ttsEngineId": core.ttsEngineId, **res}
+
+# Оставлено для совместимости: таймеры теперь срабатывают сами, периодически вызывать не нужно
 @app.get("/updTimers")
 async def updTimers():
     #core.say("аа")
     #print("upd timers")
-    core._update_timers()
+    await core.run_async(core._update_timers)
     return ""
 
 # Сообщает серверу, что клиент воспроизвёл ответ и можно начать отсчёт таймера контекста
 @app.get("/replyWasGiven")
-async def replyWasGiven():
+async def replyWasGiven(sessionId:str = "default"):
     if core.contextRemoteWaitForCall:
-        if core.contextTimer != None:
-            core.contextTimer.start()
+        session = get_session(sessionId)
+        if session.contextTimer != None:
+            session.contextTimer.start()
             #print("debug - run context after webapi call")
 
 def core_update_timers_http(runReq=True):
@@ -385,13 +579,6 @@ def app_shutdown():
     cprint("Ctrl-C pressed, exiting Irene.", "yellow")
     is_running = False
 
-@app.on_event("startup")
-@repeat_every(seconds=2)
-async def app_timers():
-    if core != None:
-        #print("update timers")
-        core._update_timers()
-
 if __name__ == "__main__":
 
 
@@ -0,0 +1,284 @@
+# Преобразования аудио в памяти: WAV (bytes) <-> PCM (numpy float32, от -1.0 до 1.0)
+
+import io
+import wave
+
+import numpy
+
+_SAMPLE_DTYPES = {1: numpy.uint8, 2: numpy.int16, 4: numpy.int32}
+
+
+def wav_bytes_to_pcm(wav_bytes:bytes):
+    # возвращает (numpy.ndarray, sample_rate); массив формы (n,) или (n, channels). None - формат не поддерживается
+    try:
+        with wave.open(io.BytesIO(wav_bytes), "rb") as wav:
+            sample_width = wav.getsampwidth()
+            channels = wav.getnchannels()
+            sample_rate = wav.getframerate()
+            frames = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError):
+        return None # например, WAV с float-сэмплами
+
+    dtype = _SAMPLE_DTYPES.get(sample_width)
+    if dtype is None:
+        return None
+    data = numpy.frombuffer(frames, dtype=dtype).astype(numpy.float32)
+    if sample_width == 1:
+        data = (data - 128.0) / 128.0
+    else:
+        data /= float(2 ** (8 * sample_width - 1))
+    if channels > 1:
+        data = data.reshape((-1, channels))
+    return data, sample_rate
+
+
+def pcm_to_int16_bytes(data:numpy.ndarray) -> bytes:
+    # сырые сэмплы 16-bit little-endian (audio/pcm)
+    return (numpy.clip(data, -1.0, 1.0) * 32767.0).astype("<i2").tobytes()
+
+
+def pcm_to_wav_bytes(data:numpy.ndarray, sample_rate:int) -> bytes:
+    # 16-bit PCM WAV
+    channels = 1 if data.ndim == 1 else data.shape[1]
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(int(sample_rate))
+        wav.writeframes(pcm_to_int16_bytes(data))
+    return buf.getvalue()
+
+
+# ------- профили формата для клиентов WEB-API -------
+# encoding: pcm16 - 16-bit PCM, mulaw - G.711 µ-law (8 бит на сэмпл)
+FORMAT_PROFILES = {
+    "original": None, # как отдал движок TTS
+    "pcm8k": {"sample_rate": 8000, "channels": 1, "encoding": "pcm16"},
+    "pcm16k": {"sample_rate": 16000, "channels": 1, "encoding": "pcm16"},
+    "pcm22k": {"sample_rate": 22050, "channels": 1, "encoding": "pcm16"},
+    "pcm24k": {"sample_rate": 24000, "channels": 1, "encoding": "pcm16"},
+    "pcm44k": {"sample_rate": 44100, "channels": 1, "encoding": "pcm16"},
+    "ulaw8k": {"sample_rate": 8000, "channels": 1, "encoding": "mulaw"},
+}
+
+
+def get_format_profile(name:str) -> dict:
+    # None - отдавать как есть
+    if name is None or name == "" or name == "original":
+        return None
+    if name not in FORMAT_PROFILES:
+        raise ValueError("Неизвестный профиль формата аудио: {0}. Доступны: {1}".format(name, ", ".join(FORMAT_PROFILES.keys())))
+    return FORMAT_PROFILES[name]
+
+
+def to_mono(data:numpy.ndarray) -> numpy.ndarray:
+    return data if data.ndim == 1 else data.mean(axis=1).astype(numpy.float32)
+
+
+def _lowpass_kernel(cutoff:float, taps:int = 63) -> numpy.ndarray:
+    # FIR-фильтр (windowed sinc); cutoff - доля частоты дискретизации (0..0.5)
+    n = numpy.arange(taps) - (taps - 1) / 2.0
+    h = 2.0 * cutoff * numpy.sinc(2.0 * cutoff * n) * numpy.hamming(taps)
+    return h / h.sum()
+
+
+def _lowpass(data:numpy.ndarray, cutoff:float, taps:int = 63) -> numpy.ndarray:
+    h = _lowpass_kernel(cutoff, taps)
+    if data.ndim == 1:
+        return numpy.convolve(data, h, mode="same")
+    return numpy.stack([numpy.convolve(data[:, c], h, mode="same") for c in range(data.shape[1])], axis=1)
+
+
+def resample(data:numpy.ndarray, src_rate:int, dst_rate:int) -> numpy.ndarray:
+    # при понижении частоты сначала срезаем все выше новой частоты Найквиста, затем линейная интерполяция
+    if src_rate == dst_rate or len(data) == 0:
+        return data
+    if dst_rate < src_rate:
+        data = _lowpass(data, 0.45 * dst_rate / src_rate)
+    n_dst = int(round(len(data) * dst_rate / src_rate))
+    t = numpy.arange(n_dst) * (src_rate / dst_rate)
+    x = numpy.arange(len(data))
+    if data.ndim == 1:
+        return numpy.interp(t, x, data).astype(numpy.float32)
+    return numpy.stack([numpy.interp(t, x, data[:, c]) for c in range(data.shape[1])], axis=1).astype(numpy.float32)
+
+
+class StreamResampler:
+    # resample для звука, который приходит кусками: состояние фильтра и позиция интерполяции переходят в следующий кусок,
+    # поэтому на стыках нет щелчков и накопления ошибки округления длины (resample по каждому куску отдельно их дает).
+    # Фильтр причинный - выход задержан на (taps - 1) / 2 сэмплов, остаток отдает flush()
+
+    def __init__(self, src_rate:int, dst_rate:int, taps:int = 63):
+        self.step = src_rate / dst_rate
+        self.kernel = _lowpass_kernel(0.45 * dst_rate / src_rate, taps) if dst_rate < src_rate else None
+        self._history = None # последние taps - 1 входных сэмплов - для фильтра
+        self._prev = None # последний сэмпл прошлого куска - от него интерполируем
+        self._pos = 0.0 # позиция следующего выходного сэмпла (0 - _prev, или начало куска, если _prev нет)
+
+    def process(self, data:numpy.ndarray) -> numpy.ndarray:
+        # data - (сэмплы, каналы) float32; результат - столько выходных сэмплов, сколько уже можно посчитать
+        data = numpy.asarray(data, dtype=numpy.float32)
+        if self.kernel is not None:
+            if self._history is None:
+                self._history = numpy.zeros((len(self.kernel) - 1, data.shape[1]), dtype=numpy.float32)
+            x = numpy.concatenate((self._history, data))
+            self._history = x[len(x) - len(self.kernel) + 1:]
+            data = numpy.stack([numpy.convolve(x[:, c], self.kernel, mode="valid") for c in range(data.shape[1])], axis=1)
+        buf = data if self._prev is None else numpy.concatenate((self._prev, data))
+        if len(buf) == 0:
+            return numpy.zeros((0, data.shape[1]), dtype=numpy.float32)
+        last = len(buf) - 1
+        n = 0 if last < self._pos else int((last - self._pos) // self.step) + 1
+        t = self._pos + numpy.arange(n) * self.step
+        x = numpy.arange(len(buf))
+        res = numpy.stack([numpy.interp(t, x, buf[:, c]) for c in range(buf.shape[1])], axis=1).astype(numpy.float32)
+        self._pos = self._pos + n * self.step - last
+        self._prev = buf[last:]
+        return res
+
+    def flush(self) -> numpy.ndarray:
+        # хвост, задержанный фильтром
+        if self.kernel is None or self._history is None:
+            return numpy.zeros((0, 1 if self._prev is None else self._prev.shape[1]), dtype=numpy.float32)
+        return self.process(numpy.zeros(((len(self.kernel) - 1) // 2, self._history.shape[1]), dtype=numpy.float32))
+
+
+_ULAW_EXP_LUT = numpy.array([0] + [int(numpy.log2(v)) for v in range(1, 256)], dtype=numpy.int32)
+
+
+def ulaw_encode(data:numpy.ndarray) -> bytes:
+    # G.711 µ-law, векторно
+    pcm = (numpy.clip(data, -1.0, 1.0) * 32767.0).astype(numpy.int32)
+    sign = numpy.where(pcm < 0, 0x80, 0)
+    pcm = numpy.minimum(numpy.abs(pcm), 32635) + 0x84
+    exponent = _ULAW_EXP_LUT[(pcm >> 7) & 0xFF]
+    mantissa = (pcm >> (exponent + 3)) & 0x0F
+    return (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(numpy.uint8).tobytes()
+
+
+def convert_pcm(data:numpy.ndarray, sample_rate:int, profile:dict):
+    # PCM -> (bytes сэмплов в кодировке профиля, sample_rate, channels)
+    if profile is None:
+        return pcm_to_int16_bytes(data), sample_rate, 1 if data.ndim == 1 else data.shape[1]
+    if profile["channels"] == 1:
+        data = to_mono(data)
+    data = resample(data, sample_rate, profile["sample_rate"])
+    channels = 1 if data.ndim == 1 else data.shape[1]
+    if profile["encoding"] == "mulaw":
+        return ulaw_encode(data), profile["sample_rate"], channels
+    return pcm_to_int16_bytes(data), profile["sample_rate"], channels
+
+
+def transcode_wav(wav_bytes:bytes, profile:dict) -> bytes:
+    if profile is None:
+        return wav_bytes
+    decoded = wav_bytes_to_pcm(wav_bytes)
+    if decoded is None:
+        return wav_bytes # формат не поддерживается - отдаем как есть
+    samples, sample_rate, channels = convert_pcm(decoded[0], decoded[1], profile)
+    if profile["encoding"] == "mulaw":
+        return _wav_header(7, channels, sample_rate, 8, len(samples)) + samples
+    return _wav_header(1, channels, sample_rate, 16, len(samples)) + samples
+
+
+def _wav_header(format_tag:int, channels:int, sample_rate:int, bits:int, data_len:int) -> bytes:
+    # format_tag: 1 - PCM, 7 - µ-law (для него нужен fact-чанк)
+    import struct
+    block_align = channels * bits // 8
+    fmt = struct.pack("<HHIIHH", format_tag, channels, sample_rate, sample_rate * block_align, block_align, bits)
+    chunks = b""
+    if format_tag != 1:
+        fmt += struct.pack("<H", 0)
+        chunks = b"fact" + struct.pack("<II", 4, data_len // block_align)
+    chunks = b"fmt " + struct.pack("<I", len(fmt)) + fmt + chunks + b"data" + struct.pack("<I", data_len)
+    return b"RIFF" + struct.pack("<I", 4 + len(chunks) + data_len) + b"WAVE" + chunks
+
+
+# ------- склейка кусков озвучки -------
+def trim_silence(data:numpy.ndarray, threshold:float = 0.01, keep:int = 0) -> numpy.ndarray:
+    # обрезает тишину по краям, оставляя keep сэмплов
+    level = numpy.abs(data) if data.ndim == 1 else numpy.abs(data).max(axis=1)
+    idx = numpy.nonzero(level > threshold)[0]
+    if len(idx) == 0:
+        return data[:0]
+    return data[max(0, idx[0] - keep):min(len(data), idx[-1] + 1 + keep)]
+
+
+def concat_crossfade(pieces:list, fade:int) -> numpy.ndarray:
+    # склейка с равномощным (equal power) перекрестным затуханием длиной fade сэмплов
+    pieces = [p for p in pieces if len(p) > 0]
+    if len(pieces) == 0:
+        return numpy.zeros(0, dtype=numpy.float32)
+    out = pieces[0]
+    for piece in pieces[1:]:
+        n = min(fade, len(out), len(piece))
+        if n == 0:
+            out = numpy.concatenate((out, piece))
+            continue
+        ramp = numpy.linspace(0.0, 1.0, n, dtype=numpy.float32)
+        if out.ndim > 1:
+            ramp = ramp[:, None]
+        mid = out[-n:] * numpy.sqrt(1.0 - ramp) + piece[:n] * numpy.sqrt(ramp)
+        out = numpy.concatenate((out[:-n], mid, piece[n:]))
+    return out.astype(numpy.float32)
+
+
+# ------- потоковое чтение (звук приходит кусками, например по HTTP) -------
+def pcm_stream_from_raw(byte_chunks, sample_rate:int, channels:int = 1, sample_width:int = 2):
+    # куски байт -> куски numpy float32; неполный кадр на границе кусков переносится в следующий
+    dtype = _SAMPLE_DTYPES[sample_width]
+    frame = channels * sample_width
+    rest = b""
+    for chunk in byte_chunks:
+        chunk = rest + chunk
+        n = len(chunk) - len(chunk) % frame
+        rest = chunk[n:]
+        if n == 0:
+            continue
+        data = numpy.frombuffer(chunk[:n], dtype=dtype).astype(numpy.float32)
+        if sample_width == 1:
+            data = (data - 128.0) / 128.0
+        else:
+            data /= float(2 ** (8 * sample_width - 1))
+        yield data if channels == 1 else data.reshape((-1, channels))
+
+
+def pcm_stream_from_wav(byte_chunks):
+    # разбирает заголовок WAV из начала потока; возвращает (генератор кусков PCM, sample_rate) или None, если это не PCM WAV.
+    # Размеры в заголовке не используются - у потоковых ответов там часто 0 или 0xFFFFFFFF
+    import struct
+    byte_chunks = iter(byte_chunks)
+    head = b""
+
+    def need(n:int) -> bool:
+        nonlocal head
+        while len(head) < n:
+            chunk = next(byte_chunks, None)
+            if chunk is None:
+                return False
+            head += chunk
+        return True
+
+    if not need(12) or head[:4] != b"RIFF" or head[8:12] != b"WAVE":
+        return None
+    pos = 12
+    fmt = None
+    while True:
+        if not need(pos + 8):
+            return None
+        chunk_id, chunk_size = head[pos:pos+4], struct.unpack("<I", head[pos+4:pos+8])[0]
+        pos += 8
+        if chunk_id == b"data":
+            break
+        if not need(pos + chunk_size):
+            return None
+        if chunk_id == b"fmt ":
+            fmt = struct.unpack("<HHIIHH", head[pos:pos+16])
+        pos += chunk_size + chunk_size % 2
+    if fmt is None or fmt[0] != 1 or fmt[5] // 8 not in _SAMPLE_DTYPES:
+        return None # float или сжатый формат - потоком не разбираем
+
+    def chunks():
+        yield head[pos:]
+        yield from byte_chunks
+    return pcm_stream_from_raw(chunks(), fmt[2], fmt[1], fmt[5] // 8), fmt[2]
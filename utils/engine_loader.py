@@ -0,0 +1,87 @@
+# Инициализация движков (проигрывание, нормализатор, TTS, fuzzy processors) в фоне.
+# Каждый движок грузится в своем потоке, ядро сразу принимает команды; тот, кому нужен движок, ждет только его (wait).
+# Состояние и время загрузки каждого движка - status() (WEB-API: /health).
+
+import time
+import logging
+from threading import Thread, Event, Lock
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class _EngineTask:
+    __slots__ = ("name", "state", "error", "time_start", "duration", "done")
+
+    def __init__(self, name:str):
+        self.name = name # id движка
+        self.state = "pending" # pending, loading, ready, error
+        self.error = ""
+        self.time_start = 0.0
+        self.duration = 0.0
+        self.done = Event()
+
+
+class EngineLoader:
+    def __init__(self, background:bool = True, metrics = None):
+        self.background = background # False - грузим сразу в вызывающем потоке, как раньше
+        self.metrics = metrics
+        self._tasks = OrderedDict() # ключ ("tts", "fuzzy:...") -> _EngineTask
+        self._lock = Lock()
+
+    def submit(self, key:str, name:str, func, depends:list = ()):
+        # func() - инициализация; исключение из нее - движок в состоянии error.
+        # depends - ключи движков, которые должны загрузиться раньше (успешно или нет)
+        task = _EngineTask(name)
+        with self._lock:
+            self._tasks[key] = task
+        if self.background:
+            Thread(target=self._run, args=(key, task, func, depends), name="vacore-init-"+key, daemon=True).start()
+        else:
+            self._run(key, task, func, depends)
+
+    def _run(self, key:str, task:_EngineTask, func, depends):
+        for dep in depends:
+            self.wait(dep)
+        task.state = "loading"
+        task.time_start = time.time()
+        time_start = time.perf_counter()
+        try:
+            func()
+            task.state = "ready"
+        except Exception as e:
+            task.state = "error"
+            task.error = "{0}: {1}".format(type(e).__name__, e)
+        finally:
+            task.duration = time.perf_counter() - time_start
+            if self.metrics is not None:
+                self.metrics.observe("engine_init", task.duration, key)
+            task.done.set()
+
+    def wait(self, key:str, timeout:float = None) -> bool:
+        # True - движок загрузился (или не загружается вовсе); False - ошибка или таймаут
+        with self._lock:
+            task = self._tasks.get(key)
+        if task is None:
+            return True
+        if not task.done.is_set():
+            logger.info("Жду загрузку движка %s (%s)...", key, task.name)
+        task.done.wait(timeout)
+        return task.state == "ready"
+
+    def is_loading(self, key:str) -> bool:
+        with self._lock:
+            task = self._tasks.get(key)
+        return task is not None and not task.done.is_set()
+
+    def status(self) -> dict:
+        engines = {}
+        with self._lock:
+            tasks = list(self._tasks.items())
+        for key, task in tasks:
+            duration = task.duration if task.done.is_set() else (time.time() - task.time_start if task.state == "loading" else 0.0)
+            engines[key] = {"engine": task.name, "state": task.state, "load_seconds": round(duration, 3)}
+            if task.error != "":
+                engines[key]["error"] = task.error
+        loading = [task for key, task in tasks if not task.done.is_set()]
+        return {"ready": len(loading) == 0, "engines": engines}
@@ -0,0 +1,70 @@
+# Кеш в памяти для частых фраз (ответы "не поняла", "Запускаю!" и т.п.)
+# Хранит готовый WAV, его base64 (для WEB-API saywav) и PCM для проигрывания из памяти - без обращения к диску.
+# Фразы попадают в кеш при старте (статические ответы из опций плагинов) или после promote_after повторов.
+
+import base64
+from threading import Lock
+from collections import OrderedDict
+
+
+class HotPhrase:
+    __slots__ = ("wav_bytes", "wav_base64", "pcm", "sample_rate", "variants")
+
+    def __init__(self, wav_bytes:bytes):
+        self.wav_bytes = wav_bytes
+        self.wav_base64 = base64.b64encode(wav_bytes)
+        from utils.audio import wav_bytes_to_pcm
+        decoded = wav_bytes_to_pcm(wav_bytes)
+        self.pcm, self.sample_rate = decoded if decoded is not None else (None, 0)
+        self.variants = {} # профиль формата клиента -> WAV (см. utils.audio.FORMAT_PROFILES)
+
+
+class HotPhraseCache:
+    def __init__(self, max_items:int = 64, promote_after:int = 3):
+        self.max_items = max_items
+        self.promote_after = promote_after
+        self.stats = {"hits": 0, "misses": 0}
+        self._entries = OrderedDict() # ключ озвучки (VACore.get_tts_cache_key) -> HotPhrase
+        self._counts = {} # ключ -> сколько раз фраза озвучивалась
+        self._lock = Lock()
+
+    def get(self, key:str) -> HotPhrase:
+        with self._lock:
+            phrase = self._entries.get(key)
+            if phrase is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return phrase
+
+    def put(self, key:str, wav_bytes:bytes) -> HotPhrase:
+        phrase = HotPhrase(wav_bytes)
+        with self._lock:
+            self._entries[key] = phrase
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+        return phrase
+
+    def should_promote(self, key:str) -> bool:
+        # считаем повторы; фраза, сказанная promote_after раз, сохраняется в памяти
+        if self.max_items <= 0:
+            return False
+        with self._lock:
+            if len(self._counts) > 10000:
+                self._counts.clear()
+            count = self._counts.get(key, 0) + 1
+            self._counts[key] = count
+            return count >= self.promote_after and key not in self._entries
+
+    def __contains__(self, key:str) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def summary(self) -> str:
+        return "Hot phrases: hits={0} misses={1} phrases={2}".format(self.stats["hits"], self.stats["misses"], len(self))
@@ -0,0 +1,76 @@
+# Общий HTTP-клиент для удаленных движков TTS (silero_rest, opentts, rhvoice_rest, vsegpt...)
+# Одна requests.Session на процесс: соединения с сервером переиспользуются (keep-alive), а не открываются на каждую фразу.
+# Ответ читается потоком - сразу в файл (кеш) или в проигрывание, не дожидаясь конца загрузки.
+
+import os
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# (соединение, чтение между кусками ответа), сек. Без таймаута зависший сервер задерживает ответ навсегда
+TTS_TIMEOUT = (5.0, 30.0)
+CHUNK_SIZE = 16384
+
+_session:requests.Session = None
+_session_lock = Lock()
+
+
+class TTSHttpError(Exception):
+    def __init__(self, code:int, msg:str):
+        Exception.__init__(self, "{0} (код {1})".format(msg, code))
+        self.code = code
+        self.msg = msg
+
+
+def get_session() -> requests.Session:
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16) # движков немного, потоков озвучки - несколько
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def request_stream(method:str, url:str, timeout = TTS_TIMEOUT, **kwargs) -> requests.Response:
+    # ответ с непрочитанным телом; закрыть - response.close() (или прочитать до конца)
+    try:
+        response = get_session().request(method, url, stream=True, timeout=timeout, **kwargs)
+    except requests.exceptions.RequestException as e:
+        raise TTSHttpError(0, str(e))
+    if response.status_code != 200:
+        text = response.text[:200]
+        response.close()
+        raise TTSHttpError(response.status_code, "HTTP {0}: {1}".format(response.status_code, text))
+    return response
+
+
+def iter_body(response:requests.Response):
+    # куски тела по мере прихода; соединение возвращается в пул после чтения до конца
+    try:
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            if chunk:
+                yield chunk
+    except requests.exceptions.RequestException as e:
+        raise TTSHttpError(0, str(e))
+    finally:
+        response.close()
+
+
+def stream_to_file(method:str, url:str, filename:str, timeout = TTS_TIMEOUT, **kwargs) -> int:
+    # пишет тело ответа в файл по мере загрузки; возвращает размер в байтах
+    response = request_stream(method, url, timeout, **kwargs)
+    size = 0
+    try:
+        with open(filename, "wb") as f:
+            for chunk in iter_body(response):
+                f.write(chunk)
+                size += len(chunk)
+    except Exception:
+        # обрыв посреди загрузки - недокачанный файл не должен попасть в кеш
+        if os.path.exists(filename):
+            os.unlink(filename)
+        raise
+    return size
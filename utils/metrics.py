@@ -0,0 +1,106 @@
+# Метрики задержек по этапам обработки команды (распознавание имени, поиск команды, плагин, TTS, проигрывание)
+# Гистограммы выдаются в текстовом формате Prometheus (WEB-API: /metrics) и сводкой в консоль.
+# Кроме задержек - счетчики (например, сколько секунд аудио озвучено - для RTF), они идут отдельными метриками.
+
+import time
+from threading import Lock
+from contextlib import contextmanager
+
+# границы корзин гистограммы, секунды
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value:float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+
+class Metrics:
+    def __init__(self, prefix:str = "irene"):
+        self.prefix = prefix
+        self.histograms = {} # (stage, name) -> Histogram
+        self.counters = {} # (counter, name) -> сумма
+        self.lock = Lock()
+
+    def observe(self, stage:str, duration:float, name:str = ""):
+        with self.lock:
+            histogram = self.histograms.get((stage, name))
+            if histogram is None:
+                histogram = Histogram()
+                self.histograms[(stage, name)] = histogram
+            histogram.observe(duration)
+
+    def add(self, counter:str, value:float, name:str = ""):
+        # не задержка - в гистограмму этапов не попадает
+        with self.lock:
+            self.counters[(counter, name)] = self.counters.get((counter, name), 0.0) + value
+
+    @contextmanager
+    def span(self, stage:str, name:str = ""):
+        # with core.metrics.span("tts", engine_id): ...
+        time_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - time_start, name)
+
+    def ratios(self, stage:str, counter:str) -> dict:
+        # name -> сумма stage / счетчик counter; например, RTF движка TTS: время синтеза / секунды аудио
+        res = {}
+        with self.lock:
+            for (cur_stage, name), histogram in sorted(self.histograms.items()):
+                base = self.counters.get((counter, name), 0.0)
+                if cur_stage == stage and base > 0:
+                    res[name] = histogram.sum / base
+        return res
+
+    def render_prometheus(self) -> str:
+        metric = self.prefix + "_stage_duration_seconds"
+        lines = [
+            "# HELP {0} Время выполнения этапов обработки команды".format(metric),
+            "# TYPE {0} histogram".format(metric),
+        ]
+        with self.lock:
+            for (stage, name), histogram in sorted(self.histograms.items()):
+                labels = 'stage="{0}",name="{1}"'.format(_escape(stage), _escape(name))
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append('{0}_bucket{{{1},le="{2}"}} {3}'.format(metric, labels, bound, cumulative))
+                lines.append('{0}_bucket{{{1},le="+Inf"}} {2}'.format(metric, labels, histogram.count))
+                lines.append('{0}_sum{{{1}}} {2}'.format(metric, labels, histogram.sum))
+                lines.append('{0}_count{{{1}}} {2}'.format(metric, labels, histogram.count))
+            for counter in sorted(set(counter for counter, name in self.counters.keys())):
+                counter_metric = "{0}_{1}_total".format(self.prefix, counter)
+                lines.append("# TYPE {0} counter".format(counter_metric))
+                for (cur_counter, name), value in sorted(self.counters.items()):
+                    if cur_counter == counter:
+                        lines.append('{0}{{name="{1}"}} {2}'.format(counter_metric, _escape(name), value))
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        lines = ["{0:<24} {1:<28} {2:>7} {3:>10} {4:>10}".format("stage", "name", "count", "avg, ms", "max, ms")]
+        with self.lock:
+            for (stage, name), histogram in sorted(self.histograms.items()):
+                avg = histogram.sum / histogram.count if histogram.count > 0 else 0.0
+                lines.append("{0:<24} {1:<28} {2:>7} {3:>10.1f} {4:>10.1f}".format(
+                    stage, name, histogram.count, avg * 1000, histogram.max * 1000))
+        return "\n".join(lines)
+
+
+def _escape(value:str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,129 @@
+# Планировщик отложенных вызовов: один поток и куча (heapq) по монотонному времени.
+# Заменяет threading.Timer (по потоку ОС на каждый таймер). Перенос срока - O(log n), без создания потоков.
+
+import heapq
+import itertools
+import time
+import logging
+from threading import Thread, Condition
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduledJob:
+    """
+    Отложенный вызов. По интерфейсу похож на threading.Timer: start() и cancel().
+
+    Может быть создан "невзведенным" (start=False в call_later) - тогда срок начинает отсчитываться
+    только после start(). Например, контекст ждет, пока клиент WEB-API проиграет ответ.
+    """
+    def __init__(self, scheduler:"Scheduler", delay:float, func, args:tuple):
+        self.scheduler = scheduler
+        self.delay = delay
+        self.func = func
+        self.args = args
+        self.deadline:float = None # time.monotonic(); None - не взведен
+        self.seq:int = None # номер актуальной записи в куче
+        self.cancelled = False
+        self.fired = False
+
+    @property
+    def is_armed(self) -> bool:
+        return self.deadline is not None and not self.cancelled and not self.fired
+
+    def start(self):
+        self.scheduler.arm(self, self.delay)
+
+    def reschedule(self, delay:float = None):
+        if delay is not None:
+            self.delay = delay
+        self.scheduler.arm(self, self.delay)
+
+    def cancel(self):
+        self.scheduler.cancel(self)
+
+    def remaining(self) -> float:
+        if self.deadline is None:
+            return self.delay
+        return max(0.0, self.deadline - time.monotonic())
+
+
+class Scheduler:
+    def __init__(self, name:str = "scheduler", executor = None):
+        self.name = name
+        self.executor = executor # если задан - вызовы выполняются в нем, а не в потоке планировщика
+        self._heap = [] # (deadline, seq, job); устаревшие записи пропускаются при извлечении
+        self._seq = itertools.count()
+        self._cond = Condition()
+        self._thread:Thread = None
+
+    def call_later(self, delay:float, func, *args, start:bool = True) -> ScheduledJob:
+        job = ScheduledJob(self, delay, func, args)
+        if start:
+            self.arm(job, delay)
+        return job
+
+    def arm(self, job:ScheduledJob, delay:float):
+        with self._cond:
+            job.cancelled = False
+            job.fired = False
+            job.deadline = time.monotonic() + delay
+            job.seq = next(self._seq)
+            heapq.heappush(self._heap, (job.deadline, job.seq, job))
+            self._ensure_thread()
+            self._cond.notify()
+
+    def cancel(self, job:ScheduledJob):
+        with self._cond:
+            job.cancelled = True
+            job.seq = None
+
+    def __len__(self):
+        with self._cond:
+            return sum(1 for deadline, seq, job in self._heap if job.seq == seq)
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._thread = Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                due = []
+                while True:
+                    # выкидываем отмененные и перенесенные записи
+                    while len(self._heap) > 0 and self._heap[0][2].seq != self._heap[0][1]:
+                        heapq.heappop(self._heap)
+
+                    if len(self._heap) == 0:
+                        self._cond.wait()
+                        continue
+
+                    timeout = self._heap[0][0] - time.monotonic()
+                    if timeout > 0:
+                        self._cond.wait(timeout)
+                        continue
+
+                    # все, у кого срок наступил
+                    now = time.monotonic()
+                    while len(self._heap) > 0 and self._heap[0][0] <= now:
+                        deadline, seq, job = heapq.heappop(self._heap)
+                        if job.seq == seq:
+                            job.seq = None
+                            job.fired = True
+                            due.append(job)
+                    if len(due) > 0:
+                        break
+
+            for job in due:
+                if self.executor is not None:
+                    self.executor.submit(self._call, job)
+                else:
+                    self._call(job)
+
+    def _call(self, job:ScheduledJob):
+        try:
+            job.func(*job.args)
+        except Exception as e:
+            logger.exception(e)
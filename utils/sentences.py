@@ -0,0 +1,26 @@
+# Разбиение текста на предложения для потоковой озвучки
+# Делим по концу предложения (. ! ? … и дальше заглавная буква или цифра) и переводам строки; "3.5" и "т.е. много" не режем.
+# Слишком короткие куски склеиваем со следующими - иначе интонация рваная.
+
+import re
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+(?=[A-ZА-ЯЁ0-9«\"—-])|\n+")
+
+
+def split_sentences(text:str, min_chars:int = 20) -> list:
+    res = []
+    buf = ""
+    for part in _SENTENCE_END.split(text):
+        part = part.strip()
+        if part == "":
+            continue
+        buf = part if buf == "" else buf + " " + part
+        if len(buf) >= min_chars:
+            res.append(buf)
+            buf = ""
+    if buf != "":
+        if len(res) > 0 and len(buf) < min_chars:
+            res[-1] = res[-1] + " " + buf
+        else:
+            res.append(buf)
+    return res
@@ -0,0 +1,138 @@
+# Журнал таймеров: события create / fire / cancel дописываются в файл (JSON lines).
+# После перезапуска журнал проигрывается - просроченные таймеры срабатывают сразу, остальные ставятся заново.
+# fsync выполняется пачками (не чаще, чем раз в flush_interval), файл периодически ужимается до незавершенных таймеров.
+#
+# Функция таймера хранится не объектом, а ссылкой: модуль плагина + имя обработчика + параметр (должен сохраняться в JSON).
+
+import os
+import sys
+import json
+import uuid
+import atexit
+import logging
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+class TimerJournal:
+    def __init__(self, path:str, scheduler, flush_interval:float = 0.5, compact_every:int = 200):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.compact_every = compact_every # после скольких событий ужимать файл
+        self.pending = {} # id в журнале -> запись create
+        self._events = 0
+        self._file = None
+        self._lock = Lock()
+        self._flush_job = scheduler.call_later(flush_interval, self.flush, start=False)
+
+    def open(self):
+        with self._lock:
+            self.pending = self._load()
+            self._compact()
+        atexit.register(self.flush)
+
+    # ------- ссылки на функции таймера -------
+    @staticmethod
+    def func_to_ref(funcparam):
+        # (func, param) или func -> (plugin, handler, param); None, если сохранить нельзя
+        if isinstance(funcparam, tuple):
+            func, param = funcparam
+        else:
+            func, param = funcparam, None
+        plugin = getattr(func, "__module__", None)
+        handler = getattr(func, "__qualname__", None)
+        if plugin is None or handler is None or "." in handler or not str(plugin).startswith("plugins."):
+            return None # лямбды, вложенные функции и методы не восстановить
+        try:
+            json.dumps(param)
+        except (TypeError, ValueError):
+            return None
+        return plugin, handler, param
+
+    @staticmethod
+    def ref_to_func(record:dict):
+        mod = sys.modules.get(record["plugin"])
+        func = getattr(mod, record["handler"], None) if mod is not None else None
+        if func is None:
+            return None
+        if record.get("param_tuple", True):
+            return (func, record["param"])
+        return func
+
+    # ------- события -------
+    def create(self, deadline:float, funcparam) -> str:
+        ref = self.func_to_ref(funcparam)
+        if ref is None:
+            return None
+        plugin, handler, param = ref
+        record = {"op": "create", "id": uuid.uuid4().hex, "deadline": deadline,
+                  "plugin": plugin, "handler": handler, "param": param,
+                  "param_tuple": isinstance(funcparam, tuple)}
+        with self._lock:
+            self.pending[record["id"]] = record
+            self._append(record)
+        return record["id"]
+
+    def fire(self, journal_id:str):
+        self._finish("fire", journal_id)
+
+    def cancel(self, journal_id:str):
+        self._finish("cancel", journal_id)
+
+    def _finish(self, op:str, journal_id:str):
+        if journal_id is None:
+            return
+        with self._lock:
+            if self.pending.pop(journal_id, None) is not None:
+                self._append({"op": op, "id": journal_id})
+
+    def _append(self, event:dict):
+        self._file.write(json.dumps(event, ensure_ascii=False) + "\n")
+        self._events += 1
+        if not self._flush_job.is_armed:
+            self._flush_job.start()
+
+    # ------- запись на диск -------
+    def flush(self):
+        with self._lock:
+            if self._file is None:
+                return
+            try:
+                if self._events >= self.compact_every:
+                    self._compact()
+                else:
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+            except OSError as e:
+                logger.exception(e)
+
+    def _load(self) -> dict:
+        pending = {}
+        if not os.path.exists(self.path):
+            return pending
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue # недописанная строка при падении
+                if event.get("op") == "create":
+                    pending[event["id"]] = event
+                else:
+                    pending.pop(event.get("id"), None)
+        return pending
+
+    def _compact(self):
+        # переписываем журнал только с незавершенными таймерами; замена файла атомарная
+        if self._file is not None:
+            self._file.close()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in self.pending.values():
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._events = 0
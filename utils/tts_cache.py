@@ -0,0 +1,177 @@
+# Дисковый кеш озвучки с индексом в SQLite.
+# Ключ - хеш от движка TTS, параметров голоса, нормализатора и текста (см. VACore.get_tts_cache_key).
+# Общий размер ограничен max_bytes, при превышении удаляются давно не использованные файлы (LRU).
+# Файл сначала рендерится во временный, затем атомарно переименовывается - параллельная озвучка не портит кеш.
+# Наличие файла при попадании не проверяется (лишний stat на каждую фразу): если файл удалили с диска,
+# его открывающий вызывает invalidate и озвучивает заново.
+
+import os
+import time
+import uuid
+import sqlite3
+import atexit
+import logging
+from threading import Lock
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+ACCESS_FLUSH_SECONDS = 30.0 # время последнего обращения пишется в SQLite пачкой, а не при каждом попадании
+TMP_PREFIX = "tmp_"
+
+
+class TTSCache:
+    def __init__(self, cache_dir:str, max_bytes:int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes # 0 - без ограничения
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+        self._lock = Lock()
+        self._inflight = {} # ключ -> Lock; один и тот же текст рендерится только один раз
+        self._entries = OrderedDict() # ключ -> (файл, размер); порядок - от давно использованных к недавним
+        self.total_bytes = 0
+        self._touched = {} # ключ -> время обращения, еще не записанное в SQLite
+        self._touched_flush = time.monotonic()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, filename TEXT, size INTEGER, last_access REAL)")
+        self._db.commit()
+
+        for key, filename, size in self._db.execute("SELECT key, filename, size FROM entries ORDER BY last_access"):
+            self._entries[key] = (filename, size)
+            self.total_bytes += size
+        atexit.register(self.flush) # несохраненные времена обращений - при выходе
+
+    def get(self, key:str) -> str:
+        # только по индексу, без обращения к диску
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            self._touch(key)
+        return os.path.join(self.cache_dir, entry[0])
+
+    def _touch(self, key:str):
+        # под self._lock; порядок LRU в памяти точный, на диске - с задержкой до ACCESS_FLUSH_SECONDS
+        self._touched[key] = time.time()
+        if time.monotonic() - self._touched_flush >= ACCESS_FLUSH_SECONDS:
+            self._flush_touched()
+            self._db.commit()
+
+    def _flush_touched(self):
+        # под self._lock, commit - вызывающий
+        if len(self._touched) > 0:
+            self._db.executemany("UPDATE entries SET last_access = ? WHERE key = ?",
+                                 [(access, key) for key, access in self._touched.items()])
+            self._touched.clear()
+        self._touched_flush = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            self._flush_touched()
+            self._db.commit()
+
+    def get_or_render(self, key:str, render, subdir:str = "") -> str:
+        # render(filename) - создает wav-файл; если вернула False - файл отдаем под временным именем и в кеш не записываем,
+        # после использования его нужно удалить (discard)
+        filename = self.get(key)
+        if filename is not None:
+            return filename
+
+        with self._lock:
+            key_lock = self._inflight.setdefault(key, Lock())
+        with key_lock:
+            # пока ждали - мог отрендерить другой поток
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self.stats["misses"] -= 1
+                    self.stats["hits"] += 1
+            if entry is not None:
+                return os.path.join(self.cache_dir, entry[0])
+
+            try:
+                return self._render(key, render, subdir)
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+
+    def _render(self, key:str, render, subdir:str) -> str:
+        os.makedirs(os.path.join(self.cache_dir, subdir), exist_ok=True)
+        rel_filename = os.path.join(subdir, key + ".wav")
+        filename = os.path.join(self.cache_dir, rel_filename)
+        tmp_filename = os.path.join(self.cache_dir, subdir, TMP_PREFIX + uuid.uuid4().hex + ".wav")
+
+        keep_tmp = False
+        try:
+            cacheable = render(tmp_filename)
+            if not os.path.exists(tmp_filename):
+                return filename # движок не смог создать файл - в кеш ничего не пишем
+            if cacheable is False:
+                keep_tmp = True
+                return tmp_filename # не в индексе и не под именем ключа - удаляет вызывающий
+            os.replace(tmp_filename, filename)
+        finally:
+            if not keep_tmp and os.path.exists(tmp_filename): # render упал - не оставляем неучтенный файл
+                os.unlink(tmp_filename)
+
+        self.put(key, rel_filename, os.path.getsize(filename))
+        return filename
+
+    def discard(self, filename:str):
+        # файл из get_or_render больше не нужен: временный (не записанный в кеш) удаляется, файлы кеша остаются
+        if os.path.basename(filename).startswith(TMP_PREFIX) and os.path.exists(filename):
+            os.unlink(filename)
+
+    def put(self, key:str, rel_filename:str, size:int):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old[1]
+            self._entries[key] = (rel_filename, size)
+            self.total_bytes += size
+            self._touched.pop(key, None)
+            self._db.execute("INSERT OR REPLACE INTO entries (key, filename, size, last_access) VALUES (?, ?, ?, ?)",
+                             (key, rel_filename, size, time.time()))
+            self._evict()
+            self._flush_touched() # коммит все равно будет
+            self._db.commit()
+
+    def _evict(self):
+        if self.max_bytes <= 0:
+            return
+        # последний (только что добавленный) файл не удаляем, даже если он один больше лимита
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, (rel_filename, size) = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            self.stats["evictions"] += 1
+            self._touched.pop(key, None)
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            try:
+                os.unlink(os.path.join(self.cache_dir, rel_filename))
+            except OSError as e:
+                logger.warning("TTS cache: не удалось удалить %s: %s", rel_filename, e)
+
+    def invalidate(self, key:str):
+        with self._lock:
+            self._invalidate(key)
+            self._db.commit()
+
+    def _invalidate(self, key:str):
+        # под self._lock, commit - вызывающий
+        entry = self._entries.pop(key, None)
+        self._touched.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[1]
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            logger.info("TTS cache: файл %s убран из кеша", entry[0])
+
+    def summary(self) -> str:
+        return "TTS cache: hits={0} misses={1} evictions={2} files={3} size={4:.1f} MB".format(
+            self.stats["hits"], self.stats["misses"], self.stats["evictions"], len(self._entries), self.total_bytes / 1024 / 1024)
@@ -0,0 +1,174 @@
+# Цепочка движков TTS с подстраховкой (hedging): если первый движок (например, удаленный silero_rest)
+# не отдал звук за свой бюджет времени, тот же текст отправляется следующему движку, берется тот, кто успеет первым.
+# Бюджет - квантиль (p95) недавних задержек движка в пересчете на длину текста.
+# Движок, который раз за разом ошибается или проигрывает гонку, на время перемещается в конец цепочки.
+
+import os
+import time
+from threading import Lock
+from collections import deque
+from contextvars import copy_context
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+_MIN_CHARS = 10 # очень короткие фразы считаем как фразы этой длины - у движка есть постоянные накладные расходы
+
+
+class _EngineStats:
+    def __init__(self, window:int):
+        self.latencies = deque(maxlen=window) # секунд на символ, только успешные
+        self.outcomes = deque(maxlen=window) # True - успех, False - ошибка или проигрыш по времени
+        self.demoted_until = 0.0
+        self.wins = 0
+        self.failures = 0 # ошибки и проигрыши по времени
+        self.hedged = 0 # сколько раз не уложился в бюджет и подключали следующий движок
+
+
+class _Attempt:
+    __slots__ = ("engine_id", "filename", "time_start", "future", "recorded")
+
+    def __init__(self, engine_id:str, filename:str):
+        self.engine_id = engine_id
+        self.filename = filename
+        self.time_start = time.perf_counter()
+        self.future = None
+        self.recorded = False
+
+
+class TTSChain:
+    def __init__(self, engines:list, render, quantile:float = 0.95, min_budget:float = 0.5, default_budget:float = 3.0,
+                 timeout:float = 60.0, window:int = 50, demote_after:int = 3, demote_seconds:float = 60.0, metrics = None):
+        # render(engine_id, text, filename) - озвучить текст движком в файл
+        self.engines = list(engines)
+        self.render_func = render
+        self.quantile = quantile
+        self.min_budget = min_budget
+        self.default_budget = default_budget # пока нет статистики по движку
+        self.timeout = timeout # дольше не ждем никого, даже если все движки уже запущены
+        self.demote_after = demote_after
+        self.demote_seconds = demote_seconds
+        self.metrics = metrics
+
+        self.stats = {engine_id: _EngineStats(window) for engine_id in self.engines}
+        self._lock = Lock()
+        # движки, не уложившиеся в бюджет, могут висеть долго - потоков с запасом
+        self._executor = ThreadPoolExecutor(max_workers=4 * len(self.engines), thread_name_prefix="vacore-tts-chain")
+
+    def order(self) -> list:
+        # порядок на сейчас: пониженные движки - в конце (по истечении demote_seconds возвращаются на свое место)
+        now = time.monotonic()
+        with self._lock:
+            active = [e for e in self.engines if self.stats[e].demoted_until <= now]
+            demoted = [e for e in self.engines if self.stats[e].demoted_until > now]
+        return active + demoted
+
+    def budget(self, engine_id:str, text_to_speech:str) -> float:
+        # сколько ждем движок, прежде чем подключить следующий
+        with self._lock:
+            latencies = sorted(self.stats[engine_id].latencies)
+        if len(latencies) < 5:
+            return max(self.min_budget, self.default_budget)
+        value = latencies[min(len(latencies) - 1, int(self.quantile * len(latencies)))]
+        return max(self.min_budget, value * max(len(text_to_speech), _MIN_CHARS))
+
+    def render(self, text_to_speech:str, filename:str) -> str:
+        # возвращает id движка, чей файл оказался в filename; None - не смог ни один
+        order = self.order()
+        base, ext = os.path.splitext(filename) # расширение оставляем - по нему некоторые движки выбирают формат
+        time_end = time.perf_counter() + self.timeout
+        attempts = []
+        pending = set()
+        winner = None
+        next_start = 0.0
+        while winner is None:
+            now = time.perf_counter()
+            if len(attempts) < len(order) and (len(pending) == 0 or now >= next_start):
+                if len(attempts) > 0 and len(pending) > 0:
+                    self._hedged(attempts[-1].engine_id)
+                attempt = self._start(order[len(attempts)], text_to_speech, base + "_chain" + str(len(attempts)) + ext)
+                attempts.append(attempt)
+                pending.add(attempt.future)
+                next_start = time.perf_counter() + self.budget(attempt.engine_id, text_to_speech)
+            if len(pending) == 0:
+                break # все попробовали, никто не смог
+
+            if time.perf_counter() >= time_end:
+                print("TTS chain: ни один движок не озвучил текст за {0} сек".format(self.timeout))
+                break
+            timeout = time_end if len(attempts) == len(order) else min(next_start, time_end)
+            done, pending = wait(pending, timeout=max(0.0, timeout - time.perf_counter()), return_when=FIRST_COMPLETED)
+            for future in done:
+                attempt = future.result()
+                if winner is None and self._is_ok(attempt):
+                    winner = attempt
+
+        for attempt in attempts:
+            if attempt is winner:
+                os.replace(attempt.filename, filename)
+            elif attempt.future.done():
+                self._cleanup(attempt)
+            else:
+                # еще работает - засчитываем проигрыш по времени сейчас, файл удалим, когда закончит
+                self._record(attempt, False)
+                attempt.future.add_done_callback(lambda future: self._cleanup(future.result()))
+
+        if winner is None:
+            return None
+        with self._lock:
+            self.stats[winner.engine_id].wins += 1
+        if self.metrics is not None:
+            self.metrics.observe("tts_chain", time.perf_counter() - attempts[0].time_start, winner.engine_id)
+        return winner.engine_id
+
+    def _start(self, engine_id:str, text_to_speech:str, filename:str) -> _Attempt:
+        attempt = _Attempt(engine_id, filename)
+        # copy_context - движку нужна текущая сессия (голос по имени обращения и пр.)
+        attempt.future = self._executor.submit(copy_context().run, self._run, attempt, text_to_speech)
+        return attempt
+
+    def _run(self, attempt:_Attempt, text_to_speech:str) -> _Attempt:
+        try:
+            self.render_func(attempt.engine_id, text_to_speech, attempt.filename)
+        except Exception as e:
+            print("TTS chain: ошибка движка {0}: {1}".format(attempt.engine_id, e))
+        ok = self._is_ok(attempt)
+        if ok:
+            with self._lock:
+                self.stats[attempt.engine_id].latencies.append(
+                    (time.perf_counter() - attempt.time_start) / max(len(text_to_speech), _MIN_CHARS))
+        self._record(attempt, ok)
+        return attempt
+
+    def _is_ok(self, attempt:_Attempt) -> bool:
+        return os.path.exists(attempt.filename) and os.path.getsize(attempt.filename) > 0
+
+    def _record(self, attempt:_Attempt, ok:bool):
+        with self._lock:
+            if attempt.recorded:
+                return
+            attempt.recorded = True
+            stats = self.stats[attempt.engine_id]
+            stats.outcomes.append(ok)
+            if not ok:
+                stats.failures += 1
+            recent = list(stats.outcomes)[-self.demote_after:]
+            if len(recent) == self.demote_after and not any(recent) and stats.demoted_until <= time.monotonic():
+                stats.demoted_until = time.monotonic() + self.demote_seconds
+                print("TTS chain: движок {0} понижен на {1} сек".format(attempt.engine_id, self.demote_seconds))
+
+    def _hedged(self, engine_id:str):
+        with self._lock:
+            self.stats[engine_id].hedged += 1
+
+    def _cleanup(self, attempt:_Attempt):
+        if os.path.exists(attempt.filename):
+            os.unlink(attempt.filename)
+
+    def summary(self) -> str:
+        now = time.monotonic()
+        parts = []
+        with self._lock:
+            for engine_id in self.engines:
+                stats = self.stats[engine_id]
+                parts.append("{0}: wins={1} failures={2} hedged={3}{4}".format(
+                    engine_id, stats.wins, stats.failures, stats.hedged, " (понижен)" if stats.demoted_until > now else ""))
+        return "TTS chain: " + ", ".join(parts)
@@ -0,0 +1,218 @@
+# Пул процессов для TTS: движок (например, silero на torch) работает в отдельных процессах,
+# и долгая озвучка не тормозит разбор команд, веб-сервер и распознавание в основном процессе.
+# Модель загружается один раз в каждом процессе. Звук (float32 PCM) передается обратно через
+# multiprocessing.shared_memory: по очереди идет только имя блока памяти и размеры, а не сами данные.
+# Запрос (текст и имя, по которому обратились) - маленький, он идет через очередь как есть.
+
+import os
+import time
+import itertools
+import multiprocessing
+from multiprocessing import shared_memory
+from threading import Thread, Lock
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import queue
+
+
+class TTSWorkerError(Exception):
+    pass
+
+
+def _worker_main(engine_id:str, worker_id:int, plugins:list, requests, results, current):
+    # точка входа процесса: свое ядро с теми же опциями, загружаем только core и плагины движка и нормализатора
+    # (init_plugins загрузил бы все плагины - команды, fuzzy-индексы, онлайн-плагины процессу не нужны)
+    try:
+        from vacore import VACore
+        core = VACore()
+        core.plugin_manifests = {}
+        for modname in ["core"] + list(plugins):
+            core.init_plugin(modname)
+        if engine_id not in core.ttss:
+            raise TTSWorkerError("движок {0} не загрузился (плагины: {1})".format(engine_id, ", ".join(plugins)))
+        core.ttsWorkers = 0
+        core.ttsEngineId = engine_id
+        if core.normalization_engine != "none":
+            try:
+                core.normalizers[core.normalization_engine][0](core)
+            except Exception as e: # как и в основном процессе (VACore.setup_assistant_voice) - работаем без нормализатора
+                print("TTS worker {0}: ошибка инициализации нормализатора {1}: {2}".format(worker_id, core.normalization_engine, e))
+                core.normalization_engine = "none"
+        core.ttss[engine_id][0](core)
+    except Exception as e:
+        results.put(("init_error", worker_id, "{0}: {1}".format(type(e).__name__, e)))
+        return
+    results.put(("ready", worker_id, os.getpid()))
+
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        req_id, text_to_speech, callname, time_submit = request
+        # если процесс упадет - основной процесс знает, чей запрос потерян (общая память, а не очередь:
+        # сообщение из очереди при аварийном завершении может не успеть уйти)
+        current.value = req_id
+        time_queue = time.time() - time_submit # сколько запрос ждал свободный процесс
+        try:
+            core.cur_callname = callname
+            data, sample_rate = core.tts_to_buffer(text_to_speech)
+            import numpy # только при включенных процессах TTS: ядро без них не зависит от numpy
+            data = numpy.ascontiguousarray(data, dtype=numpy.float32)
+            shm = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+            numpy.ndarray(data.shape, dtype=numpy.float32, buffer=shm.buf)[...] = data
+            shm.close() # блок удаляет (unlink) основной процесс, когда заберет данные
+            results.put(("done", req_id, (shm.name, data.shape, sample_rate, time_queue)))
+        except Exception as e:
+            results.put(("error", req_id, "{0}: {1}".format(type(e).__name__, e)))
+        current.value = -1
+
+
+class TTSWorkerPool:
+    def __init__(self, engine_id:str, workers:int = 1, metrics = None, plugins:list = ()):
+        self.engine_id = engine_id
+        self.workers = workers
+        self.plugins = list(plugins) # модули плагинов (кроме core), которые грузит каждый процесс
+        self.metrics = metrics # utils.metrics.Metrics: время в очереди и время рендера
+        self.stats = {"rendered": 0, "errors": 0, "pending": 0, "max_pending": 0}
+
+        self._ctx = multiprocessing.get_context("spawn") # fork и torch/потоки несовместимы
+        self._requests = self._ctx.Queue()
+        self._results = self._ctx.Queue()
+        self._processes = []
+        self._futures = {} # id запроса -> Future
+        self._current = [] # по процессу: id запроса, который он сейчас озвучивает (-1 - свободен)
+        self._ids = itertools.count()
+        self._lock = Lock()
+        self._reader:Thread = None
+        self._running = False
+
+    def start(self, timeout:float = 300.0):
+        # ждет загрузки модели во всех процессах; при ошибке - TTSWorkerError, процессы останавливаются
+        for worker_id in range(self.workers):
+            self._processes.append(self._start_process(worker_id))
+
+        time_end = time.monotonic() + timeout
+        ready = 0
+        while ready < self.workers:
+            try:
+                kind, worker_id, value = self._results.get(timeout=max(0.1, time_end - time.monotonic()))
+            except queue.Empty:
+                self.stop()
+                raise TTSWorkerError("TTS workers: процессы не загрузились за {0} сек".format(timeout))
+            if kind == "init_error":
+                self.stop()
+                raise TTSWorkerError("TTS worker {0}: ошибка инициализации {1}: {2}".format(worker_id, self.engine_id, value))
+            ready += 1
+
+        self._running = True
+        self._reader = Thread(target=self._read_results, name="vacore-tts-workers-reader", daemon=True)
+        self._reader.start()
+
+    def stop(self):
+        self._running = False
+        for _ in self._processes:
+            self._requests.put(None)
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+        with self._lock:
+            futures = list(self._futures.values())
+            self._futures.clear()
+            self.stats["pending"] = 0
+        for future in futures:
+            future.set_exception(TTSWorkerError("TTS workers остановлены"))
+
+    def submit(self, text_to_speech:str, callname:str = "") -> Future:
+        future = Future()
+        with self._lock:
+            req_id = next(self._ids)
+            future.req_id = req_id
+            self._futures[req_id] = future
+            self.stats["pending"] += 1
+            self.stats["max_pending"] = max(self.stats["max_pending"], self.stats["pending"])
+        self._requests.put((req_id, text_to_speech, callname, time.time()))
+        return future
+
+    def render(self, text_to_speech:str, callname:str = "", timeout:float = None):
+        # (numpy float32, sample_rate) - как у tobuffer плагинов TTS
+        time_start = time.perf_counter()
+        future = self.submit(text_to_speech, callname)
+        try:
+            res = future.result(timeout)
+        except FutureTimeoutError:
+            # ответ, если и придет, уже не нужен; блок памяти освободит _read_results
+            with self._lock:
+                self._futures.pop(future.req_id, None)
+                self.stats["pending"] = len(self._futures)
+            raise TTSWorkerError("TTS workers: нет ответа за {0} сек".format(timeout))
+        if self.metrics is not None:
+            self.metrics.observe("tts_worker_render", time.perf_counter() - time_start, self.engine_id)
+        return res
+
+    def _read_results(self):
+        while self._running:
+            try:
+                kind, req_id, value = self._results.get(timeout=1.0)
+            except queue.Empty:
+                self._check_alive()
+                continue
+            except (EOFError, OSError):
+                break
+
+            if kind == "ready" or kind == "init_error": # перезапущенный процесс
+                if kind == "init_error":
+                    print("TTS worker {0}: ошибка инициализации: {1}".format(req_id, value))
+                continue
+            with self._lock:
+                future = self._futures.pop(req_id, None)
+                self.stats["pending"] = len(self._futures)
+            if kind == "done":
+                shm_name, shape, sample_rate, time_queue = value
+                import numpy
+                shm = shared_memory.SharedMemory(name=shm_name)
+                try:
+                    data = numpy.ndarray(shape, dtype=numpy.float32, buffer=shm.buf).copy()
+                finally:
+                    shm.close()
+                    shm.unlink()
+                with self._lock:
+                    self.stats["rendered"] += 1
+                if self.metrics is not None:
+                    self.metrics.observe("tts_worker_queue", time_queue, self.engine_id)
+                if future is not None:
+                    future.set_result((data, sample_rate))
+            elif kind == "error":
+                with self._lock:
+                    self.stats["errors"] += 1
+                if future is not None:
+                    future.set_exception(TTSWorkerError(value))
+
+    def _start_process(self, worker_id:int):
+        if worker_id >= len(self._current):
+            self._current.append(self._ctx.Value("q", -1, lock=False))
+        self._current[worker_id].value = -1
+        process = self._ctx.Process(target=_worker_main, args=(self.engine_id, worker_id, self.plugins, self._requests, self._results,
+                                                               self._current[worker_id]),
+                                    name="vacore-tts-worker-{0}".format(worker_id), daemon=True)
+        process.start()
+        return process
+
+    def _check_alive(self):
+        # упавший процесс (например, нехватка памяти) перезапускаем; его запрос не вернется - ждущему сразу ошибка
+        for i, process in enumerate(self._processes):
+            if not process.is_alive() and self._running:
+                print("TTS worker {0}: процесс завершился (код {1}), перезапускаю".format(i, process.exitcode))
+                lost = self._current[i].value
+                with self._lock:
+                    futures = [self._futures.pop(lost)] if lost in self._futures else []
+                    self.stats["pending"] = len(self._futures)
+                    self.stats["errors"] += len(futures)
+                for future in futures:
+                    future.set_exception(TTSWorkerError("TTS worker {0}: процесс завершился во время озвучки".format(i)))
+                self._processes[i] = self._start_process(i)
+
+    def summary(self) -> str:
+        return "TTS workers ({0}): processes={1} rendered={2} errors={3} queue={4} max_queue={5}".format(
+            self.engine_id, len(self._processes), self.stats["rendered"], self.stats["errors"],
+            self.stats["pending"], self.stats["max_pending"])
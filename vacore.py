@@ -8,11 +8,27 @@ import requests
 
 from termcolor import colored, cprint
 import time
-from threading import Timer
+from threading import Lock, RLock
+from contextvars import ContextVar, copy_context
+import asyncio
+import functools
+import itertools
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 from typing import Dict, List, Tuple
+from collections import OrderedDict
 
 from jaa import JaaCore
+from utils.metrics import Metrics
+from utils.scheduler import Scheduler, ScheduledJob
+from utils.timer_journal import TimerJournal
+from utils.tts_cache import TTSCache
+from utils.hot_phrases import HotPhraseCache, HotPhrase
+from utils.sentences import split_sentences
+from utils.tts_workers import TTSWorkerPool, TTSWorkerError
+from utils.engine_loader import EngineLoader
+from utils.tts_chain import TTSChain
 
 from collections.abc import Callable
 
@@ -22,19 +38,238 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+
+class TTSBufferError(Exception):
+    # озвучку не получить в виде PCM: движок не создал файл или пишет не PCM WAV (mp3, float WAV)
+    pass
+
+# ----------- command index -----------
+
+class _CommandTrieNode:
+    __slots__ = ("children", "keyalls")
+
+    def __init__(self):
+        self.children: Dict[str, "_CommandTrieNode"] = {}
+        self.keyalls: List[str] = [] # ключи контекста ("a|b|c"), команды которых заканчиваются на этом слове
+
+
+class CommandTrie:
+    """
+    Пословное префиксное дерево по командам контекста в формате Ирины ({"a|b|c": val, ...})
+
+    Строится один раз; поиск идет за время, пропорциональное числу слов во фразе.
+    Возвращает полное совпадение либо самое длинное совпадение по началу фразы.
+    """
+    def __init__(self, context:dict = None):
+        self.root = _CommandTrieNode()
+        self.fingerprint = 0 # отпечаток набора команд, для кеша fuzzy-результатов
+        if context is not None:
+            for keyall in context.keys():
+                self.add(keyall)
+
+    def _nodes(self, keyall:str, create:bool):
+        for key in keyall.split("|"):
+            node = self.root
+            for word in key.split():
+                next_node = node.children.get(word)
+                if next_node is None:
+                    if not create:
+                        break
+                    next_node = _CommandTrieNode()
+                    node.children[word] = next_node
+                node = next_node
+            else:
+                yield node
+
+    def add(self, keyall:str):
+        self.fingerprint = hash((self.fingerprint, keyall))
+        for node in self._nodes(keyall, True):
+            if keyall not in node.keyalls:
+                node.keyalls.append(keyall) # как и раньше, выигрывает первая зарегистрированная команда
+
+    def remove(self, keyall:str):
+        self.fingerprint = hash((self.fingerprint, "-", keyall))
+        for node in self._nodes(keyall, False):
+            if keyall in node.keyalls:
+                node.keyalls.remove(keyall)
+
+    def find(self, command:str, allow_rest_phrase:bool = True):
+        """
+        Возвращает tuple(key_in_context, rest_phrase) или None
+        """
+        words = command.split()
+        node = self.root
+        best_keyalls = node.keyalls
+        best_pos = 0
+        for pos, word in enumerate(words):
+            node = node.children.get(word)
+            if node is None:
+                break
+            if len(node.keyalls) > 0:
+                best_keyalls = node.keyalls
+                best_pos = pos + 1
+
+        if len(best_keyalls) == 0:
+            return None
+        if best_pos == len(words):
+            return (best_keyalls[0], "")
+        if allow_rest_phrase:
+            return (best_keyalls[0], " ".join(words[best_pos:]))
+        return None
+
+
+class ContextIndex(dict):
+    """
+    Заранее проиндексированный контекст в формате Ирины ({"a|b|c": val, ...})
+
+    Передается везде, где принимается словарь-контекст (find_best_cmd_with_fuzzy, context_set, execute_next).
+    Плагин создает его один раз - индекс команд и подготовка fuzzy processors делаются сразу,
+    а не при каждом вызове. Индекс можно обновлять по ходу (как обычный словарь), после пачки
+    изменений стоит вызвать prepare(), чтобы fuzzy processors пересчитали свои данные заранее.
+
+    Пример:
+    index = ContextIndex(core, {"ну погоди": "nu_pogodi.mkv"})
+    index["простоквашино"] = "prostokvashino.avi"
+    index.prepare()
+    res = core.find_best_cmd_with_fuzzy(phrase, index, False, 0.7)
+    """
+    def __init__(self, core:"VACore", context:dict = None):
+        dict.__init__(self)
+        self.core = core
+        self.trie = CommandTrie()
+        if context is not None:
+            self.update(context)
+        self.prepare()
+
+    def prepare(self):
+        self.core.prepare_context(self)
+
+    def __setitem__(self, keyall, value):
+        if keyall not in self:
+            self.trie.add(keyall)
+        dict.__setitem__(self, keyall, value)
+
+    def __delitem__(self, keyall):
+        dict.__delitem__(self, keyall)
+        self.trie.remove(keyall)
+
+    def update(self, *args, **kwargs):
+        for keyall, value in dict(*args, **kwargs).items():
+            self[keyall] = value
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def setdefault(self, keyall, default = None):
+        if keyall not in self:
+            self[keyall] = default
+        return self[keyall]
+
+    def pop(self, keyall, *args):
+        if keyall in self:
+            self.trie.remove(keyall)
+        return dict.pop(self, keyall, *args)
+
+    def popitem(self):
+        keyall, value = dict.popitem(self)
+        self.trie.remove(keyall)
+        return keyall, value
+
+    def clear(self):
+        dict.clear(self)
+        fingerprint = self.trie.fingerprint
+        self.trie = CommandTrie()
+        self.trie.fingerprint = hash((fingerprint, "clear"))
+
+# ----------- sessions -----------
+
+class VASession:
+    """
+    Состояние выполнения команд для одного клиента (микрофон, браузер, вебсокет и т.д.)
+
+    Хранит контекст с его таймером, формат ответа (remoteTTS), результат TTS, имя, по которому обратились,
+    и полную фразу. Плагины по-прежнему работают через core.context, core.remoteTTS и т.д. -
+    это поля текущей сессии. Сессию можно передать в execute_next и run_input_str,
+    тогда несколько клиентов обслуживаются параллельно одним ядром с одними загруженными плагинами.
+    """
+    def __init__(self, remoteTTS:str = "none"):
+        self.context = None
+        self.contextTimer:ScheduledJob = None
+        self.contextTimerLastDuration = 0
+
+        self.remoteTTS:str = remoteTTS # формат ответа - none, saytxt, saywav или их комбинация через ,
+        self.remoteTTSResult = None
+        self.audioFormat:str = "" # профиль формата звука для клиента (pcm16k, ulaw8k...), см. utils.audio.FORMAT_PROFILES
+        self.lastSay:str = ""
+
+        self.cur_callname:str = ""
+        self.input_cmd_full:str = ""
+
+        self.speculation = None # (команда, future с результатом поиска) - см. VACore.speculate_input_str
+
+        self.lock = RLock() # одна сессия выполняет команды последовательно
+        self.async_lock:asyncio.Lock = None # то же для async-вызовов - ждут в event loop, а не занимая поток пула (см. VACore.run_async_session)
+
+_current_session:ContextVar = ContextVar("vacore_session", default=None)
+
+def _session_attr(name:str):
+    # поле текущей сессии, доступное как core.<name>
+    return property(lambda self: getattr(self.session, name),
+                    lambda self, value: setattr(self.session, name, value))
+
 # main VACore class
 
 class VACore(JaaCore):
+    context = _session_attr("context")
+    contextTimer = _session_attr("contextTimer")
+    contextTimerLastDuration = _session_attr("contextTimerLastDuration")
+    remoteTTS = _session_attr("remoteTTS")
+    remoteTTSResult = _session_attr("remoteTTSResult")
+    lastSay = _session_attr("lastSay")
+    cur_callname = _session_attr("cur_callname")
+    input_cmd_full = _session_attr("input_cmd_full")
+
     def __init__(self):
         JaaCore.__init__(self)
 
-        self.timers = [-1,-1,-1,-1,-1,-1,-1,-1]
-        self.timersFuncUpd = [None,None,None,None,None,None,None,None]
-        self.timersFuncEnd = [None,None,None,None,None,None,None,None]
-        self.timersDuration = [0,0,0,0,0,0,0,0]
+        self.default_session = VASession() # сессия по умолчанию - для консольных запусков, таймеров и т.п.
+
+        self.metrics = Metrics() # задержки по этапам обработки команды
+
+        self.backgroundEngineInit:bool = True # движки TTS, нормализатор и пр. грузятся в фоне, команды принимаются сразу
+        self.engine_loader = EngineLoader(metrics=self.metrics)
+
+        self.scheduler = Scheduler("vacore-scheduler") # один поток на все сроки контекстов
+
+        # async-выполнение команд (для FastAPI и других asyncio-клиентов)
+        self.asyncMaxWorkers:int = 4 # потоков для выполнения плагинов и TTS
+        self.asyncMaxInflight:int = 16 # сколько команд может выполняться/ждать в пуле одновременно
+        self.async_executor:ThreadPoolExecutor = None
+        self._async_semaphore:asyncio.Semaphore = None
+
+        # предварительный поиск команды по промежуточным результатам распознавания
+        self.speculativeResolve:bool = False
+        self.speculation_executor:ThreadPoolExecutor = None
+        # rolled_back - найденная заранее полная команда не совпала с финальной; discarded - промежуточная фраза еще не была полной командой
+        self.speculation_stats:Dict[str, int] = {"started": 0, "committed": 0, "rolled_back": 0, "discarded": 0}
+        self._speculation_lock = Lock() # статистику меняют поток распознавания, event loop и потоки пула
+
+        # таймеры плагинов: без ограничения количества, срабатывают сами из отдельного планировщика
+        # обработчики выполняются по одному в отдельном потоке, чтобы проигрывание звука не задерживало другие таймеры
+        self.timers:Dict[int, ScheduledJob] = {} # id таймера -> задание
+        self._timers_ids = itertools.count()
+        self._timers_lock = Lock()
+        self.timers_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vacore-timer")
+        self.timers_scheduler = Scheduler("vacore-timers", executor=self.timers_executor)
+        self.timersJournal:bool = True # сохранять таймеры на диск, чтобы пережить перезапуск
+        self.timers_journal:TimerJournal = None
 
         self.commands = {
         }
+        self.commands_trie = CommandTrie()
+        self._context_tries = {} # id(context) -> (context, frozenset(keys), CommandTrie)
+        self._context_tries_lock = Lock() # execute_next идет параллельно в потоках пула
 
         self.plugin_commands = {
         }
@@ -50,6 +285,17 @@ class VACore(JaaCore):
 
         self.fuzzy_processors: Dict[str, tuple[Callable,Callable]] = {
         }
+        self.fuzzyProcessorTimeout:float = 2.0 # сек, сколько ждем каждый fuzzy processor
+        self.fuzzyProcessorTimeouts:Dict[str, float] = {} # индивидуальные таймауты по id процессора
+        self.fuzzyMaxWorkers:int = 4
+        self.fuzzy_executor:ThreadPoolExecutor = None
+        self.fuzzy_processors_stats:Dict[str, Dict] = {} # calls, wins, timeouts, errors, time_total, time_last
+        self._fuzzy_stats_lock = Lock()
+        self._fuzzy_stragglers:Dict[str, int] = {} # id процессора -> сколько его вызовов не уложились в таймаут и еще работают
+        self.fuzzyCacheSize:int = 256 # 0 - не кешировать результаты fuzzy processors
+        self.fuzzy_cache:OrderedDict = OrderedDict() # (command, context fingerprint, allow_rest_phrase, threshold) -> res
+        self.fuzzy_cache_stats:Dict[str, int] = {"hits": 0, "misses": 0}
+        self._fuzzy_cache_lock = Lock()
 
         # more options
         self.mpcHcPath = ""
@@ -64,6 +310,41 @@ class VACore(JaaCore):
 
         self.useTTSCache = False
         self.tts_cache_dir = "tts_cache"
+        self.ttsCacheMaxMB:int = 500 # размер кеша озвучки на диске; 0 - без ограничения
+        self.tts_cache:TTSCache = None
+        self._tts_cache_lock = Lock()
+        self.tts_plugins:Dict[str, str] = {} # id движка TTS -> плагин (его опции - параметры голоса)
+        self.normalizer_plugins:Dict[str, str] = {} # id нормализатора -> плагин (для процессов TTS workers)
+
+        # частые фразы держим в памяти уже озвученными
+        self.hotPhrases:List[str] = [] # дополнительные фразы для озвучки при старте (кроме reply* из опций плагинов)
+        self.hotPhrasesMaxItems:int = 64
+        self.hot_phrases = HotPhraseCache(self.hotPhrasesMaxItems)
+        self.hot_phrases_executor:ThreadPoolExecutor = None
+
+        # длинные ответы озвучиваются по предложениям: следующее рендерится, пока играет текущее (включается опцией)
+        self.ttsStreamSentences:bool = False
+        self.ttsStreamMinChars:int = 120 # текст короче озвучивается целиком
+        self.ttsStreamBatch:int = 2 # предложений за один вызов TTS (кроме первого)
+        self.tts_stream_executor:ThreadPoolExecutor = None
+
+        # say_template: постоянные части шаблонов озвучиваются один раз
+        self.ttsTemplateCache:bool = False
+        self.ttsTemplateCrossfadeMs:int = 15
+        self.template_segments = HotPhraseCache(256, promote_after=1)
+
+        # движок TTS в отдельных процессах (0 - в основном процессе)
+        self.ttsWorkers:int = 0
+        self.ttsWorkersTimeout:float = 60.0 # сек, сколько ждем озвучку одной фразы
+        self.tts_workers:TTSWorkerPool = None
+
+        # цепочка движков: если ttsEngineId не успел за свой бюджет (p95 задержек), параллельно озвучивает следующий
+        self.ttsEngineChain:List[str] = [] # запасные движки, по порядку
+        self.ttsHedgeQuantile:float = 0.95
+        self.ttsHedgeMinBudget:float = 0.5 # сек
+        self.ttsHedgeDefaultBudget:float = 3.0 # сек, пока по движку нет статистики
+        self.tts_chain:TTSChain = None
+        self.tts_chain_keys:Dict[str, str] = {} # движок цепочки -> ключ его загрузки (см. engine_wait)
         self.ttsEngineId = ""
         self.ttsEngineId2 = ""
         self.playWavEngineId = ""
@@ -72,14 +353,7 @@ class VACore(JaaCore):
         self.logPolicy = ""
         self.tmpdir = "temp"
         self.tmpcnt = 0
-
-        self.lastSay = ""
-        self.remoteTTS = "none"
-        self.remoteTTSResult = None
-
-        self.context = None
-        self.contextTimer = None
-        self.contextTimerLastDuration = 0
+        self._tmpcnt_lock = Lock()
 
         self.contextDefaultDuration = 10
         self.contextRemoteWaitForCall = False
@@ -87,10 +361,6 @@ class VACore(JaaCore):
         import mpcapi.core
         self.mpchc = mpcapi.core.MpcAPI()
 
-        self.cur_callname:str = ""
-
-        self.input_cmd_full:str = ""
-
         self.fastApiApp = None
 
         self.log_console = True
@@ -119,6 +389,7 @@ class VACore(JaaCore):
         self.display_init_info()
 
         self.setup_assistant_voice()
+        self.hot_phrases_warmup()
 
     # ----------- process plugins functions ------
     def process_plugin_manifest(self,modname,manifest):
@@ -136,16 +407,19 @@ class VACore(JaaCore):
                 else:
                     # normal add command
                     self.commands[cmd] = manifest["commands"][cmd]
+                self.commands_trie.add(cmd)
 
                 if modname in self.plugin_commands:
                     self.plugin_commands[modname].append(cmd)
                 else:
                     self.plugin_commands[modname] = [cmd]
+            self.fuzzy_cache_clear()
 
         # adding tts engines from plugin manifest
         if "tts" in manifest: # process commands
             for cmd in manifest["tts"].keys():
                 self.ttss[cmd] = manifest["tts"][cmd]
+                self.tts_plugins[cmd] = modname
 
         # adding playwav engines from plugin manifest
         if "playwav" in manifest: # process commands
@@ -156,11 +430,13 @@ class VACore(JaaCore):
         if "normalizer" in manifest:  # process commands
             for cmd in manifest["normalizer"].keys():
                 self.normalizers[cmd] = manifest["normalizer"][cmd]
+                self.normalizer_plugins[cmd] = modname
 
         # adding fuzzy processors engines from plugin manifest
         if "fuzzy_processor" in manifest: # process commands
             for cmd in manifest["fuzzy_processor"].keys():
                 self.fuzzy_processors[cmd] = manifest["fuzzy_processor"][cmd]
+            self.fuzzy_cache_clear()
 
         # adding ai_tools from plugin manifest
         if "ai_tools" in manifest:  # process ai_tools
@@ -183,7 +459,53 @@ class VACore(JaaCore):
     # ----------- text-to-speech functions ------
 
     def setup_assistant_voice(self):
-        # init playwav engine
+        # движки загружаются в фоне (backgroundEngineInit): команды принимаются сразу, текстовые ответы не ждут,
+        # а озвучка ждет только тот движок, который ей нужен (engine_wait)
+        self.engine_loader.background = self.backgroundEngineInit
+        self.engine_loader.submit("playwav", self.playWavEngineId, self._init_playwav)
+        if self.normalization_engine != "none":
+            self.engine_loader.submit("normalizer", self.normalization_engine, self._init_normalizer)
+        # при ошибке проигрывания TTS переключается на консоль - поэтому TTS после playwav
+        self.engine_loader.submit("tts", self.ttsEngineId, self._init_tts, ["playwav"])
+        self.engine_loader.submit("tts2", self.ttsEngineId2 or self.ttsEngineId, self._init_tts2, ["tts"])
+        self.setup_tts_chain()
+
+        # init all fuzzy_processors
+        for k in self.fuzzy_processors.keys():
+            self.engine_loader.submit("fuzzy:"+k, k, functools.partial(self._init_fuzzy_processor, k))
+
+    def setup_tts_chain(self):
+        engines = []
+        for engine_id in [self.ttsEngineId] + list(self.ttsEngineChain):
+            if engine_id in engines:
+                continue
+            if engine_id not in self.ttss or self.ttss[engine_id][1] != None or len(self.ttss[engine_id]) <= 2:
+                self.print_red("TTS chain: движок {0} не найден или не умеет озвучивать в файл - пропускаю".format(engine_id))
+                continue
+            engines.append(engine_id)
+        if len(engines) < 2:
+            return
+
+        for engine_id in engines:
+            if engine_id == self.ttsEngineId:
+                self.tts_chain_keys[engine_id] = "tts"
+            elif engine_id == self.ttsEngineId2:
+                self.tts_chain_keys[engine_id] = "tts2"
+            else:
+                self.tts_chain_keys[engine_id] = "tts_chain:"+engine_id
+                self.engine_loader.submit("tts_chain:"+engine_id, engine_id, functools.partial(self.ttss[engine_id][0], self))
+        self.tts_chain = TTSChain(engines, self._tts_chain_render, self.ttsHedgeQuantile, self.ttsHedgeMinBudget,
+                                  self.ttsHedgeDefaultBudget, metrics=self.metrics)
+
+    def _tts_chain_render(self, engine_id:str, text_to_speech:str, filename:str):
+        if self.engine_wait(self.tts_chain_keys[engine_id]): # движок не загрузился - сразу уступаем следующему
+            self._tts_engine_to_filewav(engine_id, text_to_speech, filename)
+
+    def engine_wait(self, key:str) -> bool:
+        # ждет загрузки движка: playwav, normalizer, tts, tts2, fuzzy:<id>
+        return self.engine_loader.wait(key)
+
+    def _init_playwav(self):
         try:
             self.playwavs[self.playWavEngineId][0](self)
         except Exception as e:
@@ -191,20 +513,21 @@ class VACore(JaaCore):
             self.print_red('Попробуйте установить в options/core.json: "playWavEngineId": "sounddevice"')
             self.print_red('...временно переключаюсь на консольный вывод ответа...')
             self.ttsEngineId = "console"
+            raise
 
-        # init normalization engine
-        if self.normalization_engine != "none":
-            try:
-                self.normalizers[self.normalization_engine][0](self)
-            except Exception as e:
-                self.print_error(f"Ошибка инициализации нормализатора {self.normalization_engine}", e)
-                self.print_red('Попробуйте установить в options/core.json: "normalization_engine": "none"')
-                self.normalization_engine = "none"
-
+    def _init_normalizer(self):
+        try:
+            self.normalizers[self.normalization_engine][0](self)
+        except Exception as e:
+            self.print_error(f"Ошибка инициализации нормализатора {self.normalization_engine}", e)
+            self.print_red('Попробуйте установить в options/core.json: "normalization_engine": "none"')
+            self.normalization_engine = "none"
+            raise
 
-        # init tts engine
+    def _init_tts(self):
         try:
-            self.ttss[self.ttsEngineId][0](self)
+            if not self.tts_workers_start(self.ttsEngineId):
+                self.ttss[self.ttsEngineId][0](self)
         except Exception as e:
             self.print_error("Ошибка инициализации плагина TTS (ttsEngineId)", e)
             cprint('Попробуйте установить в options/core.json: "ttsEngineId": "console" для тестирования вывода через консоль', "red")
@@ -221,8 +544,9 @@ class VACore(JaaCore):
 
             self.print_red('...временно переключаюсь на консольный вывод ответа...')
             self.ttsEngineId = "console"
+            raise
 
-        # init tts2 engine
+    def _init_tts2(self):
         if self.ttsEngineId2 == "":
             self.ttsEngineId2 = self.ttsEngineId
         if self.ttsEngineId2 != self.ttsEngineId:
@@ -230,21 +554,62 @@ class VACore(JaaCore):
                 self.ttss[self.ttsEngineId2][0](self)
             except Exception as e:
                 self.print_error("Ошибка инициализации плагина TTS2 (ttsEngineId2)", e)
+                raise
 
-        # init all fuzzy_processors
-        for k in self.fuzzy_processors.keys():
-            try:
-                self.fuzzy_processors[k][0](self)
-            except Exception as e:
-                self.print_error("Ошибка инициализации fuzzy_processor {0}".format(k), e)
+    def _init_fuzzy_processor(self, k:str):
+        try:
+            self.fuzzy_processors[k][0](self)
+        except Exception as e:
+            self.print_error("Ошибка инициализации fuzzy_processor {0}".format(k), e)
+            raise
+
+    def tts_workers_start(self, engine_id:str) -> bool:
+        # True - движок загружен в процессах пула; False - инициализировать как обычно, в этом процессе
+        if self.ttsWorkers <= 0 or engine_id not in self.ttss:
+            return False
+        if self.ttss[engine_id][1] != None or len(self.ttss[engine_id]) <= 2:
+            print("TTS workers: движок {0} сам проигрывает звук - работает в основном процессе".format(engine_id))
+            return False
+        if len(self.ttss[engine_id]) <= 3 or self.ttss[engine_id][3] is None:
+            # без tobuffer звук идет файлом, возможно не PCM (mp3) - из процесса его не передать
+            print("TTS workers: движок {0} не умеет озвучивать в память - работает в основном процессе".format(engine_id))
+            return False
+        print("TTS workers: запускаю {0} процесс(а) для {1}...".format(self.ttsWorkers, engine_id))
+        # в процессах загружаем только плагины движка и нормализатора, а не все плагины
+        plugins = [self.tts_plugins[engine_id]]
+        if self.normalization_engine in self.normalizer_plugins:
+            plugins.append(self.normalizer_plugins[self.normalization_engine])
+        pool = TTSWorkerPool(engine_id, self.ttsWorkers, self.metrics, plugins)
+        try:
+            pool.start()
+        except TTSWorkerError as e:
+            self.print_red(str(e))
+            self.print_red("...TTS будет работать в основном процессе...")
+            return False
+        self.tts_workers = pool
+        return True
+
+    def tts_workers_for(self, engine_id:str) -> TTSWorkerPool:
+        if self.tts_workers is not None and self.tts_workers.engine_id == engine_id:
+            return self.tts_workers
+        return None
+
+    def _tts_workers_to_filewav(self, pool:TTSWorkerPool, text_to_speech:str, filename:str):
+        from utils.audio import pcm_to_wav_bytes
+        data, sample_rate = pool.render(text_to_speech, self.cur_callname, self.ttsWorkersTimeout)
+        with open(filename, "wb") as wav_file:
+            wav_file.write(pcm_to_wav_bytes(data, sample_rate))
 
     def normalize(self, text:str):
+        self.engine_wait("normalizer")
         if self.normalization_engine == "none":
             return text
         else:
-            return self.normalizers[self.normalization_engine][1](self, text)
+            with self.metrics.span("normalize", self.normalization_engine):
+                return self.normalizers[self.normalization_engine][1](self, text)
 
-    def play_voice_assistant_speech(self,text_to_speech:str):
+    def play_voice_assistant_speech(self,text_to_speech:str,audio = None):
+        # audio - (numpy float32, sample_rate), если звук уже озвучен (например, склеен из шаблона - см. say_template)
         self.lastSay = text_to_speech
         remoteTTSList = self.remoteTTS.split(",")
 
@@ -252,22 +617,32 @@ class VACore(JaaCore):
         is_processed = False
         if "none" in remoteTTSList: # no remote tts, do locally anything
             #self.remoteTTSResult = "" # anywhere, set it ""
+            self.engine_wait("tts")
 
-            if self.ttss[self.ttsEngineId][1] != None:
-                self.ttss[self.ttsEngineId][1](self,text_to_speech)
+            if audio is not None:
+                if not self.play_audio_buffer(audio[0], audio[1]):
+                    from utils.audio import pcm_to_wav_bytes
+                    tts_file = self.get_tempfilename()+".wav"
+                    with open(tts_file, "wb") as wav_file:
+                        wav_file.write(pcm_to_wav_bytes(audio[0], audio[1]))
+                    try:
+                        self.play_wav(tts_file)
+                    finally:
+                        os.unlink(tts_file)
+            elif self.ttss[self.ttsEngineId][1] != None:
+                with self.metrics.span("tts_say", self.ttsEngineId):
+                    self.ttss[self.ttsEngineId][1](self,text_to_speech)
             else:
-                if self.useTTSCache:
-                    tts_file = self.get_tts_cache_file(text_to_speech)
+                hot = self.get_hot_phrase(text_to_speech)
+                sentences = self.tts_split_sentences(text_to_speech)
+                if hot is not None and hot.pcm is not None and self.play_audio_buffer(hot.pcm, hot.sample_rate):
+                    pass # проиграли из памяти
+                elif len(sentences) > 1:
+                    self.play_sentences_pipelined(sentences)
                 else:
-                    tts_file = self.get_tempfilename()+".wav"
-
-                #print('Temp TTS filename: ', tts_file)
-                if not self.useTTSCache or self.useTTSCache and not os.path.exists(tts_file):
-                    self.tts_to_filewav(text_to_speech, tts_file)
-
-                self.play_wav(tts_file)
-                if not self.useTTSCache and os.path.exists(tts_file):
-                    os.unlink(tts_file)
+                    rendered = self.tts_render_local(text_to_speech, allow_stream=True)
+                    self.hot_phrase_learn(text_to_speech, rendered=rendered)
+                    self.play_rendered(rendered, text_to_speech)
 
             is_processed = True
 
@@ -276,24 +651,30 @@ class VACore(JaaCore):
 
             is_processed = True
 
-        if "saywav" in remoteTTSList:
-            if self.useTTSCache:
-                tts_file = self.get_tts_cache_file(text_to_speech)
-            else:
-                tts_file = self.get_tempfilename()+".wav"
-
-            if not self.useTTSCache or self.useTTSCache and not os.path.exists(tts_file):
-                self.tts_to_filewav(text_to_speech, tts_file)
-            #self.play_wav(tts_file)
+        if "saywav" in remoteTTSList or "saywavbin" in remoteTTSList:
+            # saywav - WAV в base64 (для JSON), saywavbin - WAV как есть (bytes), клиенту уходит бинарными данными
             import base64
+            self.engine_wait("tts")
+            hot = self.get_hot_phrase(text_to_speech) if audio is None else None
+            encoded_string = None
+            if audio is not None:
+                from utils.audio import pcm_to_wav_bytes
+                wav_bytes = pcm_to_wav_bytes(audio[0], audio[1])
+            elif hot is not None:
+                wav_bytes = hot.wav_bytes
+                encoded_string = hot.wav_base64
+            else:
+                wav_bytes = self.tts_to_cached_wav_bytes(text_to_speech)
+                self.hot_phrase_learn(text_to_speech, wav_bytes=wav_bytes)
 
-            with open(tts_file, "rb") as wav_file:
-                encoded_string = base64.b64encode(wav_file.read())
-
-            if not self.useTTSCache and os.path.exists(tts_file):
-                os.unlink(tts_file)
+            if self.session.audioFormat not in ("", "original"):
+                wav_bytes = self.transcode_wav_for_client(text_to_speech, wav_bytes, self.session.audioFormat, hot, audio is None)
+                encoded_string = None
 
-            self.remoteTTSResult["wav_base64"] = encoded_string
+            if "saywav" in remoteTTSList:
+                self.remoteTTSResult["wav_base64"] = encoded_string if encoded_string is not None else base64.b64encode(wav_bytes)
+            if "saywavbin" in remoteTTSList:
+                self.remoteTTSResult["wav_bytes"] = wav_bytes
 
             is_processed = True
 
@@ -308,7 +689,38 @@ class VACore(JaaCore):
     def say(self,text_to_speech:str): # alias for play_voice_assistant_speech
         self.play_voice_assistant_speech(text_to_speech)
 
+    def say_template(self, template:str, *args, **kwargs):
+        """
+        Озвучивает шаблон с подстановками, например: core.say_template("Ставлю таймер на {0}", txt)
+
+        Постоянные части шаблона озвучиваются один раз и берутся из кеша, заново озвучиваются только подстановки;
+        куски склеиваются с коротким перекрестным затуханием. Текст ответа (saytxt, lastSay) - как у обычного say.
+        """
+        text_to_speech = template.format(*args, **kwargs)
+        remoteTTSList = self.remoteTTS.split(",")
+        if "none" in remoteTTSList or "saywav" in remoteTTSList or "saywavbin" in remoteTTSList:
+            self.engine_wait("tts")
+        if (not self.ttsTemplateCache or self.ttss[self.ttsEngineId][1] != None or len(self.ttss[self.ttsEngineId]) <= 2
+                or not ("none" in remoteTTSList or "saywav" in remoteTTSList or "saywavbin" in remoteTTSList)
+                or self.get_hot_phrase(text_to_speech) is not None):
+            return self.play_voice_assistant_speech(text_to_speech)
+
+        pieces = self.template_pieces(template, args, kwargs)
+        if len([text for text, is_slot in pieces if not is_slot]) == 0:
+            return self.play_voice_assistant_speech(text_to_speech) # кешировать нечего
+
+        try:
+            with self.metrics.span("tts_template", self.ttsEngineId):
+                audio = self.tts_template_to_buffer(pieces)
+        except Exception as e:
+            print("Ошибка озвучки шаблона, озвучиваю целиком: {0}".format(e))
+            audio = None
+        if audio is None: # кусок не разобрать (движок пишет mp3 и т.п.) - обычная озвучка
+            return self.play_voice_assistant_speech(text_to_speech)
+        self.play_voice_assistant_speech(text_to_speech, audio)
+
     def say2(self,text_to_speech:str): # озвучивает через второй движок
+        self.engine_wait("tts2")
         if self.ttss[self.ttsEngineId2][1] != None:
             self.ttss[self.ttsEngineId2][1](self,text_to_speech)
         else:
@@ -320,27 +732,387 @@ class VACore(JaaCore):
                 os.unlink(tempfilename)
 
 
-    def tts_to_filewav(self,text_to_speech:str,filename:str):
-        if len(self.ttss[self.ttsEngineId]) > 2:
-            self.ttss[self.ttsEngineId][2](self,text_to_speech,filename)
-        else:
-            print("File save not supported by this TTS")
+    def tts_to_filewav(self,text_to_speech:str,filename:str) -> str:
+        # возвращает id движка, который озвучил (при цепочке движков может быть запасной)
+        if self.tts_chain is not None:
+            return self.tts_chain.render(text_to_speech, filename)
+        self.engine_wait("tts")
+        return self._tts_engine_to_filewav(self.ttsEngineId, text_to_speech, filename)
 
     def tts_to_filewav2(self,text_to_speech:str,filename:str): # через второй движок
-        if len(self.ttss[self.ttsEngineId2]) > 2:
-            self.ttss[self.ttsEngineId2][2](self,text_to_speech,filename)
+        self.engine_wait("tts2")
+        self._tts_engine_to_filewav(self.ttsEngineId2, text_to_speech, filename)
+
+    def _tts_engine_to_filewav(self, engine_id:str, text_to_speech:str, filename:str) -> str:
+        pool = self.tts_workers_for(engine_id)
+        if pool is not None:
+            with self.metrics.span("tts_to_filewav", engine_id):
+                self._tts_workers_to_filewav(pool, text_to_speech, filename)
+        elif len(self.ttss[engine_id]) > 2:
+            with self.metrics.span("tts_to_filewav", engine_id):
+                self.ttss[engine_id][2](self,text_to_speech,filename)
         else:
             print("File save not supported by this TTS")
+            return None
+        return engine_id
 
     def get_tempfilename(self):
-        self.tmpcnt += 1
-        return self.tmpdir+"/vacore_"+str(self.tmpcnt)
+        # озвучка идет из нескольких потоков (и процессов) - имена не должны совпадать
+        with self._tmpcnt_lock:
+            self.tmpcnt += 1
+            tmpcnt = self.tmpcnt
+        return self.tmpdir+"/vacore_"+str(os.getpid())+"_"+str(tmpcnt)
+
+    def tts_to_cached_filewav(self, text_to_speech:str) -> str:
+        # озвучка в файл через кеш (если useTTSCache); без кеша (или запасным движком) - во временный файл,
+        # после использования - play_rendered_cleanup(("file", filename)).
+        # Наличие файла кеша не проверяется - если его удалили с диска, см. tts_cache_file_lost
+        if self.useTTSCache:
+            # озвучку запасным движком цепочки в кеш не пишем - ключ кеша от основного
+            return self.get_tts_cache().get_or_render(self.get_tts_cache_key(text_to_speech),
+                                                      lambda filename: self.tts_to_filewav(text_to_speech, filename) == self.ttsEngineId,
+                                                      self.ttsEngineId)
+        tts_file = self.get_tempfilename()+".wav"
+        self.tts_to_filewav(text_to_speech, tts_file)
+        return tts_file
+
+    def tts_to_cached_wav_bytes(self, text_to_speech:str) -> bytes:
+        for attempt in range(2):
+            tts_file = self.tts_to_cached_filewav(text_to_speech)
+            try:
+                with open(tts_file, "rb") as wav_file:
+                    return wav_file.read()
+            except FileNotFoundError:
+                if attempt > 0 or not self.useTTSCache:
+                    raise
+                self.tts_cache_file_lost(text_to_speech)
+            finally:
+                self.play_rendered_cleanup(("file", tts_file))
+
+    def tts_cache_file_lost(self, text_to_speech:str):
+        # файл кеша удалили с диска - убираем из индекса, следующий запрос озвучит заново
+        self.get_tts_cache().invalidate(self.get_tts_cache_key(text_to_speech))
+
+    # ------- шаблоны: постоянные части из кеша + подстановки ----------
+    def template_pieces(self, template:str, args:tuple, kwargs:dict) -> List[Tuple[str, bool]]:
+        # [(текст, подстановка ли)]; куски без букв и цифр (", " между подстановками) не озвучиваются
+        from string import Formatter
+        formatter = Formatter()
+        res = []
+        auto_ind = 0
+        for literal, field_name, format_spec, conversion in formatter.parse(template):
+            if any(ch.isalnum() for ch in literal):
+                res.append((literal.lstrip(" ,.;:").strip(), False))
+            if field_name is None:
+                continue
+            if field_name == "":
+                field_name = str(auto_ind)
+                auto_ind += 1
+            value = formatter.get_field(field_name, args, kwargs)[0]
+            value = format(formatter.convert_field(value, conversion), format_spec or "")
+            if value.strip() != "":
+                res.append((value.strip(), True))
+        return res
+
+    def tts_template_to_buffer(self, pieces:List[Tuple[str, bool]]):
+        # None - какой-то кусок не удалось получить как PCM
+        from utils.audio import resample, trim_silence, concat_crossfade, to_mono
+        buffers = []
+        sample_rate = None
+        for text, is_slot in pieces:
+            res = self.tts_to_buffer(text) if is_slot else self._tts_template_fixed(text)
+            if res is None:
+                return None
+            data, rate = res
+            data = to_mono(data)
+            if sample_rate is None:
+                sample_rate = rate
+            buffers.append(trim_silence(resample(data, rate, sample_rate), keep=int(sample_rate * 0.04)))
+        return concat_crossfade(buffers, int(sample_rate * self.ttsTemplateCrossfadeMs / 1000)), sample_rate
+
+    def _tts_template_fixed(self, text_to_speech:str):
+        # постоянная часть шаблона: из памяти, иначе из кеша TTS на диске (если включен), иначе озвучиваем; None - не PCM WAV
+        key = self.get_tts_cache_key(text_to_speech)
+        segment = self.template_segments.get(key)
+        if segment is None:
+            if self.useTTSCache:
+                wav_bytes = self.tts_to_cached_wav_bytes(text_to_speech)
+            else:
+                from utils.audio import pcm_to_wav_bytes
+                wav_bytes = pcm_to_wav_bytes(*self.tts_to_buffer(text_to_speech))
+            segment = self.template_segments.put(key, wav_bytes)
+        if segment.pcm is None:
+            return None
+        return segment.pcm, segment.sample_rate
+
+    # ------- формат звука для клиентов ----------
+    def transcode_wav_for_client(self, text_to_speech:str, wav_bytes:bytes, audio_format:str, hot:HotPhrase = None, use_cache:bool = True) -> bytes:
+        # пересчитанный вариант хранится рядом с оригиналом: в частой фразе (память) и в кеше TTS (диск)
+        from utils.audio import get_format_profile, transcode_wav
+        profile = get_format_profile(audio_format)
+        if hot is not None and audio_format in hot.variants:
+            return hot.variants[audio_format]
+
+        if self.useTTSCache and use_cache:
+            def render(filename:str):
+                with open(filename, "wb") as f:
+                    f.write(transcode_wav(wav_bytes, profile))
+            key = self.get_tts_cache_key(text_to_speech)+"_"+audio_format
+            for attempt in range(2):
+                with self.metrics.span("transcode", audio_format):
+                    tts_file = self.get_tts_cache().get_or_render(key, render, self.ttsEngineId)
+                try:
+                    with open(tts_file, "rb") as wav_file:
+                        res = wav_file.read()
+                    break
+                except FileNotFoundError:
+                    if attempt > 0:
+                        raise
+                    self.get_tts_cache().invalidate(key) # файл удалили с диска - пересчитываем заново
+        else:
+            with self.metrics.span("transcode", audio_format):
+                res = transcode_wav(wav_bytes, profile)
+
+        if hot is not None:
+            hot.variants[audio_format] = res
+        return res
+
+    # ------- озвучка в память ----------
+    def tts_supports_buffer(self, engine_id:str = None) -> bool:
+        # четвертый элемент в "tts" манифеста - tobuffer(core, text) -> (numpy float32, sample_rate)
+        if engine_id is None:
+            engine_id = self.ttsEngineId
+        if self.tts_chain is not None and engine_id == self.ttsEngineId:
+            return False # цепочка движков работает через файлы
+        if self.tts_workers_for(engine_id) is not None:
+            return True
+        return len(self.ttss[engine_id]) > 3 and self.ttss[engine_id][3] is not None
+
+    def tts_to_buffer(self, text_to_speech:str):
+        # (numpy float32, sample_rate); движки без tobuffer рендерят во временный файл.
+        # TTSBufferError - файл не создан или не PCM WAV; тогда нужен путь через файл (tts_to_filewav + play_wav)
+        self.engine_wait("tts")
+        if self.tts_supports_buffer():
+            pool = self.tts_workers_for(self.ttsEngineId)
+            time_start = time.perf_counter()
+            with self.metrics.span("tts_to_buffer", self.ttsEngineId):
+                if pool is not None:
+                    res = pool.render(text_to_speech, self.cur_callname, self.ttsWorkersTimeout)
+                else:
+                    res = self.ttss[self.ttsEngineId][3](self, text_to_speech)
+            time_render = time.perf_counter() - time_start
+            # длительность озвученного - для RTF (время синтеза / длительность аудио), суммарный RTF - в print_metrics_summary
+            duration = len(res[0]) / res[1]
+            self.metrics.add("tts_audio_seconds", duration, self.ttsEngineId)
+            if duration > 0:
+                logger.info("TTS %s: %.2f с аудио за %.2f с, RTF %.3f", self.ttsEngineId, duration, time_render, time_render / duration)
+            return res
+
+        from utils.audio import wav_bytes_to_pcm
+        tts_file = self.get_tempfilename()+".wav"
+        self.tts_to_filewav(text_to_speech, tts_file)
+        try:
+            if not os.path.exists(tts_file):
+                raise TTSBufferError("TTS {0}: движок не создал файл".format(self.ttsEngineId))
+            with open(tts_file, "rb") as wav_file:
+                res = wav_bytes_to_pcm(wav_file.read())
+            if res is None:
+                raise TTSBufferError("TTS {0}: звук не в формате PCM WAV (например, mp3), в память не разобрать".format(self.ttsEngineId))
+            return res
+        finally:
+            if os.path.exists(tts_file):
+                os.unlink(tts_file)
+
+    def tts_render_local(self, text_to_speech:str, allow_stream:bool = False):
+        # для проигрывания на этой машине: ("buffer", (data, sample_rate)) - если и TTS, и playwav умеют работать с памятью,
+        # ("stream", (куски, sample_rate)) - если allow_stream и оба умеют потоком (проигрывание начнется до конца загрузки),
+        # иначе ("file", filename)
+        self.engine_wait("tts")
+        if allow_stream and not self.useTTSCache and self.tts_supports_stream() and self.playwav_supports_stream():
+            stream = self.tts_to_stream(text_to_speech)
+            if stream is not None:
+                return ("stream", stream)
+        if not self.useTTSCache and self.tts_supports_buffer() and len(self.playwavs[self.playWavEngineId]) > 2:
+            return ("buffer", self.tts_to_buffer(text_to_speech))
+        return ("file", self.tts_to_cached_filewav(text_to_speech))
+
+    def play_rendered(self, rendered, text_to_speech:str = None):
+        # text_to_speech - чтобы озвучить заново, если файл кеша удалили с диска
+        kind, value = rendered
+        try:
+            if kind == "buffer":
+                self.play_audio_buffer(value[0], value[1])
+            elif kind == "stream":
+                self.play_audio_stream(value[0], value[1])
+            else:
+                try:
+                    self.play_wav(value)
+                except Exception:
+                    # наличие файла проверяем только при ошибке, а не при каждом попадании в кеш
+                    if text_to_speech is None or not self.useTTSCache or os.path.exists(value):
+                        raise
+                    self.tts_cache_file_lost(text_to_speech)
+                    self.play_rendered_cleanup(rendered)
+                    rendered = ("file", self.tts_to_cached_filewav(text_to_speech))
+                    self.play_wav(rendered[1])
+        finally:
+            self.play_rendered_cleanup(rendered)
+
+    def play_rendered_cleanup(self, rendered):
+        kind, value = rendered
+        if kind == "stream":
+            value[0].close() # незавершенная загрузка - закрываем соединение
+        elif kind == "file" and self.useTTSCache:
+            self.get_tts_cache().discard(value) # файлы кеша остаются, временные (запасной движок) удаляются
+        elif kind == "file" and os.path.exists(value):
+            os.unlink(value)
+
+    # ------- потоковая озвучка (удаленные движки) ----------
+    def tts_supports_stream(self) -> bool:
+        # пятый элемент в "tts" манифеста - tostream(core, text) -> (генератор кусков numpy float32, sample_rate) или None
+        engine = self.ttss[self.ttsEngineId]
+        if self.tts_chain is not None or self.tts_workers_for(self.ttsEngineId) is not None:
+            return False
+        return len(engine) > 4 and engine[4] is not None
+
+    def playwav_supports_stream(self) -> bool:
+        # четвертый элемент в "playwav" манифеста - playstream(core, куски, sample_rate)
+        engine = self.playwavs[self.playWavEngineId]
+        return len(engine) > 3 and engine[3] is not None
+
+    def tts_to_stream(self, text_to_speech:str):
+        # None - движок не может отдать этот текст потоком (например, формат не WAV)
+        with self.metrics.span("tts_to_stream", self.ttsEngineId): # до начала данных
+            return self.ttss[self.ttsEngineId][4](self, text_to_speech)
+
+    def play_audio_stream(self, chunks, sample_rate:int):
+        self.engine_wait("playwav")
+        with self.metrics.span("play_wav", self.playWavEngineId):
+            self.playwavs[self.playWavEngineId][3](self, chunks, sample_rate)
+
+    # ------- потоковая озвучка по предложениям ----------
+    def tts_split_sentences(self, text_to_speech:str) -> List[str]:
+        if not self.ttsStreamSentences or len(text_to_speech) < self.ttsStreamMinChars:
+            return [text_to_speech]
+        return self.tts_batch_sentences(split_sentences(text_to_speech))
+
+    def tts_batch_sentences(self, sentences:List[str]) -> List[str]:
+        # первое предложение - отдельно (быстрее начинаем говорить), остальные - по ttsStreamBatch за один вызов TTS
+        if self.ttsStreamBatch <= 1 or len(sentences) <= 2:
+            return sentences
+        return sentences[:1] + [" ".join(sentences[i:i+self.ttsStreamBatch]) for i in range(1, len(sentences), self.ttsStreamBatch)]
+
+    def play_sentences_pipelined(self, sentences:List[str]):
+        # пока играет предложение N, в отдельном потоке рендерится N+1 - первая фраза звучит после рендера только первого предложения
+        if self.tts_stream_executor is None:
+            self.tts_stream_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vacore-tts-stream")
+
+        def render(sentence:str):
+            # copy_context - чтобы в потоке рендера была текущая сессия (голос по имени обращения и пр.)
+            return self.tts_stream_executor.submit(copy_context().run, self.tts_render_local, sentence, True)
+
+        time_start = time.perf_counter()
+        next_future = render(sentences[0])
+        rendered = None # отрендерено, но еще не отдано в play_rendered (он убирает за собой сам)
+        try:
+            for i in range(len(sentences)):
+                future, next_future = next_future, None
+                rendered = future.result()
+                next_future = render(sentences[i+1]) if i+1 < len(sentences) else None
+                if i == 0:
+                    self.metrics.observe("tts_first_audio", time.perf_counter() - time_start, self.ttsEngineId)
+                current, rendered = rendered, None
+                self.play_rendered(current, sentences[i])
+        finally:
+            if rendered is not None:
+                self.play_rendered_cleanup(rendered)
+            if next_future is not None: # проигрывание прервалось - убираем уже отрендеренный файл
+                try:
+                    self.play_rendered_cleanup(next_future.result())
+                except Exception as e: # не подменяем исходную ошибку ошибкой фонового рендера
+                    logger.warning("Озвучка по предложениям: ошибка рендера следующего предложения: %s", e)
+
+    # ------- частые фразы в памяти ----------
+    def get_hot_phrase(self, text_to_speech:str) -> HotPhrase:
+        if self.hotPhrasesMaxItems <= 0 or len(self.ttss[self.ttsEngineId]) <= 2:
+            return None
+        return self.hot_phrases.get(self.get_tts_cache_key(text_to_speech))
+
+    def hot_phrase_learn(self, text_to_speech:str, rendered = None, wav_bytes:bytes = None):
+        # фраза повторяется - запоминаем ее озвучку в памяти
+        key = self.get_tts_cache_key(text_to_speech)
+        if not self.hot_phrases.should_promote(key):
+            return
+        if wav_bytes is None and rendered is not None:
+            kind, value = rendered
+            if kind == "buffer":
+                from utils.audio import pcm_to_wav_bytes
+                wav_bytes = pcm_to_wav_bytes(value[0], value[1])
+            elif kind == "file" and os.path.exists(value):
+                with open(value, "rb") as wav_file:
+                    wav_bytes = wav_file.read()
+        if wav_bytes is not None:
+            self.hot_phrases.put(key, wav_bytes)
+
+    def hot_phrases_collect(self) -> List[str]:
+        # статические ответы: строковые опции reply* всех плагинов + опция hotPhrases
+        phrases = []
+        for modname in self.plugin_manifests.keys():
+            options = self.plugin_options(modname) or {}
+            for k, v in options.items():
+                if str(k).startswith("reply") and isinstance(v, str) and v.strip() != "":
+                    phrases.append(v)
+        phrases.extend(self.hotPhrases)
+        return list(dict.fromkeys(phrases))[:self.hotPhrasesMaxItems]
+
+    def hot_phrases_warmup(self):
+        # озвучиваем частые фразы в фоне, чтобы не задерживать старт
+        self.hot_phrases = HotPhraseCache(self.hotPhrasesMaxItems)
+        if self.hotPhrasesMaxItems <= 0 or self.ttsEngineId not in self.ttss or len(self.ttss[self.ttsEngineId]) <= 2:
+            return
+        if self.hot_phrases_executor is None:
+            # один поток: не все движки TTS безопасно вызывать параллельно
+            self.hot_phrases_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vacore-hot")
+        for text in self.hot_phrases_collect():
+            self.hot_phrases_executor.submit(self._hot_phrase_render, text)
+
+    def _hot_phrase_render(self, text_to_speech:str):
+        try:
+            rendered = self.tts_render_local(text_to_speech)
+            kind, value = rendered
+            if kind == "buffer":
+                from utils.audio import pcm_to_wav_bytes
+                self.hot_phrases.put(self.get_tts_cache_key(text_to_speech), pcm_to_wav_bytes(value[0], value[1]))
+            elif os.path.exists(value):
+                with open(value, "rb") as wav_file:
+                    self.hot_phrases.put(self.get_tts_cache_key(text_to_speech), wav_file.read())
+            self.play_rendered_cleanup(rendered)
+        except Exception as e:
+            self.print_error("Ошибка озвучки частой фразы '{0}'".format(text_to_speech), e)
+
+    def get_tts_cache(self) -> TTSCache:
+        with self._tts_cache_lock:
+            if self.tts_cache is None:
+                self.tts_cache = TTSCache(self.tts_cache_dir, self.ttsCacheMaxMB * 1024 * 1024)
+        return self.tts_cache
+
+    def get_tts_cache_key(self, text_to_speech:str, engine_id:str = None) -> str:
+        # голос определяется опциями плагина движка (speaker, sample_rate и пр.) и нормализатором
+        if engine_id is None:
+            engine_id = self.ttsEngineId
+        options = {}
+        modname = self.tts_plugins.get(engine_id)
+        if modname is not None:
+            options = dict(self.plugin_options(modname) or {})
+            options.pop("v", None)
+            if "speaker_by_assname" in options:
+                options["cur_callname"] = self.cur_callname # голос может зависеть от имени обращения
+        key = json.dumps([engine_id, options, self.normalization_engine, text_to_speech], ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
 
     def get_tts_cache_file(self, text_to_speech:str):
-        hash = hashlib.md5(text_to_speech.encode('utf-8')).hexdigest()
-        text_slice = text_to_speech[:40]
-        filename = ".".join([text_slice, hash, "wav"])
-        return self.tts_cache_dir+"/"+self.ttsEngineId+"/"+filename
+        # имя файла в кеше (без озвучки); None - текст еще не озвучивался
+        return self.get_tts_cache().get(self.get_tts_cache_key(text_to_speech))
 
     def all_num_to_text(self,text:str):
         from utils.all_num_to_text import all_num_to_text
@@ -363,50 +1135,158 @@ class VACore(JaaCore):
         Возвращает tuple(key_in_context, схожесть (от 0.0 до 1.0), res_phrase)
         """
 
-        # первый проход - ищем полное совпадение
-        for keyall in context.keys():
-            keys = keyall.split("|")
-            for key in keys:
-                if command == key:
-                    return (keyall, 1.0, "")
-
-        if allow_rest_phrase: # если фраза может быть неполной
-            # второй проход - ищем частичное совпадение
-            for keyall in context.keys():
-                keys = keyall.split("|")
-                for key in keys:
-                    if command.startswith(key):
-                        rest_phrase = command[(len(key) + 1):]
-                        return (keyall, 1.0, rest_phrase)
+        # первый и второй проход - полное совпадение или самое длинное совпадение по началу фразы
+        # (если allow_rest_phrase - фраза может быть неполной)
+        with self.metrics.span("match_trie"):
+            trie = self.get_context_trie(context)
+            res = trie.find(command, allow_rest_phrase)
+        if res is not None:
+            keyall, rest_phrase = res
+            return (keyall, 1.0, rest_phrase)
 
         if threshold is None:
             threshold = self.plugin_options("core")["fuzzyThreshold"]
 
         # третий проход - ищем с помощью fuzzy_processors
-        # TODO: по хорошему надо пробежаться по всем процессорам, и выдать лучший результат,
-        # но пока берется просто первый прошедший пороговое значение
+        if len(self.fuzzy_processors) == 0:
+            return None
+
+        # одни и те же фразы повторяются постоянно - кешируем результат нечеткого сравнения
+        cache_key = (" ".join(command.split()), trie.fingerprint, allow_rest_phrase, threshold)
+        if self.fuzzyCacheSize > 0:
+            with self._fuzzy_cache_lock:
+                if cache_key in self.fuzzy_cache:
+                    self.fuzzy_cache.move_to_end(cache_key)
+                    self.fuzzy_cache_stats["hits"] += 1
+                    return self.fuzzy_cache[cache_key]
+                self.fuzzy_cache_stats["misses"] += 1
+
+        with self.metrics.span("match_fuzzy"):
+            res, is_complete = self._find_best_with_fuzzy_processors(command, context, allow_rest_phrase, threshold)
+
+        # результат с отвалившимися по таймауту/ошибке процессорами не кешируем - в следующий раз может быть другим
+        if self.fuzzyCacheSize > 0 and is_complete:
+            with self._fuzzy_cache_lock:
+                self.fuzzy_cache[cache_key] = res
+                while len(self.fuzzy_cache) > self.fuzzyCacheSize:
+                    self.fuzzy_cache.popitem(last=False)
+
+        return res
+
+    def fuzzy_cache_clear(self):
+        with self._fuzzy_cache_lock:
+            self.fuzzy_cache.clear()
+
+    def _find_best_with_fuzzy_processors(self, command, context, allow_rest_phrase:bool, threshold:float):
+        # все процессоры запускаются параллельно, у каждого свой дедлайн; выигрывает лучший результат,
+        # не успевшие к дедлайну процессоры брошены (их результат игнорируется).
+        # Таймаут отсчитывается с начала работы процессора, а не с постановки в очередь; в очереди ждем не дольше таймаута.
+        # Процессор, чей прошлый вызов завис (не уложился и еще работает), пропускается - он не занимает потоки пула снова
+        # Возвращает tuple(результат или None, все ли процессоры отработали без ошибок и таймаутов)
+        if self.fuzzy_executor is None:
+            self.fuzzy_executor = ThreadPoolExecutor(max_workers=self.fuzzyMaxWorkers, thread_name_prefix="fuzzy")
+
+        time_start = time.monotonic()
+        futures = {}
+        is_complete = True
         for fuzzy_processor_k in self.fuzzy_processors.keys():
-            res = None
+            if self.engine_loader.is_loading("fuzzy:"+fuzzy_processor_k):
+                is_complete = False # еще загружается - пока ищем команды без него
+                continue
+            with self._fuzzy_stats_lock:
+                is_stuck = self._fuzzy_stragglers.get(fuzzy_processor_k, 0) > 0
+            if is_stuck:
+                is_complete = False
+                logger.debug("Fuzzy processor %s пропущен: прошлый вызов еще работает", fuzzy_processor_k)
+                continue
+            started = [None] # время начала работы - заполняет поток пула
+            future = self.fuzzy_executor.submit(self._run_fuzzy_processor, fuzzy_processor_k, command, context, allow_rest_phrase, started)
+            futures[future] = (fuzzy_processor_k, self.fuzzyProcessorTimeouts.get(fuzzy_processor_k, self.fuzzyProcessorTimeout), started)
+
+        def deadline(future):
+            fuzzy_processor_k, timeout, started = futures[future]
+            return (started[0] if started[0] is not None else time_start) + timeout
+
+        results = {}
+        pending = set(futures.keys())
+        while len(pending) > 0:
+            timeout = max(0.0, min(deadline(f) for f in pending) - time.monotonic())
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                res, is_ok = future.result()
+                is_complete = is_complete and is_ok
+                if res is not None:
+                    results[futures[future][0]] = res
+
+            now = time.monotonic()
+            for future in [f for f in pending if deadline(f) <= now]:
+                fuzzy_processor_k = futures[future][0]
+                pending.discard(future)
+                is_complete = False
+                self._update_fuzzy_stats(fuzzy_processor_k, "timeouts")
+                if future.cancel():
+                    logger.warning("Fuzzy processor {0} не дождался свободного потока для '{1}'".format(fuzzy_processor_k, command))
+                    continue
+                # уже работает - остановить нельзя; до его окончания процессор пропускаем
+                with self._fuzzy_stats_lock:
+                    self._fuzzy_stragglers[fuzzy_processor_k] = self._fuzzy_stragglers.get(fuzzy_processor_k, 0) + 1
+                future.add_done_callback(lambda f, k=fuzzy_processor_k: self._fuzzy_straggler_done(k))
+                logger.warning("Fuzzy processor {0} не уложился в таймаут для '{1}'".format(fuzzy_processor_k, command))
+
+        best_k = None
+        best_res = None
+        for fuzzy_processor_k in self.fuzzy_processors.keys(): # при равенстве выигрывает процессор, зарегистрированный раньше
+            res = results.get(fuzzy_processor_k)
+            if res is not None:
+                keyall, probability, rest_phrase = res
+                if threshold < probability and (best_res is None or best_res[1] < probability):
+                    best_k = fuzzy_processor_k
+                    best_res = res
+
+        if best_res is not None:
+            self._update_fuzzy_stats(best_k, "wins")
+
+        return best_res, is_complete
+
+    def _fuzzy_straggler_done(self, fuzzy_processor_k:str):
+        with self._fuzzy_stats_lock:
+            self._fuzzy_stragglers[fuzzy_processor_k] -= 1
+
+    def _run_fuzzy_processor(self, fuzzy_processor_k:str, command:str, context, allow_rest_phrase:bool, started:list = None):
+        time_start = time.monotonic()
+        if started is not None:
+            started[0] = time_start
+        res = None
+        try:
             try:
                 res = self.fuzzy_processors[fuzzy_processor_k][1](self, command, context, allow_rest_phrase)
             except TypeError as e:
                 # старый вариант, где только 3 параметра
-                # print(e)
-                # import traceback
-                # traceback.print_exc()
                 logger.exception(e)
                 res = self.fuzzy_processors[fuzzy_processor_k][1](self, command, context)
-
-            # fuzzy processor должен вернуть либо None либо
-            # (context_key:str,уверенность:float[0:1],rest_phrase:str) для лучшей фразы
-            print("Fuzzy processor {0}, result for '{1}': {2}".format(fuzzy_processor_k, command, res))
-
-            if res is not None:
-                keyall, probability, rest_phrase = res
-                if threshold < probability:
-                    return res
-
-        return None
+        except Exception as e:
+            self._update_fuzzy_stats(fuzzy_processor_k, "errors")
+            logger.exception(e)
+            return None, False
+
+        # fuzzy processor должен вернуть либо None либо
+        # (context_key:str,уверенность:float[0:1],rest_phrase:str) для лучшей фразы
+        logger.debug("Fuzzy processor %s, result for '%s': %s", fuzzy_processor_k, command, res)
+
+        self._update_fuzzy_stats(fuzzy_processor_k, "calls", time.monotonic() - time_start)
+        self.metrics.observe("fuzzy_processor", time.monotonic() - time_start, fuzzy_processor_k)
+        return res, True
+
+    def _update_fuzzy_stats(self, fuzzy_processor_k:str, counter:str, duration:float = None):
+        with self._fuzzy_stats_lock:
+            stats = self.fuzzy_processors_stats.get(fuzzy_processor_k)
+            if stats is None:
+                stats = {"calls": 0, "wins": 0, "timeouts": 0, "errors": 0, "time_total": 0.0, "time_last": 0.0}
+                self.fuzzy_processors_stats[fuzzy_processor_k] = stats
+            stats[counter] += 1
+            if duration is not None:
+                stats["time_total"] += duration
+                stats["time_last"] = duration
 
     def calc_ai_tools_manifest(self):
         res = []
@@ -458,7 +1338,74 @@ class VACore(JaaCore):
         except Exception as e:
             return 500, str(e)
 
-    def execute_next(self,command,context):
+    # ----------- sessions -----------
+    @property
+    def session(self) -> VASession:
+        session = _current_session.get()
+        if session is None:
+            return self.default_session
+        return session
+
+    @contextmanager
+    def use_session(self, session:VASession):
+        # делает session текущей для этого потока / asyncio-задачи
+        token = _current_session.set(session)
+        try:
+            yield session
+        finally:
+            _current_session.reset(token)
+
+    # ----------- async -----------
+    async def run_async(self, func, *args):
+        """
+        Выполняет синхронную функцию ядра (плагины, TTS и пр.) в ограниченном пуле потоков и ждет результат,
+        не блокируя event loop. Текущая сессия передается в поток.
+        """
+        if self.async_executor is None:
+            self.async_executor = ThreadPoolExecutor(max_workers=self.asyncMaxWorkers, thread_name_prefix="vacore")
+        if self._async_semaphore is None:
+            self._async_semaphore = asyncio.Semaphore(self.asyncMaxInflight)
+
+        async with self._async_semaphore:
+            loop = asyncio.get_running_loop()
+            ctx = copy_context()
+            return await loop.run_in_executor(self.async_executor, functools.partial(ctx.run, func, *args))
+
+    async def run_async_session(self, session:VASession, func, *args):
+        """
+        То же, что run_async, но команды одной сессии выполняются по очереди. Очередь - в event loop:
+        несколько запросов одной сессии не занимают потоки пула, ожидая session.lock, и не мешают другим сессиям.
+        """
+        if session.async_lock is None: # создается в потоке event loop - без гонки
+            session.async_lock = asyncio.Lock()
+        async with session.async_lock:
+            return await self.run_async(func, *args)
+
+    async def execute_next_async(self,command,context,session:VASession = None):
+        if session is None:
+            return await self.run_async(self.execute_next, command, context, session)
+        return await self.run_async_session(session, self.execute_next, command, context, session)
+
+    async def run_input_str_async(self,voice_input_str,func_before_run_cmd = None,session:VASession = None):
+        if session is None:
+            return await self.run_async(self.run_input_str, voice_input_str, func_before_run_cmd, session)
+        return await self.run_async_session(session, self.run_input_str, voice_input_str, func_before_run_cmd, session)
+
+    async def play_voice_assistant_speech_async(self,text_to_speech:str,session:VASession = None):
+        if session is None:
+            session = self.session
+
+        def play():
+            with self.use_session(session):
+                self.play_voice_assistant_speech(text_to_speech)
+
+        return await self.run_async_session(session, play)
+
+    def execute_next(self,command,context,session:VASession = None):
+        if session is not None:
+            with session.lock, self.use_session(session):
+                return self.execute_next(command,context)
+
         is_first_call = False
         if context == None: # первый вход
             is_first_call = True
@@ -477,7 +1424,11 @@ class VACore(JaaCore):
         try:
             is_allow_classic_plugins = (not is_first_call) or ("classic" in self.plugin_types)
             if is_allow_classic_plugins:
-                res = self.find_best_cmd_with_fuzzy(command,context,True)
+                speculation = self._take_speculation(command) if is_first_call else None
+                if speculation is not None:
+                    res = speculation.result() # команду уже искали заранее, по промежуточному результату
+                else:
+                    res = self.find_best_cmd_with_fuzzy(command,context,True)
                 if res is not None:
                     keyall, probability, rest_phrase = res
                     next_context = context[keyall]
@@ -485,7 +1436,8 @@ class VACore(JaaCore):
                     return
 
             if is_first_call and ("ai" in self.plugin_types): # разрешены плагины ИИ
-                res_code, res = self.call_ai_tools(command)
+                with self.metrics.span("ai_tool_call"):
+                    res_code, res = self.call_ai_tools(command)
                 logger.info(f"AI tool result code: {res_code}")
                 logger.info(res)
                 # self.say("Вызов успешен!")
@@ -564,6 +1516,36 @@ class VACore(JaaCore):
         except Exception as err:
             logger.exception(err)
 
+    def get_context_trie(self, context:dict) -> CommandTrie:
+        # индекс команд основного словаря строится в process_plugin_manifest,
+        # для остальных словарей-контекстов - при первом использовании
+        if context is self.commands:
+            return self.commands_trie
+        if isinstance(context, ContextIndex):
+            return context.trie
+
+        with self._context_tries_lock:
+            cached = self._context_tries.get(id(context))
+        if cached is not None and cached[0] is context and cached[1] == context.keys():
+            return cached[2]
+
+        trie = CommandTrie(context) # строим вне блокировки
+        with self._context_tries_lock:
+            if id(context) not in self._context_tries and len(self._context_tries) >= 16:
+                self._context_tries.pop(next(iter(self._context_tries)))
+            self._context_tries[id(context)] = (context, frozenset(context.keys()), trie)
+        return trie
+
+    def prepare_context(self, context:dict):
+        # заранее готовим данные fuzzy processors для контекста (третья, необязательная функция в манифесте)
+        for fuzzy_processor_k in self.fuzzy_processors.keys():
+            fuzzy_processor = self.fuzzy_processors[fuzzy_processor_k]
+            if len(fuzzy_processor) > 2 and fuzzy_processor[2] is not None:
+                try:
+                    fuzzy_processor[2](self, context)
+                except Exception as e:
+                    self.print_error("Ошибка подготовки контекста в fuzzy_processor {0}".format(fuzzy_processor_k), e)
+
     # fuzzy util
     def fuzzy_get_command_key_from_context(self, predicted_command:str, context:dict):
         # возвращает ключ в context по одной из распознанных команд внутри
@@ -583,60 +1565,135 @@ class VACore(JaaCore):
         return human_readable_date_local.strftime('%Y-%m-%d %H:%M:%S')
 
     def set_timer(self, duration, timerFuncEnd, timerFuncUpd = None):
-        # print "Start set_timer!"
+        # возвращает id таймера; id не переиспользуются, поэтому clear_timer(id) не заденет чужой таймер
         curtime = time.time()
-        for i in range(len(self.timers)):
-            if self.timers[i] <= 0:
-                # print "Found timer!"
-                self.timers[i] = curtime+duration  #duration
-                self.timersFuncEnd[i] = timerFuncEnd
-                print("New Timer ID =", str(i), ' curtime=', self.util_time_to_readable(curtime), 'duration=', duration, 'endtime=', self.util_time_to_readable(self.timers[i]))
-                return i
-        return -1  # no more timer valid
+        journal_id = None
+        journal = self.get_timers_journal()
+        if journal is not None:
+            journal_id = journal.create(curtime+duration, timerFuncEnd)
+        timer_id = self._add_timer(duration, timerFuncEnd, journal_id)
+        print("New Timer ID =", str(timer_id), ' curtime=', self.util_time_to_readable(curtime), 'duration=', duration, 'endtime=', self.util_time_to_readable(curtime+duration))
+        return timer_id
+
+    def _add_timer(self, duration, timerFuncEnd, journal_id:str = None) -> int:
+        with self._timers_lock:
+            timer_id = next(self._timers_ids)
+            self.timers[timer_id] = self.timers_scheduler.call_later(duration, self._timer_fired, timer_id, timerFuncEnd, journal_id)
+        return timer_id
 
     def clear_timer(self, index, runEndFunc=False):
-        if runEndFunc and self.timersFuncEnd[index] != None:
-            self.call_ext_func(self.timersFuncEnd[index])
-        self.timers[index] = -1
-        self.timersDuration[index] = 0
-        self.timersFuncEnd[index] = None
+        with self._timers_lock:
+            job = self.timers.pop(index, None)
+        if job is None:
+            return
+        job.cancel()
+        if self.timers_journal is not None:
+            self.timers_journal.cancel(job.args[2])
+        if runEndFunc and job.args[1] != None:
+            self.call_ext_func(job.args[1])
 
     def clear_timers(self): # not calling end function
-        for i in range(len(self.timers)):
-            if self.timers[i] >= 0:
-                self.timers[i] = -1
-                self.timersFuncEnd[i] = None
+        with self._timers_lock:
+            jobs = list(self.timers.values())
+            self.timers.clear()
+        for job in jobs:
+            job.cancel()
+            if self.timers_journal is not None:
+                self.timers_journal.cancel(job.args[2])
+
+    def timer_remaining(self, index) -> float:
+        # сколько секунд осталось до срабатывания; None - таймера нет
+        with self._timers_lock:
+            job = self.timers.get(index)
+        return job.remaining() if job is not None else None
 
     def _update_timers(self):
+        # оставлено для совместимости: таймеры срабатывают сами из timers_scheduler, опрашивать их не нужно
+        pass
+
+    def _timer_fired(self, timer_id:int, timerFuncEnd, journal_id:str = None):
+        with self._timers_lock:
+            if self.timers.pop(timer_id, None) is None:
+                return # успели отменить
+        print("End Timer ID =", str(timer_id), ' curtime=', self.util_time_to_readable(time.time()))
+        try:
+            if timerFuncEnd != None:
+                self.call_ext_func(timerFuncEnd)
+        finally:
+            # отмечаем после выполнения: если упадем посреди обработчика, таймер сработает еще раз после перезапуска
+            if self.timers_journal is not None:
+                self.timers_journal.fire(journal_id)
+
+    def get_timers_journal(self) -> TimerJournal:
+        if not self.timersJournal:
+            return None
+        with self._timers_lock:
+            if self.timers_journal is None:
+                journal = TimerJournal(os.path.join(self.tmpdir, "timers_journal.jsonl"), self.scheduler)
+                journal.open()
+                self.timers_journal = journal
+        return self.timers_journal
+
+    def timers_journal_replay(self):
+        # вызывается при запуске долгоживущих сервисов (голос, WEB-API): восстанавливает таймеры из журнала
+        journal = self.get_timers_journal()
+        if journal is None:
+            return
         curtime = time.time()
-        for i in range(len(self.timers)):
-            if(self.timers[i] > 0):
-                if curtime >= self.timers[i]:
-                    print("End Timer ID =", str(i), ' curtime=', self.util_time_to_readable(curtime), 'endtime=', self.util_time_to_readable(self.timers[i]))
-                    self.clear_timer(i,True)
+        for record in sorted(list(journal.pending.values()), key=lambda r: r["deadline"]):
+            funcparam = journal.ref_to_func(record)
+            if funcparam is None:
+                print("Timer from journal skipped, handler not found:", record["plugin"], record["handler"])
+                journal.cancel(record["id"])
+                continue
+            duration = max(0.0, record["deadline"] - curtime)
+            timer_id = self._add_timer(duration, funcparam, record["id"])
+            print("Restored Timer ID =", str(timer_id), 'endtime=', self.util_time_to_readable(record["deadline"]))
 
     # --------- calling functions -----------
 
     def call_ext_func(self,funcparam):
         if isinstance(funcparam,tuple): # funcparam =(func, param)
-            funcparam[0](self,funcparam[1])
+            with self.metrics.span("plugin_handler", self._func_name(funcparam[0])):
+                funcparam[0](self,funcparam[1])
         else: # funcparam = func
-            funcparam(self)
+            with self.metrics.span("plugin_handler", self._func_name(funcparam)):
+                funcparam(self)
 
     def call_ext_func_phrase(self,phrase,funcparam):
         if isinstance(funcparam,tuple): # funcparam =(func, param)
-            funcparam[0](self,phrase,funcparam[1])
+            with self.metrics.span("plugin_handler", self._func_name(funcparam[0])):
+                funcparam[0](self,phrase,funcparam[1])
         else: # funcparam = func
-            funcparam(self,phrase)
+            with self.metrics.span("plugin_handler", self._func_name(funcparam)):
+                funcparam(self,phrase)
+
+    def _func_name(self, func) -> str:
+        return "{0}.{1}".format(str(getattr(func, "__module__", "")).replace("plugins.", ""), getattr(func, "__name__", str(func)))
 
     # ------- play wav from subfolder ----------
     def play_wav(self,wavfile):
-        self.playwavs[self.playWavEngineId][1](self,wavfile)
+        self.engine_wait("playwav")
+        with self.metrics.span("play_wav", self.playWavEngineId):
+            self.playwavs[self.playWavEngineId][1](self,wavfile)
+
+    def play_audio_buffer(self, data, sample_rate:int) -> bool:
+        # проиграть звук из памяти (numpy float32); False - движок проигрывания так не умеет, нужен файл
+        self.engine_wait("playwav")
+        if len(self.playwavs[self.playWavEngineId]) <= 2:
+            return False
+        with self.metrics.span("play_wav", self.playWavEngineId):
+            self.playwavs[self.playWavEngineId][2](self, data, sample_rate)
+        return True
 
 
     # -------- raw txt running -----------------
-    def run_input_str(self,voice_input_str,func_before_run_cmd = None): # voice_input_str - строка распознавания голоса, разделенная пробелами
+    def run_input_str(self,voice_input_str,func_before_run_cmd = None,session:VASession = None): # voice_input_str - строка распознавания голоса, разделенная пробелами
                 # пример: "ирина таймер пять"
+        if session is not None:
+            with session.lock, self.use_session(session):
+                return self.run_input_str(voice_input_str,func_before_run_cmd)
+
         haveRun = False
         if voice_input_str == None:
             return False
@@ -648,34 +1705,27 @@ class VACore(JaaCore):
                 print("Input (in context): ",voice_input_str)
 
         try:
-            voice_input = voice_input_str.split(" ")
-            #callname = voice_input[0]
             haveRun = False
             if self.context == None:
-                for ind in range(len(voice_input)):
-                    callname = voice_input[ind]
-
-                    if callname in self.voiceAssNames: # найдено имя ассистента
-                        self.cur_callname = callname
-                        if self.logPolicy == "cmd":
-                            print("Input (cmd): ",voice_input_str)
+                with self.metrics.span("wake_name"):
+                    callname, command_options = self.find_callname_command(voice_input_str)
+                if callname is not None: # найдено имя ассистента
+                    self.cur_callname = callname
+                    if self.logPolicy == "cmd":
+                        print("Input (cmd): ",voice_input_str)
 
+                    if callname in self.voiceAssNameRunCmd:
+                        print("Modified input, added ", self.voiceAssNameRunCmd.get(callname))
 
-                        command_options = " ".join([str(input_part) for input_part in voice_input[(ind+1):len(voice_input)]])
-                        if callname in self.voiceAssNameRunCmd:
-                            command_options = self.voiceAssNameRunCmd.get(callname)+" "+command_options
-                            print("Modified input, added ", self.voiceAssNameRunCmd.get(callname))
+                    # running some cmd before run cmd
+                    if func_before_run_cmd != None:
+                        func_before_run_cmd()
 
-                        # running some cmd before run cmd
-                        if func_before_run_cmd != None:
-                            func_before_run_cmd()
 
-
-                        #context = self.context
-                        #self.context_clear()
-                        self.execute_next(command_options, None)
-                        haveRun = True
-                        break
+                    #context = self.context
+                    #self.context_clear()
+                    self.execute_next(command_options, None)
+                    haveRun = True
             else:
                 if self.logPolicy == "cmd":
                     print("Input (cmd in context): ",voice_input_str)
@@ -692,6 +1742,81 @@ class VACore(JaaCore):
 
         return haveRun
 
+    def find_callname_command(self, voice_input_str:str):
+        # ищет во фразе имя ассистента; возвращает tuple(имя, команда после имени) или (None, None)
+        voice_input = voice_input_str.split(" ")
+        for ind in range(len(voice_input)):
+            callname = voice_input[ind]
+            if callname in self.voiceAssNames: # найдено имя ассистента
+                command_options = " ".join([str(input_part) for input_part in voice_input[(ind+1):len(voice_input)]])
+                if callname in self.voiceAssNameRunCmd:
+                    command_options = self.voiceAssNameRunCmd.get(callname)+" "+command_options
+                return callname, command_options
+        return None, None
+
+    # -------- speculative resolution on partial results -----------
+    def speculate_input_str(self, partial_str:str, session:VASession = None):
+        """
+        Предварительный поиск команды по промежуточному результату распознавания (например, Vosk PartialResult).
+
+        Если во фразе есть имя ассистента и команда, поиск команды через fuzzy processors запускается заранее,
+        в фоне (команды, которые находятся по дереву команд, находятся мгновенно - для них это не нужно).
+        Когда придет финальный результат: если команда совпала - используется найденное заранее (commit),
+        иначе предварительный результат отбрасывается. Промахом (rollback) считается только отброшенная
+        полная команда - найденная без остатка фразы; фразы, которые еще росли, считаются отдельно (discarded).
+        Сами плагины заранее не вызываются.
+        """
+        if not self.speculativeResolve or partial_str is None or partial_str == "":
+            return
+        if session is None:
+            session = self.session
+        if session.context is not None:
+            return
+
+        callname, command = self.find_callname_command(partial_str)
+        if callname is None or command.strip() == "":
+            return
+        if self.get_context_trie(self.commands).find(command, True) is not None:
+            return # команда (или ее начало) есть в дереве - финальный поиск и так мгновенный
+
+        speculation = session.speculation
+        if speculation is not None:
+            if speculation[0] == command:
+                return # уже ищем эту же команду
+            self._drop_speculation(speculation)
+
+        if self.speculation_executor is None:
+            self.speculation_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="speculation")
+
+        future = self.speculation_executor.submit(self.find_best_cmd_with_fuzzy, command, self.commands, True)
+        session.speculation = (command, future)
+        with self._speculation_lock:
+            self.speculation_stats["started"] += 1
+
+    def _take_speculation(self, command:str):
+        # забирает предварительный результат поиска команды, если он был для этой же команды
+        speculation = self.session.speculation
+        if speculation is None:
+            return None
+        self.session.speculation = None
+        if speculation[0] != command:
+            self._drop_speculation(speculation)
+            return None
+        with self._speculation_lock:
+            self.speculation_stats["committed"] += 1
+        return speculation[1]
+
+    def _drop_speculation(self, speculation):
+        # промах - только если заранее была найдена полная команда (без остатка фразы)
+        command, future = speculation
+        future.cancel()
+        is_complete = False
+        if future.done() and not future.cancelled() and future.exception() is None:
+            res = future.result()
+            is_complete = res is not None and res[2] == ""
+        with self._speculation_lock:
+            self.speculation_stats["rolled_back" if is_complete else "discarded"] += 1
+
     # ------------ context handling functions ----------------
 
     def context_set(self,context,duration = None):
@@ -702,21 +1827,25 @@ class VACore(JaaCore):
 
         self.context = context
         self.contextTimerLastDuration = duration
-        self.contextTimer = Timer(duration,self._context_clear_timer)
+        # срок контекста ведет общий планировщик, без отдельного потока на каждый контекст
+        self.contextTimer = self.scheduler.call_later(duration,self._context_clear_timer,self.session,start=False)
 
         remoteTTSList = self.remoteTTS.split(",")
-        if self.contextRemoteWaitForCall and ("saytxt" in remoteTTSList or "saywav" in remoteTTSList):
-            pass # wait for run context timer
+        if self.contextRemoteWaitForCall and ("saytxt" in remoteTTSList or "saywav" in remoteTTSList or "saywavbin" in remoteTTSList):
+            pass # wait for run context timer - срок будет взведен через contextTimer.start()
         else:
             self.contextTimer.start()
 
 
 
     #def _timer_context
-    def _context_clear_timer(self):
-        print("Context cleared after timeout")
-        self.contextTimer = None
-        self.context_clear()
+    def _context_clear_timer(self, session:VASession):
+        with self.use_session(session):
+            if self.contextTimer is None or not self.contextTimer.fired:
+                return # контекст уже переустановлен или сброшен
+            print("Context cleared after timeout")
+            self.contextTimer = None
+            self.context_clear()
 
     def context_clear(self):
         self.context = None
@@ -786,6 +1915,20 @@ class VACore(JaaCore):
         #     for i in range(101):
         #         f.write(utils.num_to_text_ru.num2text(i)+"\n")
 
+    def print_metrics_summary(self):
+        cprint("Задержки по этапам обработки команд: " + "#" * 43, "blue")
+        print(self.metrics.summary())
+        for engine_id, rtf in self.metrics.ratios("tts_to_buffer", "tts_audio_seconds").items():
+            print("TTS {0}: RTF={1:.3f}".format(engine_id, rtf))
+        if self.tts_cache is not None:
+            print(self.tts_cache.summary())
+        print(self.hot_phrases.summary())
+        if self.tts_workers is not None:
+            print(self.tts_workers.summary())
+        if self.tts_chain is not None:
+            print(self.tts_chain.summary())
+        cprint("#" * 80, "blue")
+
     def format_print_key_list(self, key:str, value:list):
         print(colored(key+": ", "blue")+", ".join(value))
 